@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+変換エンジン・変換モード別のベンチマークスクリプト
+
+使い方:
+    python benchmark_conversion.py [--rows 20000] [--cols 10] [--repeat 5] [--json results.json]
+    python benchmark_conversion.py --pool 4   # 同時変換のスループット（スレッド / ワーカープール）
+"""
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import xlwt
+
+from conversion_utils import convert_xls_to_xlsx_with_stats, parse_schema_hint
+
+# (ラベル, エンジン, 変換オプション)
+MODES = [
+    ('pandas (header)', 'pandas', {}),
+    ('pandas (raw)', 'pandas', {'raw': True}),
+    ('pandas (raw + schema text)', 'pandas', {'schema': parse_schema_hint('text')}),
+    ('native', 'native', {}),
+    ('native (schema text)', 'native', {'schema': parse_schema_hint('text')}),
+]
+
+
+def create_workbook(rows: int, cols: int) -> bytes:
+    """
+    数値・文字列・日付が混在するベンチマーク用XLSを作成
+
+    Args:
+        rows: データ行数（ヘッダー行を除く、XLS の上限 65535 行）
+        cols: 列数
+
+    Returns:
+        XLSファイルのバイナリデータ
+    """
+    date_style = xlwt.easyxf(num_format_str='yyyy-mm-dd')
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('benchmark')
+    for col in range(cols):
+        ws.write(0, col, f'列{col}')
+    for row in range(1, rows + 1):
+        for col in range(cols):
+            kind = col % 3
+            if kind == 0:
+                ws.write(row, col, row * 1.5 + col)
+            elif kind == 1:
+                ws.write(row, col, f'値{row % 500}')
+            else:
+                ws.write(row, col, datetime(2024, 1, 1 + row % 28), date_style)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def run_benchmark(xls_data: bytes, repeat: int) -> list:
+    """
+    各モードで変換を繰り返し、処理時間を計測
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        repeat: 繰り返し回数
+
+    Returns:
+        モードごとの計測結果
+    """
+    results = []
+    for label, engine, options in MODES:
+        durations = []
+        output_size = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            xlsx_data, _ = convert_xls_to_xlsx_with_stats(xls_data, engine, **options)
+            durations.append(time.perf_counter() - start)
+            output_size = len(xlsx_data)
+        results.append({
+            'mode': label,
+            'median_seconds': statistics.median(durations),
+            'min_seconds': min(durations),
+            'output_bytes': output_size,
+        })
+    return results
+
+
+def run_concurrency_benchmark(xls_data: bytes, workers: int, engine: str = 'native') -> list:
+    """
+    同時変換のスループットを、呼び出し元スレッドでの変換とワーカープールで比較
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        workers: 同時変換数（ワーカープールのプロセス数）
+        engine: 変換エンジン
+
+    Returns:
+        方式ごとの計測結果
+    """
+    from worker_pool import ConversionPool
+
+    pool = ConversionPool(workers)
+    try:
+        # ワーカーの起動（ウォームアップ）を計測から除く
+        list(ThreadPoolExecutor(workers).map(lambda _: pool.convert(xls_data, engine), range(workers)))
+        results = []
+        for label, convert in (
+            ('threads', lambda: convert_xls_to_xlsx_with_stats(xls_data, engine)),
+            (f'pool ({workers} processes)', lambda: pool.convert(xls_data, engine)),
+        ):
+            jobs = workers * 2
+            start = time.perf_counter()
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(lambda _: convert(), range(jobs)))
+            elapsed = time.perf_counter() - start
+            results.append({'mode': label, 'jobs': jobs, 'seconds': elapsed, 'jobs_per_second': jobs / elapsed})
+        return results
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='変換エンジン・変換モード別ベンチマーク')
+    parser.add_argument('--rows', type=int, default=20000, help='データ行数')
+    parser.add_argument('--cols', type=int, default=10, help='列数')
+    parser.add_argument('--repeat', type=int, default=5, help='繰り返し回数')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    parser.add_argument('--pool', type=int, help='同時変換数（スレッドとワーカープールのスループットを比較）')
+    args = parser.parse_args()
+
+    print(f"ベンチマーク用XLSを作成中... ({args.rows}行 x {args.cols}列)")
+    xls_data = create_workbook(args.rows, args.cols)
+    print(f"入力サイズ: {len(xls_data):,} bytes\n")
+
+    if args.pool:
+        print(f"{'方式':<30} {'変換数':>8} {'所要時間(秒)':>14} {'変換/秒':>10}")
+        print("-" * 66)
+        for result in run_concurrency_benchmark(xls_data, args.pool):
+            print(f"{result['mode']:<30} {result['jobs']:>8} {result['seconds']:>14.2f} "
+                  f"{result['jobs_per_second']:>10.2f}")
+        return 0
+
+    results = run_benchmark(xls_data, args.repeat)
+
+    print(f"{'モード':<30} {'中央値(秒)':>12} {'最小(秒)':>12} {'出力(bytes)':>14}")
+    print("-" * 72)
+    for result in results:
+        print(
+            f"{result['mode']:<30} {result['median_seconds']:>12.3f} "
+            f"{result['min_seconds']:>12.3f} {result['output_bytes']:>14,}"
+        )
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'timestamp': datetime.now().isoformat(),
+                'rows': args.rows,
+                'cols': args.cols,
+                'input_bytes': len(xls_data),
+                'results': results,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n結果を保存しました: {args.json}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+入力Blobの変換処理モジュール
+Blobトリガー・キュートリガーで共通の「xls-input の Blob を変換して xls-output に保存する」処理を提供
+"""
+import logging
+import threading
+from typing import Callable, Mapping, Tuple
+
+from security_utils import MAX_FILE_SIZE, validate_xls_format, log_security_event
+import checkpoint
+from columnar_writer import FORMAT_XLSX, archive_name
+from conversion_utils import (
+    CACHEABLE_FAILURES,
+    ENGINE_VERSION,
+    FAILURE_INVALID_FORMAT,
+    FAILURE_INVALID_OPTIONS,
+    FAILURE_LIMIT_EXCEEDED,
+    classify_failure,
+    compute_input_hash,
+    compute_output_hash,
+    failure_message,
+    get_default_engine,
+    options_key,
+    parse_blob_options,
+)
+from metrics_registry import CACHE_LOOKUPS, REJECTIONS, STAGE_SECONDS, observe_conversion
+import negative_cache
+import profiling
+import slow_capture
+from single_flight import convert_coalesced
+from storage_utils import INPUT_CONTAINER, OUTPUT_CONTAINER, QUARANTINE_CONTAINER, ensure_container
+import tracing
+import worker_pool
+
+# 処理結果
+OUTCOME_CONVERTED = 'converted'       # 変換して保存
+OUTCOME_SKIPPED = 'skipped'           # 変換済みのためスキップ
+OUTCOME_QUARANTINED = 'quarantined'   # 変換できない入力として隔離
+OUTCOME_IGNORED = 'ignored'           # .xls 以外のため対象外
+OUTCOME_REJECTED = 'rejected'         # シート・行範囲の指定が不正、サイズ上限超過（入力は移動しない）
+OUTCOME_PENDING = 'pending'           # 時間予算内に完了せず途中経過を保存（次の実行で再開）
+
+# 変換・スキップ・隔離件数（プロセス内）
+_stats_lock = threading.Lock()
+_stats = {'converted': 0, 'skipped': 0, 'quarantined': 0, 'pending': 0}
+
+
+def process_input_blob(blob_path: str, read_data: Callable[[], bytes], source_etag: str = None,
+                       metadata: Mapping[str, str] = None, options: dict = None,
+                       size: int = None) -> Tuple[str, str]:
+    """
+    入力Blobを変換して出力コンテナに保存
+
+    Args:
+        blob_path: 入力Blobのパス（"xls-input/<名前>"）
+        read_data: 入力データを返す関数（変換済みでスキップする場合は呼び出さない）
+        source_etag: 入力Blobの ETag（不明な場合は None）
+        metadata: 入力Blobのメタデータ（シート・行範囲・出力形式の指定。parse_blob_options を参照）
+        options: 変換オプション（メタデータ・Blob名の指定より優先）
+        size: 入力Blobのサイズ（バイト）。MAX_FILE_SIZE を超える入力は読み込まずに拒否する
+
+    Returns:
+        (処理結果（OUTCOME_*）, 出力ファイル名（変換・スキップ時）、失敗種別（隔離・拒否時）
+        または進捗 "<変換済みシート数>/<シート数>"（途中経過の保存時）)
+
+    Raises:
+        Exception: 一時的な失敗（Storage エラー・変換の制限時間超過等）。入力起因の失敗は送出せず隔離する
+    """
+    # ファイル名を取得（.xlsを.xlsxに変更）
+    original_name = blob_path.split('/')[-1]
+
+    # .xls以外のファイルはスキップ
+    if not original_name.lower().endswith('.xls'):
+        logging.info(f"Skipping non-XLS file: {original_name}")
+        return OUTCOME_IGNORED, None
+
+    engine = get_default_engine()
+
+    # アップロードSASで直接書き込まれた入力にも HTTP と同じサイズ上限を適用（上限を超える入力は読み込まない）
+    if size is not None and size > MAX_FILE_SIZE:
+        return _reject_too_large(blob_path, size, engine)
+
+    # シート・行範囲・出力形式の指定（指定の誤りは入力を隔離せず、再試行もしない）
+    try:
+        options = {**parse_blob_options(original_name, metadata), **(options or {})}
+    except ValueError as e:
+        logging.error(f"Invalid conversion options for {blob_path}: {str(e)}")
+        _observe(FAILURE_INVALID_OPTIONS, engine)
+        return OUTCOME_REJECTED, FAILURE_INVALID_OPTIONS
+    current_options = options_key(**options)
+    output_name = archive_name(original_name[:-4], options.get('output_format', FORMAT_XLSX))
+
+    # 出力Blobのメタデータを1回の HEAD で取得し、入力の ETag が一致すれば読み込み前にスキップ
+    output_metadata = get_output_metadata(output_name)
+    if is_output_up_to_date(output_metadata, engine, source_etag=source_etag, options=current_options):
+        record_skip(original_name, output_name, 'etag')
+        _observe(OUTCOME_SKIPPED, engine)
+        return OUTCOME_SKIPPED, output_name
+
+    # XLSデータを読み込み
+    with STAGE_SECONDS.time(stage='download'), tracing.start_span('download'):
+        xls_data = read_data()
+    if len(xls_data) > MAX_FILE_SIZE:
+        return _reject_too_large(blob_path, len(xls_data), engine)
+
+    # 同じ内容の再アップロード（ETag のみ変化）もスキップ
+    input_hash = compute_input_hash(xls_data)
+    if is_output_up_to_date(output_metadata, engine, input_hash=input_hash, options=current_options):
+        record_skip(original_name, output_name, 'content hash')
+        _observe(OUTCOME_SKIPPED, engine, xls_data)
+        return OUTCOME_SKIPPED, output_name
+    CACHE_LOOKUPS.inc(cache='output', result='miss')
+    tracing.set_attributes({'xls2xlsx.cache.output': 'miss'})
+
+    # ファイル形式検証（マジックナンバーチェック）
+    is_valid_format, format_error = validate_xls_format(xls_data)
+    if not is_valid_format:
+        log_security_event('invalid_xls_format', {'blob_name': blob_path})
+        logging.error(f"Invalid XLS format detected: {blob_path}")
+        quarantine_blob(blob_path, xls_data, FAILURE_INVALID_FORMAT)
+        _observe(FAILURE_INVALID_FORMAT, engine, xls_data)
+        return OUTCOME_QUARANTINED, FAILURE_INVALID_FORMAT
+
+    # 過去に入力起因で失敗した入力は解析せずに隔離
+    known_failure = negative_cache.lookup(input_hash, options)
+    if known_failure:
+        log_security_event('known_bad_input', {
+            'blob_name': blob_path,
+            'failure_class': known_failure['failure_class']
+        })
+        quarantine_blob(blob_path, xls_data, known_failure['failure_class'])
+        REJECTIONS.inc(reason='known_bad_input')
+        _observe(known_failure['failure_class'], engine, xls_data)
+        return OUTCOME_QUARANTINED, known_failure['failure_class']
+
+    # XLSXに変換（シート数の多いワークブックはシート単位のチェックポイントを保存しながら変換し、
+    # それ以外は同じBlobに対する重複トリガー・メッセージで1回の変換結果を共有）
+    try:
+        result = None
+        if checkpoint.is_enabled(engine, options):
+            with tracing.start_span('convert_resumable', {'xls2xlsx.input.size': len(xls_data)}):
+                result = worker_pool.convert_resumable(xls_data, input_hash, **options)
+        if result is not None:
+            (xlsx_data, stats), coalesced = result, False
+        elif profiling.is_requested(input_hash):
+            xlsx_data, stats = profiling.convert_profiled(xls_data, input_hash, 'blob', engine=engine, **options)
+            coalesced = False
+        else:
+            xlsx_data, stats, coalesced = convert_coalesced(xls_data, engine=engine, input_hash=input_hash, **options)
+    except checkpoint.CheckpointPending as e:
+        with _stats_lock:
+            _stats['pending'] += 1
+        logging.info(f"Checkpointed {blob_path}: {e.completed}/{e.total} sheets converted, resuming later")
+        _observe(OUTCOME_PENDING, engine, xls_data)
+        return OUTCOME_PENDING, f"{e.completed}/{e.total}"
+    except Exception as e:
+        failure_class = classify_failure(e)
+        if not failure_class:
+            raise
+        _observe(failure_class, engine, xls_data)
+        if failure_class in slow_capture.RESOURCE_FAILURES:
+            slow_capture.capture(xls_data, input_hash, 'blob', [failure_class], engine, options=options)
+        if failure_class == FAILURE_INVALID_OPTIONS:
+            logging.error(f"Invalid conversion options for {blob_path}: {str(e)}")
+            return OUTCOME_REJECTED, failure_class
+        logging.error(f"XLS input error ({failure_class}) in {blob_path}: {str(e)}")
+        log_security_event(failure_class, {'blob_name': blob_path, 'error': str(e)})
+        if failure_class not in CACHEABLE_FAILURES:
+            # 制限時間の超過はインスタンスの負荷でも発生するため、隔離せずランタイム・キューの再試行に任せる
+            raise
+        # 入力起因の失敗は再試行しても成功しないため、例外を送出せず隔離する
+        negative_cache.record(input_hash, failure_class, failure_message(failure_class, e), options)
+        quarantine_blob(blob_path, xls_data, failure_class)
+        return OUTCOME_QUARANTINED, failure_class
+    if coalesced:
+        logging.info(f"Reused in-flight conversion result for {original_name}")
+    elif result is None:
+        slow_capture.capture_if_slow(xls_data, input_hash, 'blob', stats, options)
+
+    # 出力コンテナに保存（入力の ETag・ハッシュ・エンジンバージョンを記録）
+    with STAGE_SECONDS.time(stage='upload'), tracing.start_span('upload'):
+        save_to_output_container(xlsx_data, output_name, metadata={
+            'source_etag': source_etag or '',
+            'source_sha256': input_hash,
+            'content_sha256': compute_output_hash(xlsx_data),
+            'engine': engine,
+            'engine_version': ENGINE_VERSION,
+            'options_key': current_options,
+            **tracing.inject(),
+        })
+    if result is not None:
+        # 途中経過は出力の保存後に削除（保存に失敗した再試行では組み立てからやり直す）
+        checkpoint.discard(input_hash, **options)
+    with _stats_lock:
+        _stats['converted'] += 1
+    _observe(OUTCOME_CONVERTED, stats['engine'], xls_data, xlsx_data, stats, coalesced)
+
+    logging.info(
+        f"Successfully converted {original_name} to {output_name} "
+        f"(trimmed cells: {stats['trimmed_cells']})"
+    )
+    return OUTCOME_CONVERTED, output_name
+
+
+def _reject_too_large(blob_path: str, size: int, engine: str) -> Tuple[str, str]:
+    """サイズ上限を超える入力を変換せずに拒否（入力Blobは移動しない）"""
+    logging.error(f"Input blob too large ({size} bytes, max {MAX_FILE_SIZE}): {blob_path}")
+    log_security_event('file_too_large', {'blob_name': blob_path, 'file_size': size})
+    REJECTIONS.inc(reason='file_too_large')
+    _observe(FAILURE_LIMIT_EXCEEDED, engine)
+    return OUTCOME_REJECTED, FAILURE_LIMIT_EXCEEDED
+
+
+def get_output_metadata(filename: str):
+    """
+    出力Blobのメタデータを取得（HEAD リクエスト1回）
+
+    Args:
+        filename: 出力ファイル名
+
+    Returns:
+        メタデータ（出力Blobが存在しない・取得できない場合は None）
+    """
+    try:
+        blob_client = ensure_container(OUTPUT_CONTAINER).get_blob_client(filename)
+        return blob_client.get_blob_properties().metadata or {}
+    except Exception as e:
+        # 未作成（404）を含め、取得できない場合は変換を行う
+        logging.debug(f"Output metadata unavailable for {filename}: {str(e)}")
+        return None
+
+
+def is_output_up_to_date(metadata, engine: str, source_etag: str = None, input_hash: str = None,
+                         options: str = '') -> bool:
+    """
+    出力Blobが現在の入力・エンジンから変換済みかを判定
+
+    Args:
+        metadata: 出力Blobのメタデータ（get_output_metadata）
+        engine: 使用する変換エンジン
+        source_etag: 入力Blobの ETag
+        input_hash: 入力データの SHA-256
+        options: 変換オプションのキー（conversion_utils.options_key）
+
+    Returns:
+        ETag またはハッシュが一致し、エンジン・エンジンバージョン・変換オプションも一致する場合 True
+    """
+    if not metadata:
+        return False
+    if metadata.get('engine') != engine or metadata.get('engine_version') != ENGINE_VERSION:
+        return False
+    if metadata.get('options_key', '') != options:
+        return False
+    if source_etag and metadata.get('source_etag') == source_etag:
+        return True
+    return bool(input_hash) and metadata.get('source_sha256') == input_hash
+
+
+def _observe(outcome: str, engine: str, xls_data: bytes = None, output: bytes = None,
+             stats: dict = None, coalesced: bool = False):
+    """処理結果をメトリクスに記録（outcome は OUTCOME_* または失敗種別）"""
+    observe_conversion('blob', outcome, engine, len(xls_data) if xls_data is not None else None,
+                       output, stats, coalesced)
+
+
+def record_skip(original_name: str, output_name: str, reason: str):
+    """変換済みのためスキップした件数を記録"""
+    CACHE_LOOKUPS.inc(cache='output', result='hit')
+    tracing.set_attributes({'xls2xlsx.cache.output': 'hit', 'xls2xlsx.skip_reason': reason})
+    with _stats_lock:
+        _stats['skipped'] += 1
+        skipped = _stats['skipped']
+    logging.info(
+        f"Skipping {original_name}: {OUTPUT_CONTAINER}/{output_name} is up to date ({reason}, "
+        f"skipped in this worker: {skipped})"
+    )
+
+
+def quarantine_blob(blob_path: str, data: bytes, failure_class: str):
+    """
+    変換できない入力Blobを隔離コンテナに移動（再トリガー・再試行を防止）
+
+    Args:
+        blob_path: トリガー元のパス（"xls-input/<名前>"）
+        data: 入力Blobのデータ
+        failure_class: 失敗種別
+    """
+    blob_name = blob_path.split('/', 1)[1] if blob_path.startswith(f"{INPUT_CONTAINER}/") else blob_path
+    try:
+        with tracing.start_span('quarantine', {'xls2xlsx.failure_class': failure_class}):
+            ensure_container(QUARANTINE_CONTAINER).upload_blob(
+                blob_name,
+                data,
+                overwrite=True,
+                metadata={
+                    'failure_class': failure_class,
+                    'source_sha256': compute_input_hash(data),
+                    'engine_version': ENGINE_VERSION,
+                }
+            )
+            ensure_container(INPUT_CONTAINER).get_blob_client(blob_name).delete_blob()
+    except Exception as e:
+        # 隔離に失敗しても入力起因のエラーは再試行しない（ネガティブキャッシュで即時拒否される）
+        logging.warning(f"隔離コンテナへの移動エラー: {str(e)}")
+        return
+
+    with _stats_lock:
+        _stats['quarantined'] += 1
+    logging.warning(f"Moved {blob_path} to {QUARANTINE_CONTAINER}/{blob_name} ({failure_class})")
+
+
+def get_stats() -> dict:
+    """プロセス内の変換・スキップ・隔離件数を返す"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def save_to_output_container(data: bytes, filename: str, metadata: dict = None):
+    """
+    出力コンテナにファイルを保存
+
+    Args:
+        data: ファイルのバイナリデータ
+        filename: 保存するファイル名
+        metadata: Blobメタデータ
+    """
+    # プロセス内で共有するクライアント（接続プール）を使用
+    container_client = ensure_container(OUTPUT_CONTAINER)
+
+    # 出力コンテナにアップロード
+    # 大きな出力はブロック単位で並列にアップロード
+    container_client.upload_blob(filename, data, overwrite=True, metadata=metadata, max_concurrency=4)
+    logging.info(f"Saved to {OUTPUT_CONTAINER}/{filename}")
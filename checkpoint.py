@@ -0,0 +1,292 @@
+"""
+シート単位のチェックポイントによる再開可能な変換モジュール
+シート数の多いワークブックを時間予算ごとの複数回の実行に分けて変換する
+
+- 1シート変換するごとに、ワークシートパーツ（XML）と共有文字列テーブルの追加分、
+  進捗（完了シート数・シート統計）を xls-checkpoints コンテナに保存する
+- 時間予算（CHECKPOINT_STEP_SECONDS）を使い切ると CheckpointPending を送出し、
+  再試行・キューで連鎖した次の実行が最後に完了したシートの次から再開する
+- 全シートの完了後、保存済みのパーツを順に読み込んで XLSX を組み立てる
+
+スタイルは固定の styles.xml（日付・日時の2種類）を使用するため、
+シート間で引き継ぐ状態は共有文字列テーブルと日付モードのみ
+"""
+import json
+import logging
+import os
+import time
+import zlib
+from typing import List, Tuple
+
+from conversion_utils import (
+    ENGINE_NATIVE,
+    MAX_SHEETS,
+    classify_failure,
+    conversion_key,
+    native_sheet_stats,
+)
+from columnar_writer import FORMAT_XLSX
+from sheet_model import (
+    InputLimitError,
+    SharedStrings,
+    build_sparse_sheet,
+    open_xls_book,
+    select_sheet_indices,
+)
+from xlsx_writer import assemble_xlsx, iter_sheet_xml
+
+# チェックポイントの形式バージョン（形式を変更した場合は既存の途中経過を使用しない）
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointPending(Exception):
+    """
+    時間予算内に全シートを変換できなかった（途中経過は保存済み）
+
+    Attributes:
+        completed: 変換済みのシート数
+        total: 変換対象のシート数
+    """
+
+    def __init__(self, completed: int, total: int):
+        super().__init__(f"{completed}/{total} sheets converted")
+        self.completed = completed
+        self.total = total
+
+    def __reduce__(self):
+        # 変換ワーカーから親プロセスに送る（pickle）際に completed / total を引き継ぐ
+        return CheckpointPending, (self.completed, self.total)
+
+
+def get_min_sheets() -> int:
+    """チェックポイントを使用する最小シート数（CHECKPOINT_MIN_SHEETS、既定: 0 = 無効）"""
+    try:
+        return max(0, int(os.environ.get('CHECKPOINT_MIN_SHEETS', '0')))
+    except ValueError:
+        return 0
+
+
+def get_step_seconds() -> float:
+    """1回の実行で変換に使う時間予算（CHECKPOINT_STEP_SECONDS、既定: 180秒）"""
+    try:
+        return float(os.environ.get('CHECKPOINT_STEP_SECONDS', '180'))
+    except ValueError:
+        return 180.0
+
+
+def is_enabled(engine: str, options: dict) -> bool:
+    """
+    チェックポイントによる変換の対象かを判定
+
+    native エンジンの XLSX 出力のみ対象（pandas エンジン・列指向形式はシート単位の
+    パーツに分割できないため、従来どおり1回で変換する）
+    """
+    return (
+        get_min_sheets() > 0
+        and engine == ENGINE_NATIVE
+        and options.get('output_format', FORMAT_XLSX) == FORMAT_XLSX
+    )
+
+
+def convert_resumable(xls_data: bytes, input_hash: str, schema: dict = None, sheets: List[str] = None,
+                      rows: Tuple[int, int] = None, store=None, time_budget: float = None, **_options):
+    """
+    シート単位のチェックポイントを保存しながら native エンジンで XLSX に変換
+
+    同じ入力・変換オプションの途中経過があれば、最後に完了したシートの次から再開する。
+    変換対象のシート数が CHECKPOINT_MIN_SHEETS 未満の場合は何もせず None を返す
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        input_hash: 入力データのハッシュ（compute_input_hash）
+        schema: スキーマヒント
+        sheets: 変換するシート（None は全シート）
+        rows: 各シートで変換する行範囲
+        store: 途中経過の保存先（省略時は xls-checkpoints の BlobCheckpointStore）
+        time_budget: この実行で新しいシートの変換を開始してよい時間（秒、省略時は CHECKPOINT_STEP_SECONDS）
+
+    Returns:
+        (XLSXファイルのバイナリデータ, 変換統計)。対象外の場合は None
+
+    Raises:
+        CheckpointPending: 時間予算を使い切った（次の実行で再開する）
+        InputLimitError: シート数制限超過
+        SheetSelectionError: 存在しないシートの指定
+        xlrd.XLRDError: XLS解析エラー
+    """
+    key = checkpoint_key(input_hash, schema=schema, sheets=sheets, rows=rows)
+    deadline = time.monotonic() + (get_step_seconds() if time_budget is None else time_budget)
+
+    book = open_xls_book(xls_data)
+    try:
+        indices = select_sheet_indices(book.sheet_names(), sheets)
+        if len(indices) > MAX_SHEETS:
+            raise InputLimitError(f"シート数が多すぎます（最大{MAX_SHEETS}シート）")
+        if len(indices) < get_min_sheets():
+            return None
+
+        store = store or BlobCheckpointStore(key)
+        state = store.load_state()
+        if not state or state.get('version') != CHECKPOINT_VERSION or state.get('total') != len(indices):
+            state = {'version': CHECKPOINT_VERSION, 'total': len(indices), 'completed': 0,
+                     'datemode': book.datemode, 'sst_refs': 0, 'sheets': []}
+        sst = _restore_shared_strings(store, state)
+
+        start = state['completed']
+        if start:
+            logging.info(f"Resuming checkpointed conversion at sheet {start + 1}/{len(indices)}")
+        try:
+            for position in range(start, len(indices)):
+                # 1回の実行で少なくとも1シートは進める
+                if position > start and time.monotonic() >= deadline:
+                    raise CheckpointPending(position, len(indices))
+                string_count = len(sst)
+                sheet = build_sparse_sheet(book.sheet_by_index(indices[position]), sst,
+                                           schema=schema, row_range=rows)
+                book.unload_sheet(indices[position])
+                store.save_sheet(position, _compress_sheet(sheet), sst.strings[string_count:])
+                state['completed'] = position + 1
+                state['sst_refs'] = sst.ref_count
+                state['sheets'].extend(native_sheet_stats([sheet]))
+                if not store.save_state(state):
+                    # 同じ変換を別の実行が先に進めた場合はそちらに任せる
+                    raise CheckpointPending(position + 1, len(indices))
+        except Exception as e:
+            if classify_failure(e):
+                # 入力起因の失敗は再開しても成功しないため途中経過を破棄
+                store.discard()
+            raise
+    finally:
+        book.release_resources()
+
+    sheet_stats = state['sheets']
+    xlsx_data = assemble_xlsx(
+        [sheet['name'] for sheet in sheet_stats],
+        ([store.load_sheet(position)] for position in range(len(sheet_stats))),
+        sst,
+        state['datemode'],
+    )
+    stats = {
+        'engine': ENGINE_NATIVE,
+        'format': FORMAT_XLSX,
+        'raw': True,
+        'sheets': sheet_stats,
+        'trimmed_cells': sum(sheet['trimmed_cells'] for sheet in sheet_stats),
+    }
+    return xlsx_data, stats
+
+
+def checkpoint_key(input_hash: str, schema: dict = None, sheets: List[str] = None,
+                   rows: Tuple[int, int] = None, **_options) -> str:
+    """途中経過を識別するキー（native エンジンの変換キー）"""
+    return conversion_key(input_hash, ENGINE_NATIVE, schema=schema, sheets=sheets, rows=rows)
+
+
+def discard(input_hash: str, **options):
+    """
+    変換の途中経過を削除（出力の保存後に呼び出す）
+
+    Args:
+        input_hash: 入力データのハッシュ
+        **options: 変換オプション（convert_resumable に渡したもの）
+    """
+    BlobCheckpointStore(checkpoint_key(input_hash, **options)).discard()
+
+
+def _compress_sheet(sheet) -> bytes:
+    """ワークシート XML を生成して圧縮"""
+    compressor = zlib.compressobj(6)
+    parts = [compressor.compress(chunk.encode('utf-8')) for chunk in iter_sheet_xml(sheet)]
+    parts.append(compressor.flush())
+    return b''.join(parts)
+
+
+def _restore_shared_strings(store, state: dict) -> SharedStrings:
+    """保存済みのシートごとの追加分から共有文字列テーブルを復元"""
+    sst = SharedStrings()
+    for position in range(state['completed']):
+        for value in store.load_strings(position):
+            sst.intern(value)
+    sst.ref_count = state['sst_refs']
+    return sst
+
+
+class BlobCheckpointStore:
+    """
+    途中経過を xls-checkpoints コンテナに保存する
+
+    Blob 構成（<key> は変換キー）:
+    - <key>/state.json: 進捗（完了シート数・日付モード・共有文字列の参照数・シート統計）
+    - <key>/sheets/<番号>.xml.z: ワークシート XML（zlib 圧縮）
+    - <key>/strings/<番号>.json: そのシートで追加された共有文字列
+
+    state.json は ETag の条件付き書き込みで更新し、同じ変換の並行実行で進捗が戻らないようにする
+    """
+
+    def __init__(self, key: str):
+        from storage_utils import CHECKPOINT_CONTAINER, ensure_container
+
+        self._prefix = f"{key}/"
+        self._container = ensure_container(CHECKPOINT_CONTAINER)
+        self._state_etag = None
+
+    def load_state(self):
+        """進捗を取得（未保存の場合は None）"""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            downloader = self._container.get_blob_client(f"{self._prefix}state.json").download_blob()
+        except ResourceNotFoundError:
+            return None
+        self._state_etag = downloader.properties.etag
+        return json.loads(downloader.readall())
+
+    def save_state(self, state: dict) -> bool:
+        """
+        進捗を保存
+
+        Returns:
+            保存した場合 True（読み込み後に別の実行が更新していた場合は False）
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+
+        blob_client = self._container.get_blob_client(f"{self._prefix}state.json")
+        data = json.dumps(state, ensure_ascii=False).encode('utf-8')
+        try:
+            if self._state_etag is None:
+                result = blob_client.upload_blob(data, overwrite=False)
+            else:
+                result = blob_client.upload_blob(data, overwrite=True, etag=self._state_etag,
+                                                 match_condition=MatchConditions.IfNotModified)
+        except (ResourceExistsError, ResourceModifiedError):
+            return False
+        self._state_etag = result.get('etag')
+        return True
+
+    def save_sheet(self, position: int, sheet_xml: bytes, strings: List[str]):
+        """シートのワークシート XML（圧縮済み）と追加された共有文字列を保存"""
+        self._container.upload_blob(f"{self._prefix}sheets/{position:05d}.xml.z", sheet_xml,
+                                    overwrite=True)
+        self._container.upload_blob(f"{self._prefix}strings/{position:05d}.json",
+                                    json.dumps(strings, ensure_ascii=False).encode('utf-8'),
+                                    overwrite=True)
+
+    def load_sheet(self, position: int) -> bytes:
+        """ワークシート XML を取得（展開済み）"""
+        blob_client = self._container.get_blob_client(f"{self._prefix}sheets/{position:05d}.xml.z")
+        return zlib.decompress(blob_client.download_blob().readall())
+
+    def load_strings(self, position: int) -> List[str]:
+        """シートで追加された共有文字列を取得"""
+        blob_client = self._container.get_blob_client(f"{self._prefix}strings/{position:05d}.json")
+        return json.loads(blob_client.download_blob().readall())
+
+    def discard(self):
+        """途中経過をすべて削除"""
+        try:
+            for blob in self._container.list_blobs(name_starts_with=self._prefix):
+                self._container.delete_blob(blob.name)
+        except Exception as e:
+            # 削除できなかった途中経過はライフサイクル管理ポリシー等で削除する
+            logging.warning(f"チェックポイントの削除エラー: {str(e)}")
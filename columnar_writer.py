@@ -0,0 +1,268 @@
+"""
+中間表現（sheet_model）から列指向形式（Parquet / Arrow IPC）・CSV を書き出すモジュール
+XLSX と同じ読み込み処理（型別の列チャンク）を使い、シートごとに1ファイルを ZIP にまとめる
+
+Parquet / Arrow IPC は pyarrow を使用する（使用時のみ読み込む）
+"""
+import csv
+import io
+import zipfile
+from typing import List, Tuple
+
+import xlrd
+
+from sheet_model import (
+    KIND_BOOL,
+    KIND_DATE,
+    KIND_ERROR,
+    KIND_NUMBER,
+    KIND_TEXT,
+    SharedStrings,
+    SparseSheet,
+)
+from xlsx_writer import ERROR_TEXTS, column_letter, format_number, unique_sheet_names, zip_entry
+
+# 出力形式
+FORMAT_XLSX = 'xlsx'
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+OUTPUT_FORMATS = (FORMAT_XLSX, FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW)
+
+# 出力形式 → シートごとのファイルの拡張子
+FILE_EXTENSIONS = {
+    FORMAT_CSV: 'csv',
+    FORMAT_PARQUET: 'parquet',
+    FORMAT_ARROW: 'arrow',
+}
+
+# Accept ヘッダーのメディアタイプ → 出力形式
+# CSV はシートごとのファイルを ZIP にまとめて返すため application/zip のみ（text/csv は 406）
+MEDIA_TYPES = {
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': FORMAT_XLSX,
+    'application/zip': FORMAT_CSV,
+    'application/vnd.apache.parquet': FORMAT_PARQUET,
+    'application/x-parquet': FORMAT_PARQUET,
+    'application/vnd.apache.arrow.file': FORMAT_ARROW,
+    'application/vnd.apache.arrow.stream': FORMAT_ARROW,
+}
+
+
+class OutputFormatUnavailable(RuntimeError):
+    """出力形式に必要なライブラリ（pyarrow）がインストールされていない"""
+
+
+class NotAcceptable(ValueError):
+    """Accept ヘッダーのメディアタイプでは応答できない（text/csv 等）"""
+
+
+def archive_name(base_name: str, output_format: str) -> str:
+    """
+    出力ファイル名を返す（XLSX 以外はシートごとのファイルをまとめた ZIP）
+
+    Args:
+        base_name: 拡張子を除いたファイル名
+        output_format: 出力形式
+
+    Returns:
+        ファイル名（例: "report.xlsx"、"report.parquet.zip"）
+    """
+    if output_format == FORMAT_XLSX:
+        return f"{base_name}.xlsx"
+    return f"{base_name}.{FILE_EXTENSIONS[output_format]}.zip"
+
+
+def sheet_file_names(sheets: List[SparseSheet], output_format: str) -> List[str]:
+    """
+    ZIP 内のシートごとのファイル名一覧を返す（シート名の重複・パス区切りを除去）
+    """
+    extension = FILE_EXTENSIONS[output_format]
+    return [
+        f"{name.replace('/', '_').replace(chr(92), '_')}.{extension}"
+        for name in unique_sheet_names(sheets)
+    ]
+
+
+def cell_text(kind: int, value, sst: SharedStrings, datemode: int = 0) -> str:
+    """
+    セルを文字列表現に変換（CSV・型が混在する列用）
+
+    日付は ISO 8601（時刻が 0 の場合は日付のみ）、真偽値は TRUE / FALSE
+    """
+    if kind == KIND_TEXT:
+        return sst[value]
+    if kind == KIND_NUMBER:
+        return format_number(value)
+    if kind == KIND_BOOL:
+        return 'TRUE' if value else 'FALSE'
+    if kind == KIND_DATE:
+        moment = _cell_datetime(value, datemode)
+        return moment.date().isoformat() if value.is_integer() else moment.isoformat()
+    if kind == KIND_ERROR:
+        return ERROR_TEXTS.get(int(value), '#N/A')
+    return ''
+
+
+def _cell_datetime(value: float, datemode: int):
+    """日付シリアル値を datetime に変換"""
+    return xlrd.xldate_as_datetime(value, datemode)
+
+
+def iter_csv_rows(sheet: SparseSheet, sst: SharedStrings, datemode: int = 0):
+    """
+    シートを CSV の行（文字列のリスト）として行順に返す（空行も出力する）
+    """
+    next_row = 0
+    for row, cells in sheet.iter_rows():
+        while next_row < row:
+            yield []
+            next_row += 1
+        values = [''] * (cells[-1][0] + 1)
+        for col, kind, value in cells:
+            values[col] = cell_text(kind, value, sst, datemode)
+        yield values
+        next_row = row + 1
+
+
+def write_csv_archive(sheets: List[SparseSheet], sst: SharedStrings, datemode: int = 0) -> bytes:
+    """
+    シートごとの CSV（UTF-8、CRLF 区切り）を ZIP にまとめて書き出す
+
+    各シートは行単位で ZIP エントリにストリーム出力する
+
+    Args:
+        sheets: シート一覧
+        sst: 共有文字列テーブル
+        datemode: 日付モード（0: 1900年, 1: 1904年）
+
+    Returns:
+        ZIP ファイルのバイナリデータ
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for sheet, name in zip(sheets, sheet_file_names(sheets, FORMAT_CSV)):
+            with zf.open(zip_entry(name), 'w') as entry:
+                text = io.TextIOWrapper(io.BufferedWriter(entry, buffer_size=256 * 1024),
+                                        encoding='utf-8', newline='')
+                csv.writer(text).writerows(iter_csv_rows(sheet, sst, datemode))
+                text.flush()
+                text.detach().flush()
+    return buffer.getvalue()
+
+
+def write_arrow_archive(sheets: List[SparseSheet], sst: SharedStrings, datemode: int = 0,
+                        output_format: str = FORMAT_PARQUET, header: bool = True) -> bytes:
+    """
+    シートごとの Parquet / Arrow IPC ファイルを ZIP にまとめて書き出す
+
+    列の型はセル種別から決定する（数値のみ: float64、日付のみ: timestamp、
+    真偽値のみ: bool、それ以外: string）。空セルは null
+
+    Args:
+        sheets: シート一覧
+        sst: 共有文字列テーブル
+        datemode: 日付モード（0: 1900年, 1: 1904年）
+        output_format: FORMAT_PARQUET または FORMAT_ARROW
+        header: 1行目を列名として扱う（False の場合は列記号 A, B, ... を列名にする）
+
+    Returns:
+        ZIP ファイルのバイナリデータ
+
+    Raises:
+        OutputFormatUnavailable: pyarrow がインストールされていない
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise OutputFormatUnavailable(f"{output_format} 形式の出力には pyarrow が必要です")
+
+    buffer = io.BytesIO()
+    # Parquet・Arrow IPC は圧縮済みのため ZIP では圧縮しない
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for sheet, name in zip(sheets, sheet_file_names(sheets, output_format)):
+            table = arrow_table(pa, sheet, sst, datemode, header)
+            sink = pa.BufferOutputStream()
+            if output_format == FORMAT_PARQUET:
+                pa.parquet.write_table(table, sink, compression='zstd')
+            else:
+                with pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+                    writer.write_table(table)
+            zf.writestr(zip_entry(name, zipfile.ZIP_STORED), sink.getvalue().to_pybytes())
+    return buffer.getvalue()
+
+
+def arrow_table(pa, sheet: SparseSheet, sst: SharedStrings, datemode: int = 0, header: bool = True):
+    """
+    シートを pyarrow.Table に変換
+
+    Args:
+        pa: pyarrow モジュール
+        sheet: 中間表現のシート
+        sst: 共有文字列テーブル
+        datemode: 日付モード
+        header: 1行目を列名として扱う
+
+    Returns:
+        pyarrow.Table
+    """
+    start = 1 if header else 0
+    nrows = max(sheet.nrows - start, 0)
+    names = []
+    arrays = []
+    for col in range(sheet.ncols):
+        chunk = sheet.columns.get(col)
+        cells = list(chunk) if chunk is not None else []
+        title = None
+        if header and cells and cells[0][0] == 0:
+            _, kind, value = cells.pop(0)
+            title = cell_text(kind, value, sst, datemode)
+        names.append(title or column_letter(col))
+        arrays.append(_column_array(pa, chunk, cells, nrows, start, sst, datemode))
+    return pa.table(arrays, names=_unique_names(names))
+
+
+def _column_array(pa, chunk, cells: List[Tuple[int, int, object]], nrows: int, start: int,
+                  sst: SharedStrings, datemode: int):
+    """
+    1列分のセルを pyarrow.Array に変換
+    """
+    kinds = {kind for _, kind, _ in cells}
+    if kinds == {KIND_NUMBER} and len(cells) == nrows and len(chunk.numbers) == nrows:
+        # 欠損のない数値列は列チャンクの float64 バッファをコピーせずに使用
+        return pa.Array.from_buffers(pa.float64(), nrows, [None, pa.py_buffer(chunk.numbers)])
+
+    values = [None] * nrows
+    if kinds == {KIND_NUMBER}:
+        arrow_type = pa.float64()
+        for row, _, value in cells:
+            values[row - start] = value
+    elif kinds == {KIND_BOOL}:
+        arrow_type = pa.bool_()
+        for row, _, value in cells:
+            values[row - start] = value
+    elif kinds == {KIND_DATE}:
+        arrow_type = pa.timestamp('ms')
+        for row, _, value in cells:
+            values[row - start] = _cell_datetime(value, datemode)
+    else:
+        arrow_type = pa.string()
+        for row, kind, value in cells:
+            values[row - start] = cell_text(kind, value, sst, datemode)
+    return pa.array(values, type=arrow_type)
+
+
+def _unique_names(names: List[str]) -> List[str]:
+    """重複する列名に連番を付ける"""
+    seen = set()
+    result = []
+    for name in names:
+        unique = name
+        suffix = 1
+        while unique in seen:
+            suffix += 1
+            unique = f"{name}_{suffix}"
+        seen.add(unique)
+        result.append(unique)
+    return result
@@ -0,0 +1,781 @@
+"""
+XLS→XLSX変換ユーティリティモジュール
+HTTPトリガー・Blobトリガーで共通の変換処理を提供
+"""
+import io
+import os
+import json
+import hashlib
+import logging
+import sys
+import time
+from typing import List, Mapping, Tuple
+from urllib.parse import unquote
+
+import xlrd
+
+from sheet_model import (
+    SCHEMA_TYPES,
+    InputLimitError,
+    SheetSelectionError,
+    TYPE_BOOL,
+    TYPE_NUMBER,
+    TYPE_TEXT,
+    clip_extent,
+    data_extent,
+    declared_extent,
+    load_sparse_workbook,
+    open_xls_book,
+    select_sheet_indices,
+)
+from columnar_writer import (
+    FORMAT_ARROW,
+    FORMAT_CSV,
+    FORMAT_PARQUET,
+    FORMAT_XLSX,
+    MEDIA_TYPES,
+    OUTPUT_FORMATS,
+    NotAcceptable,
+    write_arrow_archive,
+    write_csv_archive,
+)
+from xlsx_writer import is_deterministic, normalize_package, write_xlsx
+
+# 変換エンジン
+ENGINE_PANDAS = 'pandas'   # pandas DataFrame 経由（従来方式）
+ENGINE_NATIVE = 'native'   # スパース中間表現から直接書き出し
+SUPPORTED_ENGINES = (ENGINE_PANDAS, ENGINE_NATIVE)
+
+# 変換結果に影響する変更を行った場合に更新（変換キー・出力メタデータに含める）
+# 2: ZIP エントリの日時・docProps の日時を固定した決定的な出力
+ENGINE_VERSION = '2'
+
+# シート数上限（異常に多いシートは拒否）
+MAX_SHEETS = 100
+
+# 入力起因の失敗種別
+FAILURE_INVALID_FORMAT = 'invalid_format'     # マジックナンバー不一致
+FAILURE_PARSE_ERROR = 'parse_error'           # XLS 解析エラー
+FAILURE_LIMIT_EXCEEDED = 'limit_exceeded'     # シート数等の上限超過
+FAILURE_INVALID_OPTIONS = 'invalid_options'   # 存在しないシートの指定等
+FAILURE_MEMORY_LIMIT = 'memory_limit'         # 変換ワーカーのメモリ上限超過
+FAILURE_CPU_LIMIT = 'cpu_limit'               # 変換ワーカーの CPU 時間上限超過
+FAILURE_TIMEOUT = 'timeout'                   # 変換の制限時間（経過時間）超過
+
+# ネガティブキャッシュに記録する失敗種別（変換オプション単位で記録し、シート・行範囲を変えた再送は
+# 拒否しない。negative_cache を参照）
+# FAILURE_INVALID_OPTIONS は指定の誤りで入力の性質ではないため、
+# FAILURE_TIMEOUT はインスタンスの負荷でも発生するため記録しない
+CACHEABLE_FAILURES = (FAILURE_PARSE_ERROR, FAILURE_LIMIT_EXCEEDED, FAILURE_MEMORY_LIMIT, FAILURE_CPU_LIMIT)
+
+# 失敗種別 → HTTP ステータス（記載の無い種別は 400）
+FAILURE_STATUS = {
+    FAILURE_MEMORY_LIMIT: 413,
+    FAILURE_CPU_LIMIT: 422,
+    FAILURE_TIMEOUT: 422,
+}
+
+# Blob名で変換オプションを指定する区切り（例: report@sheets=Sales,2@rows=1-100.xls）
+BLOB_OPTION_SEPARATOR = '@'
+
+_BLOB_OPTION_NAMES = ('sheets', 'rows', 'format')
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class ResourceLimitExceeded(RuntimeError):
+    """変換ワーカーのリソース上限を超えた（異常に大きい・重い入力）"""
+    failure_class = None
+
+
+class MemoryLimitExceeded(ResourceLimitExceeded):
+    """変換ワーカーのメモリ（アドレス空間）上限を超えた"""
+    failure_class = FAILURE_MEMORY_LIMIT
+
+
+class CpuLimitExceeded(ResourceLimitExceeded):
+    """変換ワーカーの1件あたりの CPU 時間上限を超えた"""
+    failure_class = FAILURE_CPU_LIMIT
+
+
+def is_parse_error(error: Exception) -> bool:
+    """
+    XLS の解析エラー（入力ファイル起因のエラー）かどうかを判定
+
+    pandas は読み込み済みの場合のみ判定対象とする（判定のために import しない）
+
+    Args:
+        error: 例外オブジェクト
+
+    Returns:
+        解析エラーの場合 True
+    """
+    if isinstance(error, (xlrd.XLRDError, xlrd.compdoc.CompDocError)):
+        return True
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(error, pandas.errors.ParserError)
+
+
+def classify_failure(error: Exception):
+    """
+    変換エラーを入力起因の失敗種別に分類
+
+    同じ入力で再実行しても必ず失敗するエラーのみを分類し、
+    Storage エラー等の一時的な失敗は None を返す（再試行の対象）
+
+    Args:
+        error: 例外オブジェクト
+
+    Returns:
+        FAILURE_* の失敗種別、または None
+    """
+    if isinstance(error, ResourceLimitExceeded):
+        return error.failure_class
+    if is_parse_error(error):
+        return FAILURE_PARSE_ERROR
+    if isinstance(error, InputLimitError):
+        return FAILURE_LIMIT_EXCEEDED
+    if isinstance(error, SheetSelectionError):
+        return FAILURE_INVALID_OPTIONS
+    return None
+
+
+def failure_message(failure_class: str, error: Exception) -> str:
+    """
+    入力起因の失敗をクライアントに返すエラーメッセージに変換
+
+    解析エラーの詳細（xlrd の内部メッセージ）は返さない
+
+    Args:
+        failure_class: 失敗種別（classify_failure）
+        error: 例外オブジェクト
+
+    Returns:
+        エラーメッセージ
+    """
+    if failure_class == FAILURE_PARSE_ERROR:
+        return "ファイルの解析に失敗しました。有効なXLSファイルか確認してください。"
+    if failure_class == FAILURE_MEMORY_LIMIT:
+        return "変換に必要なメモリが上限を超えました。シート・行範囲を指定するか、ファイルを分割してください。"
+    if failure_class in (FAILURE_CPU_LIMIT, FAILURE_TIMEOUT):
+        return "変換処理が制限時間を超えました。シート・行範囲を指定するか、ファイルを分割してください。"
+    return str(error)
+
+
+def failure_status(failure_class: str) -> int:
+    """
+    入力起因の失敗種別に対応する HTTP ステータスを返す
+
+    リソース上限超過はメモリが 413、CPU 時間・経過時間が 422、それ以外は 400
+    """
+    return FAILURE_STATUS.get(failure_class, 400)
+
+
+def get_default_engine() -> str:
+    """
+    環境変数 CONVERSION_ENGINE から既定の変換エンジンを取得
+
+    Returns:
+        エンジン名（未設定・不正値の場合は pandas）
+    """
+    engine = os.environ.get('CONVERSION_ENGINE', ENGINE_PANDAS).strip().lower()
+    if engine not in SUPPORTED_ENGINES:
+        logging.warning(f"Unknown CONVERSION_ENGINE '{engine}', falling back to {ENGINE_PANDAS}")
+        return ENGINE_PANDAS
+    return engine
+
+
+def parse_schema_hint(hint: str) -> dict:
+    """
+    スキーマヒント文字列を解析
+
+    形式:
+        - 列型のみ（例: "text"）: 全列をその型として扱う
+        - JSON（例: {"default": "text", "columns": {"0": "number", "C": "bool"}}）
+          columns のキーは0始まりの列番号または列記号
+
+    Args:
+        hint: スキーマヒント文字列
+
+    Returns:
+        {'default': 列型 or None, 'columns': {列番号: 列型}}
+
+    Raises:
+        ValueError: 形式不正、未対応の列型
+    """
+    hint = hint.strip()
+    if hint.lower() in SCHEMA_TYPES:
+        return {'default': hint.lower(), 'columns': {}}
+
+    try:
+        raw = json.loads(hint)
+    except json.JSONDecodeError:
+        raise ValueError("スキーマヒントの形式が不正です")
+    if not isinstance(raw, dict):
+        raise ValueError("スキーマヒントの形式が不正です")
+
+    default = raw.get('default')
+    if default is not None and default not in SCHEMA_TYPES:
+        raise ValueError(f"未対応の列型です: {default}")
+
+    columns = {}
+    for key, column_type in (raw.get('columns') or {}).items():
+        if column_type not in SCHEMA_TYPES:
+            raise ValueError(f"未対応の列型です: {column_type}")
+        columns[_column_index(str(key))] = column_type
+
+    return {'default': default, 'columns': columns}
+
+
+def _column_index(key: str) -> int:
+    """
+    列番号（"0"）または列記号（"A"）を0始まりの列番号に変換
+    """
+    key = key.strip().upper()
+    if key.isdigit():
+        return int(key)
+    if not key or not key.isalpha() or not key.isascii():
+        raise ValueError(f"列の指定が不正です: {key}")
+    index = 0
+    for char in key:
+        index = index * 26 + (ord(char) - 64)
+    return index - 1
+
+
+def parse_sheet_selection(text: str) -> List[str]:
+    """
+    シート指定文字列を解析
+
+    カンマ区切りのシート名または1始まりのシート番号（例: "Sales,3"）
+
+    Args:
+        text: シート指定文字列
+
+    Returns:
+        シート名・シート番号の一覧
+
+    Raises:
+        ValueError: 空の指定
+    """
+    selection = [item.strip() for item in text.split(',') if item.strip()]
+    if not selection:
+        raise ValueError("シートの指定が不正です")
+    return selection
+
+
+def parse_row_range(text: str) -> Tuple[int, int]:
+    """
+    行範囲文字列を解析
+
+    1始まり・終了行を含む範囲（"10-20"、"10-"（最終行まで）、"-20"（先頭から）、"5"（1行のみ））
+
+    Args:
+        text: 行範囲文字列
+
+    Returns:
+        (開始行, 終了行)（0始まり・終了行は含まない・None は最終行まで）
+
+    Raises:
+        ValueError: 形式不正
+    """
+    text = text.strip()
+    first, separator, last = text.partition('-')
+    first, last = first.strip(), last.strip()
+    if not separator:
+        last = first
+    if (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        raise ValueError("行範囲の形式が不正です（例: 1-100）")
+    start = int(first) if first else 1
+    stop = int(last) if last else None
+    if start < 1 or (stop is not None and stop < start):
+        raise ValueError("行範囲の形式が不正です（例: 1-100）")
+    return start - 1, stop
+
+
+def parse_output_format(value: str) -> str:
+    """
+    出力形式名を検証
+
+    Args:
+        value: 出力形式名（xlsx / csv / parquet / arrow）
+
+    Returns:
+        出力形式（columnar_writer.FORMAT_*）
+
+    Raises:
+        ValueError: 未対応の出力形式
+    """
+    output_format = value.strip().lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {value}")
+    return output_format
+
+
+def negotiate_output_format(accept: str) -> str:
+    """
+    Accept ヘッダーから出力形式を決定（最初に一致したメディアタイプ、q 値は考慮しない）
+
+    Args:
+        accept: Accept ヘッダーの値
+
+    Returns:
+        出力形式（対応するメディアタイプが無い場合は None）
+
+    Raises:
+        NotAcceptable: 応答できないメディアタイプ（text/csv）のみを指定した場合
+    """
+    unacceptable = None
+    for media_range in accept.split(','):
+        media_type = media_range.split(';', 1)[0].strip().lower()
+        if media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+        if media_type == 'text/csv':
+            unacceptable = media_type
+    if unacceptable:
+        raise NotAcceptable(
+            f"{unacceptable} では応答できません。CSV はシートごとのファイルを ZIP にまとめて返すため、"
+            "Accept: application/zip またはクエリ format=csv を指定してください。"
+        )
+    return None
+
+
+def parse_request_options(headers: Mapping[str, str], params: Mapping[str, str]) -> dict:
+    """
+    リクエストヘッダー・クエリパラメータから変換オプションを取得
+
+    - X-Raw-Mode / raw: ヘッダー推定なしの raw モード
+    - X-Schema-Hint / schema: スキーマヒント（parse_schema_hint を参照）
+    - X-Sheets / sheets: 変換するシート（parse_sheet_selection を参照）。
+      ヘッダーは ASCII 以外のシート名をパーセントエンコードで指定する
+    - X-Rows / rows: 変換する行範囲（parse_row_range を参照）
+    - format / Accept: 出力形式（xlsx / csv / parquet / arrow。クエリが優先）
+
+    Args:
+        headers: リクエストヘッダー
+        params: クエリパラメータ
+
+    Returns:
+        convert_xls_to_xlsx_with_stats のキーワード引数
+
+    Raises:
+        ValueError: オプションの形式不正
+        NotAcceptable: Accept ヘッダーのメディアタイプでは応答できない（ValueError のサブクラス、406）
+    """
+    options = {}
+
+    raw = headers.get('X-Raw-Mode') or params.get('raw')
+    if raw is not None:
+        options['raw'] = raw.strip().lower() in _TRUE_VALUES
+
+    schema = headers.get('X-Schema-Hint') or params.get('schema')
+    if schema:
+        options['schema'] = parse_schema_hint(schema)
+
+    sheets = headers.get('X-Sheets')
+    sheets = unquote(sheets) if sheets else params.get('sheets')
+    if sheets:
+        options['sheets'] = parse_sheet_selection(sheets)
+
+    rows = headers.get('X-Rows') or params.get('rows')
+    if rows:
+        options['rows'] = parse_row_range(rows)
+
+    output_format = params.get('format')
+    if output_format:
+        output_format = parse_output_format(output_format)
+    elif headers.get('Accept'):
+        output_format = negotiate_output_format(headers.get('Accept'))
+    if output_format and output_format != FORMAT_XLSX:
+        options['output_format'] = output_format
+
+    return options
+
+
+def parse_blob_options(blob_name: str, metadata: Mapping[str, str] = None) -> dict:
+    """
+    入力Blobのメタデータ・Blob名から変換オプションを取得
+
+    - メタデータ sheets / rows / format（sheets はパーセントエンコード可）
+    - Blob名の規約: <名前>@sheets=<シート指定>@rows=<行範囲>@format=<出力形式>.xls（いずれも省略可）
+
+    メタデータの指定が Blob名の指定より優先される
+
+    Args:
+        blob_name: 入力Blob名
+        metadata: 入力Blobのメタデータ
+
+    Returns:
+        convert_xls_to_xlsx_with_stats のキーワード引数
+
+    Raises:
+        ValueError: オプションの形式不正
+    """
+    values = {}
+    stem = blob_name.rsplit('/', 1)[-1]
+    if stem.lower().endswith('.xls'):
+        stem = stem[:-4]
+    for segment in stem.split(BLOB_OPTION_SEPARATOR)[1:]:
+        name, _, value = segment.partition('=')
+        if name.lower() in _BLOB_OPTION_NAMES:
+            values[name.lower()] = value
+    for name, value in (metadata or {}).items():
+        if name.lower() in _BLOB_OPTION_NAMES:
+            values[name.lower()] = unquote(value)
+
+    options = {}
+    if values.get('sheets'):
+        options['sheets'] = parse_sheet_selection(values['sheets'])
+    if values.get('rows'):
+        options['rows'] = parse_row_range(values['rows'])
+    if values.get('format') and parse_output_format(values['format']) != FORMAT_XLSX:
+        options['output_format'] = parse_output_format(values['format'])
+    return options
+
+
+def compute_input_hash(xls_data: bytes) -> str:
+    """
+    入力データの SHA-256 ハッシュ（16進文字列）を計算
+    """
+    return hashlib.sha256(xls_data).hexdigest()
+
+
+def compute_output_hash(output_data: bytes) -> str:
+    """
+    変換結果の SHA-256 ハッシュ（16進文字列）を計算（ETag・出力Blobのメタデータ content_sha256）
+    """
+    return hashlib.sha256(output_data).hexdigest()
+
+
+def conversion_key(input_hash: str, engine: str = None, **options) -> str:
+    """
+    変換結果を一意に識別するキーを作成
+
+    同じ入力・エンジン・変換オプション・ENGINE_VERSION の組み合わせは同じ出力になるため、
+    重複実行の抑止や結果の再利用に使用する
+
+    Args:
+        input_hash: 入力データのハッシュ（compute_input_hash）
+        engine: 変換エンジン（省略時は環境変数 CONVERSION_ENGINE）
+        **options: 変換オプション（convert_xls_to_xlsx_with_stats を参照）
+
+    Returns:
+        キー（SHA-256 の16進文字列）
+    """
+    descriptor = json.dumps({
+        'input': input_hash,
+        'engine': engine or get_default_engine(),
+        'version': ENGINE_VERSION,
+        # 既定値と同じオプション（raw=False 等）は省略時と同じキーにする
+        'options': {name: value for name, value in options.items() if value not in (None, False)},
+    }, sort_keys=True)
+    return hashlib.sha256(descriptor.encode('utf-8')).hexdigest()
+
+
+def options_key(**options) -> str:
+    """
+    変換オプションを識別する短いキーを作成（出力Blobのメタデータに記録）
+
+    Args:
+        **options: 変換オプション
+
+    Returns:
+        キー（既定のオプションのみの場合は空文字列）
+    """
+    effective = {name: value for name, value in options.items() if value not in (None, False)}
+    if not effective:
+        return ''
+    return hashlib.sha256(json.dumps(effective, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def convert_xls_to_xlsx(xls_data: bytes, engine: str = None, **options) -> bytes:
+    """
+    XLSバイナリデータをXLSXバイナリデータに変換
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        engine: 変換エンジン（省略時は環境変数 CONVERSION_ENGINE）
+        **options: 変換オプション（convert_xls_to_xlsx_with_stats を参照）
+
+    Returns:
+        XLSXファイルのバイナリデータ
+
+    Raises:
+        xlrd.XLRDError / pandas.errors.ParserError: XLS解析エラー
+        InputLimitError: シート数制限超過
+        ValueError: 未対応のエンジン
+        Exception: その他の変換エラー
+    """
+    xlsx_data, _ = convert_xls_to_xlsx_with_stats(xls_data, engine, **options)
+    return xlsx_data
+
+
+def convert_xls_to_xlsx_with_stats(
+    xls_data: bytes,
+    engine: str = None,
+    raw: bool = False,
+    schema: dict = None,
+    sheets: List[str] = None,
+    rows: Tuple[int, int] = None,
+    output_format: str = FORMAT_XLSX,
+) -> Tuple[bytes, dict]:
+    """
+    XLSバイナリデータをXLSXバイナリデータに変換し、変換統計も返す
+
+    各シートは実データ範囲（空セル・書式のみのセル・DIMENSIONS レコードの
+    過大な範囲を除く）のみを書き出す。出力形式に XLSX 以外を指定した場合は
+    native エンジンと同じ読み込み処理で、シートごとのファイルを ZIP にまとめて返す。
+    決定的な出力（DETERMINISTIC_OUTPUT、既定: 有効）では、同じ入力・エンジン・変換オプション・
+    ENGINE_VERSION から常に同じバイト列を返す
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        engine: 変換エンジン（省略時は環境変数 CONVERSION_ENGINE）
+        raw: 1行目をヘッダーとして扱わず、セルを BIFF 上の型のまま書き出す
+            （native エンジンは常に raw 相当）
+        schema: スキーマヒント（parse_schema_hint の戻り値）。指定時は raw モードで
+            読み込み、列型の推定を行わない
+        sheets: 変換するシート名・シート番号（parse_sheet_selection の戻り値、None は全シート）。
+            指定外のシートは読み込まない
+        rows: 各シートで変換する行範囲（parse_row_range の戻り値）。raw モード以外は
+            範囲の先頭行をヘッダーとして扱う
+        output_format: 出力形式（xlsx / csv / parquet / arrow）。parquet / arrow は
+            raw モード以外の場合、1行目を列名として扱う
+
+    Returns:
+        (XLSXファイル（または ZIP ファイル）のバイナリデータ, 変換統計)
+        変換統計: {'engine': str, 'format': str, 'raw': bool, 'sheets': [{'name', 'rows', 'cols', 'trimmed_cells'}], 'trimmed_cells': int,
+                   'timings': {'convert': 秒, 'parse': 秒, 'write': 秒}}（parse / write は中間表現を経由する場合のみ）
+
+    Raises:
+        xlrd.XLRDError / pandas.errors.ParserError: XLS解析エラー
+        InputLimitError: シート数制限超過
+        SheetSelectionError: 存在しないシートの指定
+        OutputFormatUnavailable: 出力形式に必要なライブラリ（pyarrow）が無い
+        ValueError: 未対応のエンジン
+        Exception: その他の変換エラー
+    """
+    engine = engine or get_default_engine()
+    raw = raw or schema is not None
+    start = time.perf_counter()
+    timings = {}
+    if output_format != FORMAT_XLSX:
+        # 列指向形式・CSV は型別の列チャンクから直接書き出す
+        xlsx_data, sheet_stats = _convert_columnar(xls_data, output_format, raw, schema, sheets, rows, timings)
+        engine = ENGINE_NATIVE
+    elif engine == ENGINE_NATIVE:
+        xlsx_data, sheet_stats = _convert_native(xls_data, schema, sheets, rows, timings)
+        raw = True
+    elif engine == ENGINE_PANDAS:
+        xlsx_data, sheet_stats = _convert_with_pandas(xls_data, raw, schema, sheets, rows)
+    else:
+        raise ValueError(f"未対応の変換エンジンです: {engine}")
+
+    stats = {
+        'engine': engine,
+        'format': output_format,
+        'raw': raw,
+        'sheets': sheet_stats,
+        'trimmed_cells': sum(sheet['trimmed_cells'] for sheet in sheet_stats),
+        'timings': {'convert': time.perf_counter() - start, **timings},
+    }
+    if stats['trimmed_cells']:
+        logging.info(f"Trimmed {stats['trimmed_cells']} cells outside the data extent")
+    return xlsx_data, stats
+
+
+def _sheet_stats(name: str, extent: Tuple[int, int], declared: Tuple[int, int]) -> dict:
+    """
+    シート単位の変換統計を作成
+    """
+    rows, cols = extent
+    declared_rows, declared_cols = max(declared[0], rows), max(declared[1], cols)
+    return {
+        'name': name,
+        'rows': rows,
+        'cols': cols,
+        'trimmed_cells': declared_rows * declared_cols - rows * cols,
+    }
+
+
+def _pandas_read_options(raw: bool, schema: dict, ncols: int) -> dict:
+    """
+    read_excel に渡す dtype / converters を決定
+
+    raw モードでは object 型で読み込み、列ごとの型推定を行わない。
+    スキーマヒントの number / bool 列は変換できない値を元の値のまま残す
+    """
+    if schema is None:
+        return {'dtype': object} if raw else {}
+    column_types = {col: schema.get('default') for col in range(ncols)}
+    for col, column_type in schema.get('columns', {}).items():
+        if col < ncols:
+            column_types[col] = column_type
+
+    dtype = {}
+    converters = {}
+    for col, column_type in column_types.items():
+        if column_type == TYPE_TEXT:
+            dtype[col] = str
+        elif column_type in _PANDAS_CONVERTERS:
+            converters[col] = _PANDAS_CONVERTERS[column_type]
+        else:
+            dtype[col] = object
+    return {'dtype': dtype, 'converters': converters}
+
+
+def _to_number(value):
+    """
+    スキーマヒント number 列の値変換（変換できない値はそのまま）
+    """
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().replace(',', ''))
+        except ValueError:
+            return value
+    return value
+
+
+def _to_bool(value):
+    """
+    スキーマヒント bool 列の値変換（変換できない値はそのまま）
+    """
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ('true', 'yes', '1'):
+            return True
+        if text in ('false', 'no', '0'):
+            return False
+    return value
+
+
+_PANDAS_CONVERTERS = {
+    TYPE_NUMBER: _to_number,
+    TYPE_BOOL: _to_bool,
+}
+
+
+def _convert_with_pandas(xls_data: bytes, raw: bool = False, schema: dict = None,
+                         sheets: List[str] = None, rows: Tuple[int, int] = None) -> Tuple[bytes, list]:
+    """
+    pandas DataFrame 経由で変換（raw モード以外は1行目をヘッダーとして扱う）
+    """
+    # pandas / openpyxl は pandas エンジン使用時のみ読み込む（コールドスタート短縮）
+    import pandas as pd
+
+    # 複数シートに対応
+    xlsx_buffer = io.BytesIO()
+    sheet_stats = []
+
+    # XLSデータを xlrd で開き、ExcelFileオブジェクトとして読み込み
+    # （pandas は全行が同じ列数であることを前提とするため、行を詰め物なしにしない。
+    # 1行目が実データ範囲より狭い場合に usecols が範囲外になるのを防ぐ）
+    book = open_xls_book(xls_data, ragged_rows=False)
+    try:
+        xls_file = pd.ExcelFile(book, engine='xlrd')
+
+        # 指定されたシートのみを対象にする（シート名の一覧は各シートを読み込まずに取得できる）
+        indices = select_sheet_indices(xls_file.sheet_names, sheets)
+
+        # シート数チェック（異常に多いシートは拒否）
+        if len(indices) > MAX_SHEETS:
+            raise InputLimitError(f"シート数が多すぎます（最大{MAX_SHEETS}シート）")
+
+        # Excelライターを作成
+        with pd.ExcelWriter(xlsx_buffer, engine='openpyxl') as writer:
+            for index in indices:
+                sheet_name = xls_file.sheet_names[index]
+                # 行範囲内の実データ範囲のみを読み込む
+                sheet = book.sheet_by_index(index)
+                extent = data_extent(sheet, rows)
+                if extent[0] == 0:
+                    df = pd.DataFrame()
+                else:
+                    df = pd.read_excel(
+                        xls_file,
+                        sheet_name=index,
+                        header=None if raw else 0,
+                        skiprows=rows[0] if rows else None,
+                        nrows=extent[0] if raw else extent[0] - 1,
+                        usecols=list(range(extent[1])),
+                        **_pandas_read_options(raw, schema, extent[1]),
+                    )
+                sheet_stats.append(_sheet_stats(sheet_name, extent, clip_extent(declared_extent(sheet), rows)))
+                book.unload_sheet(index)
+
+                # シート名の検証（Excelの制限: 31文字）
+                if len(sheet_name) > 31:
+                    sheet_name = sheet_name[:31]
+
+                # データサイズチェック
+                if len(df) > 1000000:  # 100万行を超える場合は警告
+                    logging.warning(f"Large dataset: {len(df)} rows in sheet '{sheet_name}'")
+
+                df.to_excel(writer, sheet_name=sheet_name, index=False, header=not raw)
+    finally:
+        book.release_resources()
+
+    if is_deterministic():
+        # openpyxl は保存時の日時を ZIP エントリと docProps/core.xml に書き込むため固定する
+        return normalize_package(xlsx_buffer.getvalue()), sheet_stats
+    return xlsx_buffer.getvalue(), sheet_stats
+
+
+def _convert_native(xls_data: bytes, schema: dict = None, sheets: List[str] = None,
+                    rows: Tuple[int, int] = None, timings: dict = None) -> Tuple[bytes, list]:
+    """
+    スパース中間表現を経由して変換（セルをそのまま書き出す）
+
+    timings を渡した場合は読み込み（parse）と書き出し（write）の所要時間を記録する
+    """
+    start = time.perf_counter()
+    sheets, sst, datemode = load_sparse_workbook(
+        xls_data, max_sheets=MAX_SHEETS, schema=schema, sheets=sheets, rows=rows
+    )
+    parsed = time.perf_counter()
+    data = write_xlsx(sheets, sst, datemode)
+    if timings is not None:
+        timings.update(parse=parsed - start, write=time.perf_counter() - parsed)
+    return data, native_sheet_stats(sheets)
+
+
+def native_sheet_stats(sheets) -> list:
+    """
+    中間表現のシート一覧からシート単位の変換統計を作成
+    """
+    sheet_stats = []
+    for sheet in sheets:
+        if sheet.nrows > 1000000:  # 100万行を超える場合は警告
+            logging.warning(f"Large dataset: {sheet.nrows} rows in sheet '{sheet.name}'")
+        sheet_stats.append({
+            'name': sheet.name,
+            'rows': sheet.nrows,
+            'cols': sheet.ncols,
+            'trimmed_cells': sheet.trimmed_cells,
+        })
+    return sheet_stats
+
+
+def _convert_columnar(xls_data: bytes, output_format: str, raw: bool = False, schema: dict = None,
+                      sheets: List[str] = None, rows: Tuple[int, int] = None,
+                      timings: dict = None) -> Tuple[bytes, list]:
+    """
+    スパース中間表現を経由して CSV / Parquet / Arrow IPC（シートごとのファイルの ZIP）に変換
+    """
+    if output_format not in (FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW):
+        raise ValueError(f"未対応の出力形式です: {output_format}")
+    start = time.perf_counter()
+    sheets, sst, datemode = load_sparse_workbook(
+        xls_data, max_sheets=MAX_SHEETS, schema=schema, sheets=sheets, rows=rows
+    )
+    parsed = time.perf_counter()
+    if output_format == FORMAT_CSV:
+        data = write_csv_archive(sheets, sst, datemode)
+    else:
+        data = write_arrow_archive(sheets, sst, datemode, output_format, header=not raw)
+    if timings is not None:
+        timings.update(parse=parsed - start, write=time.perf_counter() - parsed)
+    return data, native_sheet_stats(sheets)
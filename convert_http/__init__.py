@@ -1,19 +1,47 @@
 import azure.functions as func
-import pandas as pd
 import logging
-import io
 import os
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from datetime import datetime, timedelta
+import time
+from datetime import timedelta
 from security_utils import (
-    validate_input,
-    get_security_headers,
+    sanitize_filename,
     sanitize_error_message,
     log_security_event
 )
-
-# ファイルサイズ閾値（10MB以上はStorageに保存）
-SIZE_THRESHOLD = 10 * 1024 * 1024
+from input_ingest import IngestError, ingest_request
+from http_utils import (
+    SIZE_THRESHOLD,
+    XLSX_CONTENT_TYPE,
+    ZIP_CONTENT_TYPE,
+    create_error_response,
+    create_file_response,
+    create_json_response,
+    get_request_filename,
+)
+from columnar_writer import FORMAT_XLSX, NotAcceptable, OutputFormatUnavailable, archive_name
+from conversion_utils import (
+    CACHEABLE_FAILURES,
+    classify_failure,
+    compute_output_hash,
+    conversion_key,
+    failure_message,
+    failure_status,
+    get_default_engine,
+    parse_request_options,
+)
+from metrics_registry import REJECTIONS, STAGE_SECONDS, observe_conversion
+import negative_cache
+import profiling
+import result_store
+import slow_capture
+from single_flight import convert_coalesced
+from storage_utils import CONTENT_CONTAINER, get_blob_url_with_sas
+import tracing
+from warmup_utils import schedule_startup_warmup
+from worker_pool import PoolBusy, get_acquire_timeout
+
+# WARMUP_ON_STARTUP が有効な場合は起動時にバックグラウンドでウォームアップ
+schedule_startup_warmup()
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     """
@@ -22,249 +50,194 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     
     - 10MB未満: レスポンスで直接返す
     - 10MB以上: Blob Storageに保存してダウンロードURLを返す
+
+    変換結果は内容の SHA-256 で xls-content に保存し（10MB未満は STORE_HTTP_RESULTS が有効な場合に
+    バックグラウンドで保存）、Content-Location の結果取得API（GET /api/results/{content_hash}）から
+    再変換せずに再取得できる。変換キーの索引も記録し、同じ入力・変換オプションは事前確認API
+    （POST /api/probe）でアップロードせずに取得できる
+
+    リクエストの traceparent ヘッダーを親とするトレースのスパンを記録する
     """
+    with tracing.start_span('convert_http', {'http.request.method': req.method}, carrier=req.headers) as span:
+        response = _convert_request(req)
+        span.set_attribute('http.response.status_code', response.status_code)
+        return response
+
+
+def _convert_request(req: func.HttpRequest) -> func.HttpResponse:
+    """convert_http の本体（main を参照）"""
     logging.info('HTTP trigger function processed a request.')
     
     # 本番環境判定
     is_production = os.environ.get('AZURE_FUNCTIONS_ENVIRONMENT') == 'Production'
+    input_hash = None
+    options = {}
+    file_data = None
+    engine = get_default_engine()
+    started = time.perf_counter()
     
     try:
-        # リクエストからファイルを取得
-        file_data = req.get_body()
-        
-        if not file_data:
-            log_security_event('empty_request', {'ip': req.headers.get('X-Forwarded-For')})
-            return create_error_response(
-                "リクエストボディにXLSファイルが含まれていません。",
-                400
-            )
-        
         # ファイル名を取得
-        raw_filename = req.headers.get('X-Filename', 'converted')
-        
-        # セキュリティ検証（ファイル名サニタイズ、サイズチェック、形式チェック）
-        is_valid, sanitized_filename, error_message = validate_input(file_data, raw_filename)
-        
-        if not is_valid:
-            log_security_event('validation_failed', {
-                'reason': error_message,
+        raw_filename = get_request_filename(req)
+
+        # リクエストボディを取り込む（Content-Length による事前のサイズチェック、
+        # 先頭 512 バイトでの形式チェック、受信しながらの SHA-256 計算）
+        try:
+            with STAGE_SECONDS.time(stage='ingest'), tracing.start_span('ingest'):
+                file_data, input_hash = ingest_request(req)
+        except IngestError as e:
+            REJECTIONS.inc(reason=e.event)
+            log_security_event(e.event, {
+                'reason': str(e),
                 'original_filename': raw_filename,
-                'file_size': len(file_data),
+                'file_size': e.size,
                 'ip': req.headers.get('X-Forwarded-For')
             })
-            return create_error_response(error_message, 400)
+            return create_error_response(str(e), e.status_code)
+
+        sanitized_filename = sanitize_filename(raw_filename)
         
         # .xls拡張子を除去
         if sanitized_filename.lower().endswith('.xls'):
             sanitized_filename = sanitized_filename[:-4]
         
+        # 変換オプションを取得（raw モード、スキーマヒント、シート・行範囲）
+        try:
+            options = parse_request_options(req.headers, req.params)
+        except NotAcceptable as e:
+            REJECTIONS.inc(reason='not_acceptable')
+            return create_error_response(str(e), 406)
+        except ValueError as e:
+            REJECTIONS.inc(reason='invalid_options')
+            return create_error_response(str(e), 400)
+
         logging.info(f"Processing file: {sanitized_filename} ({len(file_data)} bytes)")
 
-        # XLSをXLSXに変換
-        xlsx_data = convert_xls_to_xlsx(file_data)
+        # 過去に入力起因で失敗した入力は解析せずに拒否
+        known_failure = negative_cache.lookup(input_hash, options)
+        if known_failure:
+            REJECTIONS.inc(reason='known_bad_input')
+            log_security_event('known_bad_input', {
+                'failure_class': known_failure['failure_class'],
+                'input_hash': input_hash,
+                'ip': req.headers.get('X-Forwarded-For')
+            })
+            return create_error_response(known_failure['message'], failure_status(known_failure['failure_class']), {
+                'X-Failure-Class': known_failure['failure_class'],
+                'X-Negative-Cache': 'hit'
+            })
+
+        # XLSをXLSXに変換（同じ内容の同時リクエストは1回の変換結果を共有）。
+        # プロファイルの取得を要求された変換は共有せず、プロファイラの下で変換する
+        if profiling.is_requested(input_hash, req.headers):
+            xlsx_data, stats = profiling.convert_profiled(file_data, input_hash, 'http', **options)
+            coalesced = False
+        else:
+            xlsx_data, stats, coalesced = convert_coalesced(file_data, input_hash=input_hash, **options)
+
+        observe_conversion('http', 'success', stats['engine'], len(file_data), xlsx_data, stats, coalesced)
+        if not coalesced:
+            slow_capture.capture_if_slow(file_data, input_hash, 'http', stats, options)
+
+        # 実データ範囲外として除外したセル数と、変換結果の SHA-256 による ETag を通知
+        # （決定的な出力では同じ入力・変換オプションから常に同じ ETag になる）
+        content_hash = compute_output_hash(xlsx_data)
+        stats_headers = {'X-Trimmed-Cells': str(stats['trimmed_cells']), 'ETag': f'"{content_hash}"'}
+        if coalesced:
+            stats_headers['X-Coalesced'] = 'true'
+        if stats.get('profile_blob'):
+            stats_headers['X-Profile-Blob'] = stats['profile_blob']
+
+        # XLSX 以外の出力形式はシートごとのファイルをまとめた ZIP
+        output_format = options.get('output_format', FORMAT_XLSX)
+        output_filename = archive_name(sanitized_filename, output_format)
+        content_type = XLSX_CONTENT_TYPE if output_format == FORMAT_XLSX else ZIP_CONTENT_TYPE
+        result_key = conversion_key(input_hash, **options)
 
         # ファイルサイズに応じて出力方法を切り替え
         if len(xlsx_data) < SIZE_THRESHOLD:
-            # 直接レスポンスで返す
-            return create_file_response(xlsx_data, f"{sanitized_filename}.xlsx")
+            # 直接レスポンスで返す（結果取得API用の保存は応答後にバックグラウンドで行う）
+            if result_store.is_store_enabled() and \
+                    result_store.save_async(xlsx_data, output_filename, content_type, content_hash, input_hash,
+                                            result_key):
+                stats_headers['Content-Location'] = result_store.result_path(content_hash)
+            return create_file_response(xlsx_data, output_filename, stats_headers, content_type)
         else:
             # Blob Storageに保存してURLを返す
-            download_url = save_to_blob_and_get_url(xlsx_data, f"{sanitized_filename}.xlsx")
-            return create_json_response({'download_url': download_url})
-    
-    except pd.errors.ParserError as e:
-        logging.error(f"Pandas parsing error: {str(e)}")
-        log_security_event('parse_error', {'error': str(e)})
-        return create_error_response(
-            "ファイルの解析に失敗しました。有効なXLSファイルか確認してください。",
-            400
-        )
+            with STAGE_SECONDS.time(stage='upload'), tracing.start_span('upload'):
+                download_url = save_to_blob_and_get_url(xlsx_data, output_filename, content_type,
+                                                        content_hash, input_hash, result_key)
+            stats_headers['Content-Location'] = result_store.result_path(content_hash)
+            return create_json_response({
+                'download_url': download_url,
+                'result_url': result_store.result_path(content_hash),
+                'content_sha256': content_hash
+            }, stats_headers)
+
+    except OutputFormatUnavailable as e:
+        REJECTIONS.inc(reason='format_unavailable')
+        logging.error(f"出力形式を利用できません: {str(e)}")
+        return create_error_response(str(e), 406)
+
+    except PoolBusy as e:
+        # 変換ワーカーの空き待ちが長い場合は関数のタイムアウト前に再試行を促す
+        REJECTIONS.inc(reason='pool_busy')
+        logging.warning(f"変換ワーカーの空き待ちタイムアウト: {str(e)}")
+        return create_error_response("変換処理が混み合っています。しばらくしてから再試行してください。", 503,
+                                     {'Retry-After': str(int(get_acquire_timeout()))})
     
     except Exception as e:
+        failure_class = classify_failure(e)
+        if failure_class:
+            # 入力起因の失敗（変換ワーカーのリソース上限超過を含む）は記録し、同じ入力の再送を即座に拒否する
+            logging.error(f"XLS input error ({failure_class}): {str(e)}")
+            log_security_event(failure_class, {
+                'error': str(e),
+                'input_hash': input_hash,
+                'ip': req.headers.get('X-Forwarded-For')
+            })
+            observe_conversion('http', failure_class, engine,
+                               len(file_data) if file_data is not None else None)
+            if input_hash and failure_class in slow_capture.RESOURCE_FAILURES:
+                slow_capture.capture(file_data, input_hash, 'http', [failure_class], engine, options=options)
+            message = failure_message(failure_class, e)
+            if input_hash and failure_class in CACHEABLE_FAILURES:
+                negative_cache.record(input_hash, failure_class, message, options)
+            return create_error_response(message, failure_status(failure_class), {'X-Failure-Class': failure_class})
+
         logging.error(f"変換エラー: {str(e)}", exc_info=True)
         log_security_event('conversion_error', {'error': str(e)})
+        observe_conversion('http', 'error', engine)
         
         error_message = sanitize_error_message(e, is_production)
         return create_error_response(error_message, 500)
 
-
-def convert_xls_to_xlsx(xls_data: bytes) -> bytes:
-    """
-    XLSバイナリデータをXLSXバイナリデータに変換
-    
-    Args:
-        xls_data: XLSファイルのバイナリデータ
-        
-    Returns:
-        XLSXファイルのバイナリデータ
-        
-    Raises:
-        pd.errors.ParserError: XLS解析エラー
-        ValueError: データサイズ/シート数制限超過
-        Exception: その他の変換エラー
-    """
-    # XLSデータをDataFrameに読み込み
-    xls_buffer = io.BytesIO(xls_data)
-    
-    # 複数シートに対応
-    xlsx_buffer = io.BytesIO()
-    
-    # ExcelファイルをExcelFileオブジェクトとして読み込み
-    xls_file = pd.ExcelFile(xls_buffer, engine='xlrd')
-    
-    # シート数チェック（異常に多いシートは拒否）
-    MAX_SHEETS = 100
-    if len(xls_file.sheet_names) > MAX_SHEETS:
-        raise ValueError(f"シート数が多すぎます（最大{MAX_SHEETS}シート）")
-    
-    # Excelライターを作成
-    with pd.ExcelWriter(xlsx_buffer, engine='openpyxl') as writer:
-        # 全シートを変換
-        for sheet_name in xls_file.sheet_names:
-            # シート名の検証（Excelの制限: 31文字）
-            if len(sheet_name) > 31:
-                sheet_name = sheet_name[:31]
-            
-            df = pd.read_excel(xls_file, sheet_name=sheet_name)
-            
-            # データサイズチェック
-            if len(df) > 1000000:  # 100万行を超える場合は警告
-                logging.warning(f"Large dataset: {len(df)} rows in sheet '{sheet_name}'")
-            
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-    
-    xlsx_buffer.seek(0)
-    return xlsx_buffer.getvalue()
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='request')
 
 
-def save_to_blob_and_get_url(data: bytes, filename: str) -> str:
+def save_to_blob_and_get_url(data: bytes, filename: str, content_type: str = XLSX_CONTENT_TYPE,
+                             content_hash: str = None, input_hash: str = None,
+                             result_key: str = None) -> str:
     """
     Blob Storageにファイルを保存し、SAS付きダウンロードURLを返す
 
+    ファイルは内容の SHA-256 をBlob名として xls-content に保存する（同じ内容は保存済みのBlobを共有し、
+    同じファイル名の別の結果で上書きされない）
+
     Args:
         data: ファイルのバイナリデータ
-        filename: 保存するファイル名
+        filename: ダウンロード時のファイル名
+        content_type: ファイルの Content-Type
+        content_hash: ファイルの SHA-256（省略時は計算する）
+        input_hash: 入力データの SHA-256
+        result_key: 変換キー（事前確認API用の索引に記録）
 
     Returns:
         SAS付きダウンロードURL
     """
-    # 接続文字列を取得
-    connection_string = os.environ.get('AzureWebJobsStorage', 'UseDevelopmentStorage=true')
+    content_hash = result_store.save(data, filename, content_type, content_hash, input_hash,
+                                     conversion_key=result_key)
 
-    # BlobServiceClientを作成
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-
-    # コンテナとBlobの参照を取得
-    container_name = 'xls-output'
-    
-    # コンテナが存在しない場合は作成（プライベートアクセス）
-    try:
-        container_client = blob_service_client.get_container_client(container_name)
-        if not container_client.exists():
-            container_client.create_container()
-            # パブリックアクセスを明示的に無効化
-            container_client.set_container_access_policy(
-                signed_identifiers={},
-                public_access=None
-            )
-    except Exception as e:
-        logging.warning(f"コンテナ作成チェックエラー（無視可能）: {str(e)}")
-    
-    blob_client = blob_service_client.get_blob_client(
-        container=container_name,
-        blob=filename
-    )
-    
-    # アップロード（メタデータ付き）
-    blob_client.upload_blob(
-        data,
-        overwrite=True,
-        metadata={
-            'original_size': str(len(data)),
-            'upload_time': datetime.utcnow().isoformat(),
-            'content_type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        }
-    )
-    
     # SASトークンを生成（1時間有効）
-    # ローカル開発環境（Azurite）ではSAS生成をスキップ
-    if 'UseDevelopmentStorage' in connection_string or '127.0.0.1' in connection_string:
-        # Azurite用のURL（SASなし）
-        download_url = f"{blob_client.url}"
-    else:
-        # Azure本番環境用のSAS付きURL
-        sas_token = generate_blob_sas(
-            account_name=blob_service_client.account_name,
-            container_name=container_name,
-            blob_name=filename,
-            account_key=blob_service_client.credential.account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=1)
-        )
-        download_url = f"{blob_client.url}?{sas_token}"
-
-    return download_url
-
-
-def create_file_response(data: bytes, filename: str) -> func.HttpResponse:
-    """
-    ファイルダウンロード用のHTTPレスポンスを作成（セキュリティヘッダー付き）
-    
-    Args:
-        data: ファイルデータ
-        filename: ファイル名
-        
-    Returns:
-        HTTPレスポンス
-    """
-    headers = {
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'Content-Disposition': f'attachment; filename="{filename}"',
-        **get_security_headers()
-    }
-    
-    return func.HttpResponse(data, status_code=200, headers=headers)
-
-
-def create_json_response(data: dict) -> func.HttpResponse:
-    """
-    JSON HTTPレスポンスを作成（セキュリティヘッダー付き）
-    
-    Args:
-        data: JSONデータ
-        
-    Returns:
-        HTTPレスポンス
-    """
-    import json
-    
-    headers = {
-        'Content-Type': 'application/json',
-        **get_security_headers()
-    }
-    
-    return func.HttpResponse(
-        json.dumps(data, ensure_ascii=False),
-        status_code=200,
-        headers=headers
-    )
-
-
-def create_error_response(message: str, status_code: int) -> func.HttpResponse:
-    """
-    エラーレスポンスを作成（セキュリティヘッダー付き）
-    
-    Args:
-        message: エラーメッセージ
-        status_code: HTTPステータスコード
-        
-    Returns:
-        HTTPレスポンス
-    """
-    headers = get_security_headers()
-    
-    return func.HttpResponse(
-        message,
-        status_code=status_code,
-        headers=headers
-    )
+    return get_blob_url_with_sas(CONTENT_CONTAINER, content_hash, expiry=timedelta(hours=1))
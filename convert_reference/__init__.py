@@ -0,0 +1,132 @@
+import azure.functions as func
+import logging
+import os
+from security_utils import MAX_FILE_SIZE, sanitize_filename, sanitize_error_message, log_security_event
+from http_utils import create_error_response, create_json_response
+from blob_conversion import OUTCOME_PENDING, OUTCOME_QUARANTINED, OUTCOME_REJECTED, process_input_blob
+from columnar_writer import NotAcceptable
+from conversion_utils import classify_failure, failure_message, failure_status, parse_request_options
+from storage_utils import INPUT_CONTAINER, OUTPUT_CONTAINER, ensure_container, get_blob_url_with_sas
+import tracing
+from warmup_utils import schedule_startup_warmup
+from worker_pool import PoolBusy, get_acquire_timeout
+
+# WARMUP_ON_STARTUP が有効な場合は起動時にバックグラウンドでウォームアップ
+schedule_startup_warmup()
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    xls-input にアップロード済みのBlobを変換し、xls-output の結果のダウンロードURLを返す
+
+    リクエスト: {"blob": "<upload_url で発行された Blob 名>"}（またはクエリ blob）
+    シート・行範囲はヘッダー・クエリ（convert_http と同じ）、入力Blobのメタデータ、Blob名で指定できる。
+    入力は Storage から直接読み込み、結果は xls-output にブロック単位でアップロードする。
+    Blobトリガーが変換済みの場合は変換を行わずにURLを返す。
+    シート数の多いワークブックが時間予算内に完了しなかった場合は 202 と進捗を返し、
+    同じリクエストの再送で途中経過から再開する
+
+    リクエストの traceparent ヘッダーを親とするトレースのスパンを記録する
+    """
+    with tracing.start_span('convert_reference', {'http.request.method': req.method}, carrier=req.headers) as span:
+        response = _convert_reference(req)
+        span.set_attribute('http.response.status_code', response.status_code)
+        return response
+
+
+def _convert_reference(req: func.HttpRequest) -> func.HttpResponse:
+    """convert_reference の本体（main を参照）"""
+    logging.info('Convert-by-reference request.')
+
+    is_production = os.environ.get('AZURE_FUNCTIONS_ENVIRONMENT') == 'Production'
+
+    try:
+        blob_name = req.params.get('blob')
+        if not blob_name:
+            try:
+                blob_name = (req.get_json() or {}).get('blob')
+            except ValueError:
+                blob_name = None
+
+        # パス区切り等を含まない .xls の Blob 名のみ受け付ける
+        if not blob_name or not isinstance(blob_name, str) or sanitize_filename(blob_name) != blob_name \
+                or not blob_name.lower().endswith('.xls'):
+            log_security_event('invalid_blob_reference', {
+                'blob_name': str(blob_name)[:300],
+                'ip': req.headers.get('X-Forwarded-For')
+            })
+            return create_error_response("変換する Blob 名（.xls）を指定してください。", 400)
+
+        try:
+            options = parse_request_options(req.headers, req.params)
+        except NotAcceptable as e:
+            return create_error_response(str(e), 406)
+        except ValueError as e:
+            return create_error_response(str(e), 400)
+
+        from azure.core.exceptions import ResourceNotFoundError
+
+        # サイズは HEAD で確認し、上限を超える入力は読み込まない
+        blob_client = ensure_container(INPUT_CONTAINER).get_blob_client(blob_name)
+        try:
+            properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return create_error_response("指定された Blob が見つかりません。", 404)
+
+        if properties.size > MAX_FILE_SIZE:
+            log_security_event('file_too_large', {'blob_name': blob_name, 'file_size': properties.size})
+            return create_error_response(
+                f"ファイルサイズが大きすぎます（最大{MAX_FILE_SIZE // (1024 * 1024)}MB）",
+                413
+            )
+
+        outcome, detail = process_input_blob(
+            f"{INPUT_CONTAINER}/{blob_name}",
+            lambda: blob_client.download_blob(max_concurrency=4).readall(),
+            source_etag=properties.etag,
+            metadata=properties.metadata,
+            options=options,
+            size=properties.size
+        )
+
+        if outcome == OUTCOME_REJECTED:
+            return create_error_response(
+                "指定されたシート・行範囲を変換できませんでした。指定を確認してください。",
+                400,
+                {'X-Failure-Class': detail}
+            )
+
+        if outcome == OUTCOME_PENDING:
+            return create_json_response({
+                'blob': blob_name,
+                'status': outcome,
+                'progress': detail
+            }, status_code=202)
+
+        if outcome == OUTCOME_QUARANTINED:
+            return create_error_response(
+                "ファイルを変換できませんでした。有効なXLSファイルか確認してください。",
+                failure_status(detail),
+                {'X-Failure-Class': detail}
+            )
+
+        return create_json_response({
+            'blob': blob_name,
+            'output': detail,
+            'status': outcome,
+            'download_url': get_blob_url_with_sas(OUTPUT_CONTAINER, detail)
+        })
+
+    except PoolBusy as e:
+        logging.warning(f"変換ワーカーの空き待ちタイムアウト: {str(e)}")
+        return create_error_response("変換処理が混み合っています。しばらくしてから再試行してください。", 503,
+                                     {'Retry-After': str(int(get_acquire_timeout()))})
+
+    except Exception as e:
+        # 変換の制限時間超過は入力Blobを隔離せずに送出される（同じリクエストの再送で再試行できる）
+        failure_class = classify_failure(e)
+        if failure_class:
+            return create_error_response(failure_message(failure_class, e), failure_status(failure_class),
+                                         {'X-Failure-Class': failure_class})
+        logging.error(f"変換エラー: {str(e)}", exc_info=True)
+        log_security_event('conversion_error', {'error': str(e)})
+        return create_error_response(sanitize_error_message(e, is_production), 500)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+キュー駆動パイプラインの登録・実行スクリプト
+
+xls-input の .xls Blob を変換キュー（xls-convert-queue）に登録し、
+必要に応じてこのプロセスでワーカーを実行する（Azurite のキューでも動作）
+
+使い方:
+    python enqueue_blobs.py [--prefix 2024/] [--blob sample.xls] [--drain] [--workers 8]
+"""
+import argparse
+import logging
+import sys
+
+from queue_pipeline import drain_queue, enqueue_blob, enqueue_input_blobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='変換キューへの登録')
+    parser.add_argument('--prefix', default=None, help='登録する Blob 名のプレフィックス')
+    parser.add_argument('--blob', action='append', default=[], help='登録する Blob 名（複数指定可、一覧取得は行わない）')
+    parser.add_argument('--drain', action='store_true', help='登録後にこのプロセスでキューを処理')
+    parser.add_argument('--workers', type=int, default=None, help='並列変換数（既定: QUEUE_MAX_WORKERS）')
+    parser.add_argument('--time-budget', type=float, default=600, help='--drain の最大処理時間（秒）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.blob:
+        for blob_name in args.blob:
+            enqueue_blob(blob_name)
+        print(f"✅ {len(args.blob)} 件を登録しました")
+    else:
+        count = enqueue_input_blobs(args.prefix)
+        print(f"✅ xls-input から {count} 件を登録しました")
+
+    if args.drain:
+        counts = drain_queue(args.time_budget, max_workers=args.workers)
+        print(f"✅ 処理結果: {counts or '処理対象なし'}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
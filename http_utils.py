@@ -0,0 +1,178 @@
+"""
+HTTPレスポンスユーティリティモジュール
+HTTPトリガー関数で共通のレスポンス作成処理（セキュリティヘッダー付き）を提供
+"""
+import json
+from urllib.parse import quote, unquote
+
+import azure.functions as func
+
+from security_utils import get_security_headers
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+ZIP_CONTENT_TYPE = 'application/zip'
+
+# ファイルサイズ閾値（10MB以上はレスポンスで直接返さず、Storage からダウンロードさせる）
+SIZE_THRESHOLD = 10 * 1024 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    """Range ヘッダーの範囲がリソースの範囲外（416 応答）"""
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    If-None-Match / If-Range ヘッダーが ETag と一致するか（弱い比較、"*" は常に一致）
+
+    Args:
+        header: ヘッダーの値（カンマ区切りの ETag の一覧）
+        etag: リソースの ETag（引用符付き）
+
+    Returns:
+        一致する場合 True（ヘッダーが無い場合は False）
+    """
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def parse_range(header: str, size: int):
+    """
+    Range ヘッダー（単一の bytes 範囲）を解析
+
+    Args:
+        header: ヘッダーの値（例: "bytes=0-1023"、"bytes=1024-"、"bytes=-512"）
+        size: リソースのサイズ（バイト）
+
+    Returns:
+        (開始位置, 終了位置（含む）)。範囲指定として扱わない値（bytes 以外の単位・複数の範囲・
+        不正な書式）の場合は None（リソース全体を返す）
+
+    Raises:
+        RangeNotSatisfiable: 開始位置がリソースの範囲外
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep or not (first or last) or not (first + last).isdigit():
+        return None
+    if not first:
+        # 末尾からの長さ
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def get_request_filename(req: func.HttpRequest, default: str = 'converted') -> str:
+    """
+    リクエストの元のファイル名（サニタイズ前）を取得
+
+    X-Filename ヘッダーは ASCII 以外をパーセントエンコードして送る（HTTP ヘッダーは Latin-1 のため）
+
+    Args:
+        req: HTTPリクエスト
+        default: 指定が無い場合のファイル名
+
+    Returns:
+        X-Filename ヘッダー（デコード済み）、クエリ filename、または default
+    """
+    filename = req.headers.get('X-Filename')
+    return unquote(filename) if filename else (req.params.get('filename') or default)
+
+
+def content_disposition(filename: str) -> str:
+    """
+    ダウンロード用の Content-Disposition の値
+
+    ASCII 以外のファイル名は filename* に UTF-8 で指定し（RFC 6266）、filename には置き換えた名前を指定する
+    """
+    if filename.isascii():
+        return f'attachment; filename="{filename}"'
+    fallback = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def create_file_response(data: bytes, filename: str, extra_headers: dict = None,
+                         content_type: str = XLSX_CONTENT_TYPE) -> func.HttpResponse:
+    """
+    ファイルダウンロード用のHTTPレスポンスを作成（セキュリティヘッダー付き）
+    
+    Args:
+        data: ファイルデータ
+        filename: ファイル名
+        extra_headers: 追加のレスポンスヘッダー
+        content_type: Content-Type（既定: XLSX）
+        
+    Returns:
+        HTTPレスポンス
+    """
+    headers = {
+        'Content-Type': content_type,
+        'Content-Disposition': content_disposition(filename),
+        **(extra_headers or {}),
+        **get_security_headers()
+    }
+    
+    return func.HttpResponse(data, status_code=200, headers=headers)
+
+
+def create_json_response(data: dict, extra_headers: dict = None, status_code: int = 200) -> func.HttpResponse:
+    """
+    JSON HTTPレスポンスを作成（セキュリティヘッダー付き）
+    
+    Args:
+        data: JSONデータ
+        extra_headers: 追加のレスポンスヘッダー
+        status_code: HTTPステータスコード
+        
+    Returns:
+        HTTPレスポンス
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        **(extra_headers or {}),
+        **get_security_headers()
+    }
+    
+    return func.HttpResponse(
+        json.dumps(data, ensure_ascii=False),
+        status_code=status_code,
+        headers=headers
+    )
+
+
+def create_error_response(message: str, status_code: int, extra_headers: dict = None) -> func.HttpResponse:
+    """
+    エラーレスポンスを作成（セキュリティヘッダー付き）
+    
+    Args:
+        message: エラーメッセージ
+        status_code: HTTPステータスコード
+        extra_headers: 追加のレスポンスヘッダー
+        
+    Returns:
+        HTTPレスポンス
+    """
+    headers = {
+        **(extra_headers or {}),
+        **get_security_headers()
+    }
+    
+    return func.HttpResponse(
+        message,
+        status_code=status_code,
+        headers=headers
+    )
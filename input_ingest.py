@@ -0,0 +1,332 @@
+"""
+リクエストボディの取り込みモジュール
+受信しながら入力を検証・ハッシュ計算し、不正な入力を全体の受信・バッファリング前に拒否する
+
+- Content-Length が MAX_FILE_SIZE を超える場合はボディを読まずに 413 で拒否
+- 先頭 512 バイトが揃った時点でマジックナンバーと OLE2 ヘッダーを検証
+- 受信したチャンクごとに SHA-256 を更新し、受信完了時に入力ハッシュ（キャッシュのキー）が確定
+- チャンクの供給元がストリームの場合は SpooledTemporaryFile に書き出す
+  （一定サイズまではメモリ上、超えた分は一時ファイル）
+- Content-Encoding: gzip / zstd のボディはチャンク単位で展開してスプールする。
+  MAX_FILE_SIZE は展開後のサイズに適用し、圧縮率が異常に高い入力（解凍爆弾）は展開途中で拒否する
+"""
+import hashlib
+import os
+import tempfile
+import zlib
+from typing import Iterable, Optional, Tuple
+
+from security_utils import (
+    MAX_FILE_SIZE,
+    MIN_FILE_SIZE,
+    OLE2_HEADER_SIZE,
+    OLE2_SIGNATURE,
+    XLS_MAGIC_NUMBERS,
+    validate_ole2_header,
+)
+
+# ボディを検証・ハッシュ計算する単位
+CHUNK_SIZE = 1024 * 1024
+
+# スプールをメモリ上に保持する上限（超えた分は一時ファイルに書き出す）
+SPOOL_MEMORY_LIMIT = 16 * 1024 * 1024
+
+# 対応する Content-Encoding
+ENCODING_GZIP = 'gzip'
+ENCODING_ZSTD = 'zstd'
+ENCODING_ALIASES = {'gzip': ENCODING_GZIP, 'x-gzip': ENCODING_GZIP, 'zstd': ENCODING_ZSTD}
+
+# 圧縮率の検証を始める展開後のサイズ（小さな入力は圧縮率が高くても許容する）
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+INVALID_FORMAT_MESSAGE = "有効なXLSファイル形式ではありません。XLS形式のファイルのみサポートされています。"
+
+
+class IngestError(ValueError):
+    """
+    取り込み中に入力を拒否した
+
+    Attributes:
+        status_code: HTTPステータスコード
+        event: セキュリティイベントの種類
+        size: 拒否した時点までに受信したサイズ（Content-Length による拒否ではその値）
+    """
+
+    def __init__(self, message: str, status_code: int, event: str, size: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.event = event
+        self.size = size
+
+
+def _too_large(size: int, max_size: int) -> IngestError:
+    return IngestError(
+        f"ファイルサイズが上限を超えています（最大{max_size // 1024 // 1024}MB）。"
+        f"現在のサイズ: {size // 1024 // 1024}MB以上",
+        413, 'file_too_large', size,
+    )
+
+
+def get_max_decompression_ratio() -> float:
+    """展開後のサイズと圧縮サイズの比の上限（MAX_DECOMPRESSION_RATIO、既定: 100）"""
+    try:
+        return max(1.0, float(os.environ.get('MAX_DECOMPRESSION_RATIO', '100')))
+    except ValueError:
+        return 100.0
+
+
+def check_content_length(content_length: Optional[str], max_size: int = MAX_FILE_SIZE):
+    """
+    Content-Length ヘッダーでボディを読む前にサイズを検証
+
+    Args:
+        content_length: Content-Length ヘッダーの値（ない場合は None）
+        max_size: 最大許容サイズ（バイト）
+
+    Raises:
+        IngestError: 宣言されたサイズが上限を超えている
+    """
+    try:
+        declared = int(content_length) if content_length else None
+    except ValueError:
+        declared = None
+    if declared is not None and declared > max_size:
+        raise _too_large(declared, max_size)
+
+
+class InputIngestor:
+    """
+    チャンク単位で受け取った入力を検証・ハッシュ計算・スプールする
+
+    feed() でチャンクを渡し、finish() で (入力データ, SHA-256) を受け取る。
+    サイズ超過・形式不正はそのチャンクを受け取った時点で IngestError を送出する
+    """
+
+    def __init__(self, max_size: int = MAX_FILE_SIZE, spool: bool = True):
+        """
+        Args:
+            max_size: 最大許容サイズ（バイト）
+            spool: 受け取ったチャンクを保持するか（呼び出し元がボディ全体を保持している場合は False）
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._head = bytearray()
+        self._header_checked = False
+        self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT) if spool else None
+
+    def feed(self, chunk: bytes):
+        """
+        チャンクを取り込む
+
+        Raises:
+            IngestError: サイズ超過または形式不正
+        """
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise _too_large(self.size, self.max_size)
+        if not self._header_checked:
+            self._head += chunk[:OLE2_HEADER_SIZE - len(self._head)]
+            self._check_header(final=False)
+        self._sha256.update(chunk)
+        if self._spool is not None:
+            self._spool.write(chunk)
+
+    def finish(self, data: bytes = None) -> Tuple[bytes, str]:
+        """
+        取り込みを完了
+
+        Args:
+            data: 呼び出し元が保持しているボディ全体（spool=False の場合）
+
+        Returns:
+            (入力データ, 入力データの SHA-256 の16進文字列)
+
+        Raises:
+            IngestError: 空・小さすぎる入力、または形式不正
+        """
+        if self.size == 0:
+            raise IngestError("リクエストボディにXLSファイルが含まれていません。", 400, 'empty_request', 0)
+        if self.size < MIN_FILE_SIZE:
+            raise IngestError("ファイルサイズが小さすぎます", 400, 'validation_failed', self.size)
+        if not self._header_checked:
+            self._check_header(final=True)
+        if self._spool is not None:
+            self._spool.seek(0)
+            data = self._spool.read()
+            self.close()
+        return data, self._sha256.hexdigest()
+
+    def close(self):
+        """スプールを破棄"""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _check_header(self, final: bool):
+        """
+        先頭部分のマジックナンバーと OLE2 ヘッダーを検証
+
+        判定に必要なバイト数が揃っていない場合は何もしない（final の場合は揃っている分で判定）
+        """
+        head = bytes(self._head)
+        if head.startswith(OLE2_SIGNATURE):
+            if len(head) < OLE2_HEADER_SIZE and not final:
+                return
+            is_valid, error_message = validate_ole2_header(head, self.max_size)
+        elif len(head) < len(OLE2_SIGNATURE) and not final:
+            return
+        else:
+            # OLE2 以外は BIFF5 のストリームのみ受け付ける
+            is_valid = head.startswith(XLS_MAGIC_NUMBERS[1])
+            error_message = INVALID_FORMAT_MESSAGE
+        if not is_valid:
+            raise IngestError(error_message, 400, 'validation_failed', self.size)
+        self._header_checked = True
+        self._head = bytearray()
+
+
+def iter_chunks(data: bytes, chunk_size: int = CHUNK_SIZE) -> Iterable[memoryview]:
+    """バイナリデータをコピーせずにチャンクに分割"""
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+def parse_content_encoding(content_encoding: Optional[str]) -> Optional[str]:
+    """
+    Content-Encoding ヘッダーを解釈
+
+    Args:
+        content_encoding: Content-Encoding ヘッダーの値（ない場合は None）
+
+    Returns:
+        ENCODING_GZIP / ENCODING_ZSTD。圧縮されていない場合は None
+
+    Raises:
+        IngestError: 対応していない（または多重の）エンコーディング
+    """
+    codings = [coding.strip().lower() for coding in (content_encoding or '').split(',')]
+    codings = [coding for coding in codings if coding and coding != 'identity']
+    if not codings:
+        return None
+    if len(codings) > 1 or codings[0] not in ENCODING_ALIASES:
+        raise IngestError(
+            f"対応していない Content-Encoding です: {content_encoding[:50]}（gzip / zstd に対応）",
+            415, 'unsupported_encoding', 0,
+        )
+    return ENCODING_ALIASES[codings[0]]
+
+
+def iter_decoded(body: bytes, encoding: str, max_ratio: float = None) -> Iterable[bytes]:
+    """
+    圧縮されたボディをチャンク単位で展開
+
+    展開後のサイズが RATIO_CHECK_MIN_BYTES を超えた後は、それまでに読んだ圧縮データとの比が
+    max_ratio を超えた時点で展開を打ち切る
+
+    Args:
+        body: 圧縮されたボディ
+        encoding: ENCODING_GZIP / ENCODING_ZSTD
+        max_ratio: 圧縮率の上限（省略時は MAX_DECOMPRESSION_RATIO）
+
+    Yields:
+        展開したデータ（最大 CHUNK_SIZE バイト）
+
+    Raises:
+        IngestError: 解凍爆弾と判定した（413）、または圧縮データが不正（400）
+    """
+    max_ratio = max_ratio or get_max_decompression_ratio()
+    decoder = _iter_gzip if encoding == ENCODING_GZIP else _iter_zstd
+    produced = 0
+    try:
+        for chunk, consumed in decoder(body):
+            produced += len(chunk)
+            if produced > RATIO_CHECK_MIN_BYTES and produced > consumed * max_ratio:
+                raise IngestError(
+                    f"圧縮率が高すぎるため展開を中止しました（上限 {max_ratio:g} 倍）",
+                    413, 'decompression_bomb', produced,
+                )
+            yield chunk
+    except IngestError:
+        raise
+    except (zlib.error, OSError, ValueError) as e:
+        raise IngestError(f"圧縮データを展開できません（{encoding}）: {str(e)[:100]}",
+                          400, 'invalid_encoding', produced)
+
+
+def _iter_gzip(body: bytes):
+    """gzip を展開し、(展開したデータ, 読み込んだ圧縮データのサイズ) を返す（連結されたメンバーに対応）"""
+    decompressor = zlib.decompressobj(wbits=31)
+    consumed = 0
+    for chunk in iter_chunks(body):
+        data = chunk
+        while data:
+            if decompressor.eof:
+                decompressor = zlib.decompressobj(wbits=31)
+            # 出力を CHUNK_SIZE に制限し、残りの入力は unconsumed_tail から続けて展開する
+            output = decompressor.decompress(data, CHUNK_SIZE)
+            rest = decompressor.unconsumed_tail or (decompressor.unused_data if decompressor.eof else b'')
+            consumed += len(data) - len(rest)
+            data = rest
+            yield output, consumed
+    output = decompressor.flush()
+    if not decompressor.eof:
+        raise zlib.error("gzip データが途中で終わっています")
+    yield output, consumed
+
+
+def _iter_zstd(body: bytes):
+    """zstd を展開し、(展開したデータ, 読み込んだ圧縮データのサイズ) を返す"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise IngestError("zstd で圧縮されたボディの展開には pyarrow が必要です", 415, 'unsupported_encoding', 0)
+
+    source = pa.BufferReader(pa.py_buffer(body))
+    stream = pa.CompressedInputStream(source, 'zstd')
+    while True:
+        output = stream.read(CHUNK_SIZE)
+        if not output:
+            break
+        yield output, source.tell()
+
+
+def ingest_request(req, max_size: int = MAX_FILE_SIZE) -> Tuple[bytes, str]:
+    """
+    HTTPリクエストのボディを取り込む
+
+    Content-Length で事前に拒否したうえで、ボディをチャンク単位で検証・ハッシュ計算する。
+    Python の v1 プログラミングモデルではボディは受信済みの bytes として渡されるため、
+    圧縮されていないボディはスプールせずにそのまま入力データとして返す。
+    圧縮されたボディ（Content-Encoding: gzip / zstd）は展開しながら検証・ハッシュ計算してスプールし、
+    サイズの上限は展開後のサイズに適用する（入力ハッシュも展開後のデータのもの）
+
+    Args:
+        req: func.HttpRequest
+        max_size: 最大許容サイズ（バイト）
+
+    Returns:
+        (入力データ, 入力データの SHA-256 の16進文字列)
+
+    Raises:
+        IngestError: サイズ超過・空・形式不正・解凍爆弾、対応していないエンコーディング（415）
+    """
+    check_content_length(req.headers.get('Content-Length'), max_size)
+    encoding = parse_content_encoding(req.headers.get('Content-Encoding'))
+    body = req.get_body() or b''
+    if encoding is None or not body:
+        ingestor = InputIngestor(max_size, spool=False)
+        for chunk in iter_chunks(body):
+            ingestor.feed(chunk)
+        return ingestor.finish(body)
+
+    ingestor = InputIngestor(max_size)
+    try:
+        for chunk in iter_decoded(body, encoding):
+            ingestor.feed(chunk)
+        return ingestor.finish()
+    finally:
+        ingestor.close()
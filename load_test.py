@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+convert_http の負荷試験スクリプト（docker-compose の Functions + Azurite を対象）
+
+生成したサイズ別のXLSコーパスから重み付きで入力を選び、指定した同時実行数・到着レートで
+リクエストを送信して以下を集計する
+- レイテンシの p50 / p95 / p99（全体・サイズ別）
+- スループット（完了リクエスト数 / 秒）
+- エラー率（HTTP ステータス・接続エラー別）
+- 直接レスポンス（10MB未満）と Blob URL 応答（10MB以上）の比率
+
+到着レート指定時はオープンループ（ポアソン到着）で送信し、レイテンシは予定到着時刻から計測する
+（サーバーの遅延で送信が遅れた分も含める）。指定しない場合は各ワーカーが応答を受け取り次第
+次のリクエストを送信する（クローズドループ）
+
+結果は履歴ファイル（JSON Lines）に追記し、同じ条件の前回の結果と比較する
+
+使い方:
+    docker-compose up -d
+    python load_test.py [--concurrency 8] [--rate 5] [--duration 60] [--mix small=70,medium=25,large=5]
+    python load_test.py --content-encoding gzip   # 圧縮したボディで送信（Content-Encoding）
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from benchmark_conversion import create_workbook
+from measure_cold_start import git_revision
+
+DEFAULT_URL = 'http://localhost:8080/api/convert_http'
+HISTORY_FILE = 'load_test_history.jsonl'
+CORPUS_DIR = os.path.join('test_output', 'load_corpus')
+
+# サイズ区分 → (行数, 列数)
+CORPUS_SIZES = {
+    'small': (200, 5),
+    'medium': (5000, 10),
+    'large': (30000, 20),
+    'xlarge': (65000, 40),   # 出力が 10MB を超え、Blob URL 応答になる大きさ
+}
+
+DEFAULT_MIX = 'small=70,medium=25,large=4,xlarge=1'
+
+# レスポンスの種類
+RESULT_INLINE = 'inline'       # 変換結果を直接返却
+RESULT_BLOB_URL = 'blob_url'   # Blob Storage のダウンロードURLを返却
+RESULT_ERROR = 'error'
+
+
+def parse_mix(text: str) -> dict:
+    """
+    サイズ区分の重みを解析（例: "small=70,medium=25,large=5"）
+
+    Raises:
+        ValueError: 不明なサイズ区分・不正な重み
+    """
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in CORPUS_SIZES:
+            raise ValueError(f"不明なサイズ区分です: {name}（{', '.join(CORPUS_SIZES)}）")
+        mix[name] = float(weight or 1)
+        if mix[name] < 0:
+            raise ValueError(f"重みが不正です: {item}")
+    if not any(mix.values()):
+        raise ValueError("重みの合計が 0 です")
+    return mix
+
+
+def load_corpus(names, corpus_dir: str = CORPUS_DIR) -> dict:
+    """
+    サイズ区分ごとのXLSを読み込む（未生成の場合は作成してディレクトリに保存）
+
+    Returns:
+        サイズ区分 → XLSファイルのバイナリデータ
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = {}
+    for name in names:
+        rows, cols = CORPUS_SIZES[name]
+        path = os.path.join(corpus_dir, f'{name}_{rows}x{cols}.xls')
+        if not os.path.exists(path):
+            print(f"コーパスを作成中: {path}")
+            with open(path, 'wb') as f:
+                f.write(create_workbook(rows, cols))
+        with open(path, 'rb') as f:
+            corpus[name] = f.read()
+    return corpus
+
+
+def encode_corpus(corpus: dict, encoding: str) -> dict:
+    """
+    コーパスを Content-Encoding で圧縮
+
+    Args:
+        corpus: サイズ区分 → XLSファイルのバイナリデータ
+        encoding: 'gzip' / 'zstd'（zstd には pyarrow が必要）
+
+    Returns:
+        サイズ区分 → 圧縮したバイナリデータ
+    """
+    if encoding == 'gzip':
+        import gzip
+        return {name: gzip.compress(data, 6) for name, data in corpus.items()}
+    import pyarrow as pa
+    return {name: pa.compress(data, 'zstd', asbytes=True) for name, data in corpus.items()}
+
+
+def percentile(sorted_values: list, fraction: float):
+    """
+    昇順に並んだ値の百分位数（最近順位法）
+
+    Args:
+        sorted_values: 昇順の値
+        fraction: 0〜1（例: 0.95）
+
+    Returns:
+        百分位数（値が無い場合は None）
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * fraction // 1))
+    return sorted_values[int(rank) - 1]
+
+
+class _Client:
+    """ワーカースレッドごとの HTTP 接続（Keep-Alive、エラー時は再接続）"""
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        self._connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self._netloc = parts.netloc
+        self._path = parts.path + (f'?{parts.query}' if parts.query else '')
+        self._timeout = timeout
+        self._connection = None
+
+    def post(self, body: bytes, filename: str, content_encoding: str = None):
+        """
+        XLS を送信し、(ステータス, Content-Type, 応答ボディ) を返す
+        """
+        if self._connection is None:
+            self._connection = self._connection_class(self._netloc, timeout=self._timeout)
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Filename': filename,
+        }
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        try:
+            self._connection.request('POST', self._path, body=body, headers=headers)
+            response = self._connection.getresponse()
+            return response.status, response.getheader('Content-Type', ''), response.read()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def classify_response(status: int, content_type: str, body: bytes) -> str:
+    """レスポンスを直接返却・Blob URL・エラーに分類"""
+    if status != 200:
+        return RESULT_ERROR
+    if content_type.startswith('application/json'):
+        try:
+            return RESULT_BLOB_URL if 'download_url' in json.loads(body) else RESULT_ERROR
+        except ValueError:
+            return RESULT_ERROR
+    return RESULT_INLINE
+
+
+def run_load(url: str, corpus: dict, mix: dict, concurrency: int, duration: float,
+             rate: float = None, max_requests: int = None, timeout: float = 300, seed: int = None,
+             content_encoding: str = None) -> list:
+    """
+    負荷をかけてリクエストごとの結果を返す
+
+    Args:
+        url: convert_http の URL
+        corpus: サイズ区分 → XLSデータ
+        mix: サイズ区分 → 重み
+        concurrency: 同時実行数（ワーカースレッド数）
+        duration: 新しいリクエストを開始する時間（秒）
+        rate: 到着レート（リクエスト/秒、None はクローズドループ）
+        max_requests: 送信するリクエスト数の上限
+        timeout: 1リクエストのタイムアウト（秒）
+        seed: 入力選択・到着間隔の乱数シード
+        content_encoding: corpus の圧縮形式（Content-Encoding ヘッダーとして送信）
+
+    Returns:
+        [{'size', 'latency', 'status', 'result', 'bytes_in', 'bytes_out'}]
+    """
+    rng = random.Random(seed)
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    jobs = queue.Queue(maxsize=0 if rate else concurrency)
+    results = []
+    results_lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def produce():
+        scheduled = start
+        count = 0
+        while max_requests is None or count < max_requests:
+            if rate:
+                scheduled += rng.expovariate(rate)
+                if scheduled >= deadline:
+                    break
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+            elif time.perf_counter() >= deadline:
+                break
+            jobs.put((rng.choices(names, weights)[0], scheduled if rate else None))
+            count += 1
+        for _ in range(concurrency):
+            jobs.put(None)
+
+    def work():
+        client = _Client(url, timeout)
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                size, scheduled = job
+                body = corpus[size]
+                sent = time.perf_counter()
+                record = {'size': size, 'bytes_out': len(body), 'bytes_in': 0}
+                try:
+                    status, content_type, response_body = client.post(body, f'{size}.xls', content_encoding)
+                    record.update(status=status, result=classify_response(status, content_type, response_body),
+                                  bytes_in=len(response_body))
+                except Exception as e:
+                    record.update(status=type(e).__name__, result=RESULT_ERROR)
+                # オープンループでは予定到着時刻からのレイテンシ（送信待ちを含む）
+                record['latency'] = time.perf_counter() - (scheduled if scheduled is not None else sent)
+                record['finished'] = time.perf_counter() - start
+                with results_lock:
+                    results.append(record)
+        finally:
+            client.close()
+
+    producer = threading.Thread(target=produce, name='load-producer', daemon=True)
+    workers = [threading.Thread(target=work, name=f'load-worker-{index}', daemon=True)
+               for index in range(concurrency)]
+    producer.start()
+    for worker in workers:
+        worker.start()
+    producer.join()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    """
+    リクエストごとの結果を集計
+
+    Returns:
+        {'requests', 'throughput', 'error_rate', 'errors', 'inline_ratio', 'blob_url_ratio',
+         'latency': {'p50', 'p95', 'p99', 'mean', 'max'}, 'by_size': {サイズ区分: {...}}}
+    """
+    def latency_summary(records):
+        latencies = sorted(record['latency'] for record in records)
+        if not latencies:
+            return {}
+        return {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': sum(latencies) / len(latencies),
+            'max': latencies[-1],
+        }
+
+    total = len(results)
+    succeeded = [record for record in results if record['result'] != RESULT_ERROR]
+    errors = {}
+    for record in results:
+        if record['result'] == RESULT_ERROR:
+            errors[str(record['status'])] = errors.get(str(record['status']), 0) + 1
+    inline = sum(1 for record in succeeded if record['result'] == RESULT_INLINE)
+
+    summary = {
+        'requests': total,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'error_rate': (total - len(succeeded)) / total if total else 0.0,
+        'errors': errors,
+        'inline_ratio': inline / len(succeeded) if succeeded else None,
+        'blob_url_ratio': (len(succeeded) - inline) / len(succeeded) if succeeded else None,
+        'bytes_out': sum(record['bytes_out'] for record in results),
+        'bytes_in': sum(record['bytes_in'] for record in results),
+        # 成功したリクエストのレイテンシ（エラー応答は集計から除く）
+        'latency': latency_summary(succeeded),
+        'by_size': {},
+    }
+    for size in CORPUS_SIZES:
+        records = [record for record in results if record['size'] == size]
+        if records:
+            ok = [record for record in records if record['result'] != RESULT_ERROR]
+            summary['by_size'][size] = {
+                'requests': len(records),
+                'errors': len(records) - len(ok),
+                'latency': latency_summary(ok),
+            }
+    return summary
+
+
+def load_previous(history_file: str, config: dict):
+    """同じ条件（URL 以外の負荷設定）の前回の結果を返す"""
+    if not os.path.exists(history_file):
+        return None
+    previous = None
+    with open(history_file, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('config') == config:
+                previous = record
+    return previous
+
+
+def _format_seconds(value) -> str:
+    return f"{value * 1000:9.1f}ms" if value is not None else '        -'
+
+
+def print_summary(summary: dict):
+    """集計結果を表示"""
+    latency = summary['latency']
+    print(f"\nリクエスト数:   {summary['requests']}")
+    print(f"スループット:   {summary['throughput']:.2f} req/s")
+    print(f"エラー率:       {summary['error_rate'] * 100:.1f}% {summary['errors'] or ''}")
+    if summary['inline_ratio'] is not None:
+        print(f"応答の種類:     直接 {summary['inline_ratio'] * 100:.1f}% / "
+              f"Blob URL {summary['blob_url_ratio'] * 100:.1f}%")
+    print(f"\n{'区分':<10} {'件数':>6} {'エラー':>6} {'p50':>11} {'p95':>11} {'p99':>11}")
+    print("-" * 60)
+    rows = [('全体', summary['requests'], sum(summary['errors'].values()), latency)]
+    rows += [(size, item['requests'], item['errors'], item['latency']) for size, item in summary['by_size'].items()]
+    for label, count, error_count, values in rows:
+        print(f"{label:<10} {count:>6} {error_count:>6} {_format_seconds(values.get('p50'))} "
+              f"{_format_seconds(values.get('p95'))} {_format_seconds(values.get('p99'))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='convert_http の負荷試験')
+    parser.add_argument('--url', default=DEFAULT_URL, help='convert_http の URL')
+    parser.add_argument('--concurrency', type=int, default=8, help='同時実行数')
+    parser.add_argument('--rate', type=float, help='到着レート（リクエスト/秒、省略時はクローズドループ）')
+    parser.add_argument('--duration', type=float, default=60, help='リクエストを開始する時間（秒）')
+    parser.add_argument('--requests', type=int, help='送信するリクエスト数の上限')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'サイズ区分の重み（既定: {DEFAULT_MIX}）')
+    parser.add_argument('--timeout', type=float, default=300, help='1リクエストのタイムアウト（秒）')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード')
+    parser.add_argument('--corpus-dir', default=CORPUS_DIR, help='生成したコーパスの保存先')
+    parser.add_argument('--label', default='', help='結果に付けるラベル（比較対象の区別用）')
+    parser.add_argument('--history', default=HISTORY_FILE, help='履歴ファイル（JSON Lines）')
+    parser.add_argument('--content-encoding', choices=['gzip', 'zstd'],
+                        help='ボディを圧縮して送信（Content-Encoding）')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    corpus = load_corpus([name for name, weight in mix.items() if weight > 0], args.corpus_dir)
+    config = {
+        'label': args.label,
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'duration': args.duration,
+        'requests': args.requests,
+        'mix': mix,
+    }
+    if args.content_encoding:
+        corpus = encode_corpus(corpus, args.content_encoding)
+        config['content_encoding'] = args.content_encoding
+
+    print("=" * 70)
+    print(f"負荷試験: {args.url}")
+    print(f"同時実行数 {args.concurrency}, 到着レート {args.rate or 'クローズドループ'}, "
+          f"{args.duration}秒, 構成 {args.mix}"
+          + (f", {args.content_encoding} 圧縮" if args.content_encoding else ''))
+    print("=" * 70)
+
+    start = time.perf_counter()
+    results = run_load(args.url, corpus, mix, args.concurrency, args.duration, rate=args.rate,
+                       max_requests=args.requests, timeout=args.timeout, seed=args.seed,
+                       content_encoding=args.content_encoding)
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+
+    previous = load_previous(args.history, config)
+    if previous:
+        before = previous['summary']
+        print(f"\n[前回比較] {previous['timestamp']} ({previous.get('revision') or '-'})")
+        print(f"   throughput: {before['throughput']:.2f} → {summary['throughput']:.2f} req/s")
+        for key in ('p50', 'p95', 'p99'):
+            old, new = before['latency'].get(key), summary['latency'].get(key)
+            if old is not None and new is not None:
+                print(f"   {key}: {old * 1000:.1f} → {new * 1000:.1f}ms ({(new - old) * 1000:+.1f}ms)")
+
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'timestamp': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'url': args.url,
+            'config': config,
+            'elapsed_seconds': elapsed,
+            'summary': summary,
+        }, ensure_ascii=False) + '\n')
+    print(f"\n履歴に追記しました: {args.history}")
+
+    return 0 if results else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
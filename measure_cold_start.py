@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+コールドスタート計測スクリプト
+
+新しいプロセスで関数モジュールを読み込み、以下を計測する
+- `python -X importtime` による import 時間（累積・上位モジュール）
+- 初回リクエスト（検証エラー / 変換）までのレイテンシ
+- `--warmup` 指定時はウォームアップ（warmup_utils.warm_up）後の初回リクエストのレイテンシ
+
+結果は履歴ファイル（JSON Lines）に追記し、前回の計測結果と比較する
+
+使い方:
+    python measure_cold_start.py [--engine native] [--warmup] [--history cold_start_history.jsonl]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+HISTORY_FILE = 'cold_start_history.jsonl'
+TARGET_MODULES = ['convert_http', 'convert_blob']
+
+# 子プロセスで実行する初回リクエスト計測コード
+_FIRST_REQUEST_SCRIPT = r'''
+import json, sys, time
+start = time.perf_counter()
+import azure.functions as func
+import convert_http
+imported = time.perf_counter()
+import_seconds = imported - start
+
+warmup_seconds = None
+if len(sys.argv) > 2 and sys.argv[2] == '--warmup':
+    from warmup_utils import warm_up
+    warm_up(include_storage=False)
+    imported = time.perf_counter()
+    warmup_seconds = imported - start - import_seconds
+
+invalid = func.HttpRequest('POST', '/api/convert_http', headers={}, body=b'not an xls file' * 10)
+convert_http.main(invalid)
+rejected = time.perf_counter()
+heavy_after_reject = sorted(m for m in ('pandas', 'openpyxl', 'azure.storage.blob') if m in sys.modules)
+
+with open(sys.argv[1], 'rb') as f:
+    body = f.read()
+request = func.HttpRequest('POST', '/api/convert_http', headers={'X-Filename': 'cold.xls'}, body=body)
+response = convert_http.main(request)
+converted = time.perf_counter()
+
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'first_reject_seconds': rejected - imported,
+    'first_conversion_seconds': converted - rejected,
+    'first_conversion_status': response.status_code,
+    'heavy_modules_after_reject': heavy_after_reject,
+    'warmup_seconds': warmup_seconds,
+}))
+'''
+
+
+def measure_import_time(module: str, env: dict) -> dict:
+    """
+    `python -X importtime` でモジュールの import 時間を計測
+
+    Args:
+        module: 計測対象のモジュール名
+        env: 子プロセスの環境変数
+
+    Returns:
+        {'total_seconds': float, 'top_modules': [(モジュール名, 累積秒)]}
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env, check=True,
+    )
+
+    # 形式: "import time: self [us] | cumulative | imported package"
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((name.rstrip(), int(cumulative)))
+
+    # インデントのないエントリがトップレベルの import
+    top_level = [us for name, us in entries if not name.startswith('  ')]
+    total_us = sum(top_level)
+    heaviest = sorted(
+        ((name.strip(), us) for name, us in entries if name.strip() != module),
+        key=lambda item: item[1], reverse=True,
+    )[:10]
+    return {
+        'total_seconds': total_us / 1e6,
+        'top_modules': [(name, us / 1e6) for name, us in heaviest],
+    }
+
+
+def measure_first_request(xls_path: str, env: dict, warmup: bool = False) -> dict:
+    """
+    新しいプロセスで初回リクエストのレイテンシを計測
+
+    Args:
+        xls_path: 変換に使用するXLSファイルのパス
+        env: 子プロセスの環境変数
+        warmup: 初回リクエスト前にウォームアップを実行するか
+
+    Returns:
+        計測結果
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', _FIRST_REQUEST_SCRIPT, xls_path] + (['--warmup'] if warmup else []),
+        capture_output=True, text=True, env=env, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def create_sample_xls(path: str):
+    """計測用の小さなXLSを作成"""
+    import xlwt
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('cold-start')
+    for row in range(50):
+        for col in range(5):
+            ws.write(row, col, row * col if col else f'行{row}')
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def git_revision() -> str:
+    """現在のコミットIDを返す（取得できない場合は空文字）"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def load_previous(history_file: str, engine: str, warmup: bool = False):
+    """同じエンジン・ウォームアップ条件の前回計測結果を返す"""
+    if not os.path.exists(history_file):
+        return None
+    previous = None
+    with open(history_file, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('engine') == engine and record.get('warmup', False) == warmup:
+                previous = record
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コールドスタート計測')
+    parser.add_argument('--engine', default='pandas', help='CONVERSION_ENGINE の値')
+    parser.add_argument('--warmup', action='store_true', help='初回リクエスト前にウォームアップを実行')
+    parser.add_argument('--history', default=HISTORY_FILE, help='履歴ファイル（JSON Lines）')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['CONVERSION_ENGINE'] = args.engine
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    record = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python_version': sys.version.split()[0],
+        'engine': args.engine,
+        'warmup': args.warmup,
+        'imports': {},
+    }
+
+    print("=" * 70)
+    print(f"コールドスタート計測（engine={args.engine}, warmup={'あり' if args.warmup else 'なし'}）")
+    print("=" * 70)
+
+    for module in TARGET_MODULES:
+        measured = measure_import_time(module, env)
+        record['imports'][module] = measured
+        print(f"\n[import] {module}: {measured['total_seconds']:.3f}秒")
+        for name, seconds in measured['top_modules'][:5]:
+            print(f"   {seconds:8.3f}秒  {name}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xls_path = os.path.join(tmp, 'cold.xls')
+        create_sample_xls(xls_path)
+        record['first_request'] = measure_first_request(xls_path, env, warmup=args.warmup)
+
+    first = record['first_request']
+    print("\n[初回リクエスト]")
+    print(f"   import:       {first['import_seconds']:.3f}秒")
+    if first['warmup_seconds'] is not None:
+        print(f"   ウォームアップ: {first['warmup_seconds']:.3f}秒（トラフィック受信前に実行）")
+    print(f"   検証エラー:   {first['first_reject_seconds']:.3f}秒 "
+          f"(読み込み済みの重いモジュール: {first['heavy_modules_after_reject'] or 'なし'})")
+    print(f"   初回変換:     {first['first_conversion_seconds']:.3f}秒 "
+          f"(HTTP {first['first_conversion_status']})")
+
+    previous = load_previous(args.history, args.engine, args.warmup)
+    if previous:
+        before = previous['first_request']
+        print(f"\n[前回比較] {previous['timestamp']} ({previous.get('revision') or '-'})")
+        for key in ('import_seconds', 'first_conversion_seconds'):
+            delta = first[key] - before[key]
+            print(f"   {key}: {before[key]:.3f} → {first[key]:.3f} ({delta:+.3f}秒)")
+
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"\n履歴に追記しました: {args.history}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import azure.functions as func
+import logging
+import metrics_registry
+from security_utils import get_security_headers
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    プロセス内のメトリクス（変換件数・入出力サイズ・段階ごとの所要時間・キャッシュ・受付拒否）を
+    Prometheus のテキスト形式で返す
+
+    値はこのリクエストを処理したインスタンス（ワーカープロセス）のもの。
+    スケールアウト時はインスタンスごとの値になる
+    """
+    logging.debug('Metrics requested.')
+
+    return func.HttpResponse(
+        metrics_registry.render(),
+        status_code=200,
+        headers={
+            'Content-Type': metrics_registry.CONTENT_TYPE,
+            'Cache-Control': 'no-store',
+            **get_security_headers()
+        }
+    )
@@ -0,0 +1,301 @@
+"""
+プロセス内のメトリクスレジストリモジュール
+変換件数・入出力サイズ・処理段階ごとの所要時間・キャッシュのヒット・受付拒否を集計し、
+Prometheus のテキスト形式で出力する（metrics 関数）
+
+- 記録はスレッドごとのシャード（threading.local の dict）への加算のみで、ロックを取らない
+- ロックはシャードの作成（スレッドごとに初回のみ）と出力時の集計でのみ使用する
+- 終了したスレッドのシャードは出力時に集計済みの値へ畳み込む
+- 値はプロセス（インスタンス）ごと。Application Insights のサンプリングの影響を受けない
+"""
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import tracing
+
+METRIC_PREFIX = 'xls2xlsx_'
+
+# Prometheus テキスト形式の Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 入出力サイズのバケット（バイト、16KB〜64MB）
+BYTES_BUCKETS = tuple(16 * 1024 * 4 ** exponent for exponent in range(7))
+
+# 所要時間のバケット（秒）
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: List['_Family'] = []
+_registry_lock = threading.Lock()
+
+
+class _Family:
+    """レジストリに登録するメトリクスの基底クラス"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        with _registry_lock:
+            _registry.append(self)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+    def clear(self):
+        pass
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _Metric(_Family):
+    """スレッドごとのシャードに値を記録するメトリクスの基底クラス"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation)
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+
+    def _shard(self) -> dict:
+        """呼び出し元スレッドのシャード（初回のみロックを取って登録）"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _merge(self, target: dict, values: dict):
+        raise NotImplementedError
+
+    def collect(self) -> dict:
+        """全スレッドのシャードを合算（ラベル値のタプル → 値）"""
+        merged = {}
+        with self._lock:
+            live = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    live.append((thread, values))
+                else:
+                    self._merge(self._retired, values)
+            self._shards = live
+            self._merge(merged, self._retired)
+            for _, values in live:
+                # dict.copy() は GIL の下で一度に行われるため、記録中のスレッドと競合しない
+                self._merge(merged, values.copy())
+        return merged
+
+    def clear(self):
+        """記録した値をすべて破棄（テスト用）"""
+        with self._lock:
+            for _, values in self._shards:
+                values.clear()
+            self._retired.clear()
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        """値を加算"""
+        values = self._shard()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def _merge(self, target: dict, values: dict):
+        for key, value in values.items():
+            target[key] = target.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """バケットごとの観測数と合計値を記録するヒストグラム"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """値を記録"""
+        values = self._shard()
+        key = self._key(labels)
+        entry = values.get(key)
+        if entry is None:
+            # バケットごとの観測数（末尾は +Inf）と合計値
+            entry = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの所要時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _merge(self, target: dict, values: dict):
+        for key, entry in values.items():
+            entry = list(entry)
+            current = target.get(key)
+            if current is None:
+                target[key] = entry
+            else:
+                target[key] = [a + b for a, b in zip(current, entry)]
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for key, entry in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, entry[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ('le',), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Family):
+    """出力時にコールバックで取得する値（プール・キャッシュの現在の状態）"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Optional[float]]):
+        """
+        Args:
+            callback: 現在の値を返す関数（None を返した場合は出力しない）
+        """
+        super().__init__(name, documentation)
+        self._callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            value = self._callback()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return self._header() + [f"{self.name} {_format_value(value)}"]
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def render() -> str:
+    """登録済みのすべてのメトリクスを Prometheus のテキスト形式で出力"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    """すべてのメトリクスの記録を破棄（テスト用）"""
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        metric.clear()
+
+
+# 変換件数（source: http / blob、outcome: success・失敗種別・Blobの処理結果）
+CONVERSIONS = Counter('conversions_total', '変換要求の件数（入力元・結果・エンジン別）',
+                      ('source', 'outcome', 'engine'))
+INPUT_BYTES = Histogram('input_bytes', '入力XLSのサイズ（バイト）', ('source',), BYTES_BUCKETS)
+OUTPUT_BYTES = Histogram('output_bytes', '変換結果のサイズ（バイト）', ('source', 'format'), BYTES_BUCKETS)
+# stage: ingest / download / convert / parse / write / upload / probe / request
+STAGE_SECONDS = Histogram('stage_seconds', '処理段階ごとの所要時間（秒）', ('stage',))
+# cache: negative / single_flight / output / client / result_store / probe、result: hit / miss
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'キャッシュの参照件数（キャッシュ・結果別）', ('cache', 'result'))
+REJECTIONS = Counter('rejections_total', '変換前に拒否した要求の件数（理由別）', ('reason',))
+# reason: latency / memory / memory_limit / cpu_limit / timeout
+SLOW_CONVERSIONS = Counter('slow_conversions_total', '入力サイズに対して遅い・メモリを多く使った変換の件数（理由別）',
+                           ('reason',))
+
+
+def observe_conversion(source: str, outcome: str, engine: str, input_bytes: int = None,
+                       output: bytes = None, stats: dict = None, coalesced: bool = False):
+    """
+    変換1件の結果を記録（現在のトレーシングのスパンにも属性として記録する）
+
+    Args:
+        source: 入力元（http / blob）
+        outcome: 結果（success・失敗種別・Blobの処理結果）
+        engine: 変換エンジン
+        input_bytes: 入力サイズ
+        output: 変換結果のバイナリデータ
+        stats: 変換統計（timings があれば段階ごとの所要時間を記録）
+        coalesced: 他の要求の変換結果を共有した（所要時間は変換した要求のみ記録する）
+    """
+    CONVERSIONS.inc(source=source, outcome=outcome, engine=engine or '')
+    if input_bytes is not None:
+        INPUT_BYTES.observe(input_bytes, source=source)
+    if output is not None:
+        OUTPUT_BYTES.observe(len(output), source=source, format=(stats or {}).get('format', ''))
+    if stats and not coalesced:
+        for stage, seconds in stats.get('timings', {}).items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+    tracing.set_attributes({
+        'xls2xlsx.outcome': outcome,
+        'xls2xlsx.engine': engine,
+        'xls2xlsx.input.size': input_bytes,
+        'xls2xlsx.output.size': len(output) if output is not None else None,
+        'xls2xlsx.sheet_count': len(stats['sheets']) if stats and stats.get('sheets') else None,
+        'xls2xlsx.coalesced': coalesced if stats else None,
+    })
+
+
+def _module_stat(module_name: str, key: str) -> Optional[float]:
+    """読み込み済みのモジュールの get_stats() の値（未使用のモジュールは読み込まない）"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        return None
+    return module.get_stats().get(key)
+
+
+POOL_WORKERS = Gauge('pool_workers', 'ワーカープールのプロセス数',
+                     lambda: _module_stat('worker_pool', 'workers'))
+POOL_IDLE_WORKERS = Gauge('pool_idle_workers', 'ワーカープールのアイドルプロセス数',
+                          lambda: _module_stat('worker_pool', 'idle'))
+NEGATIVE_CACHE_ENTRIES = Gauge('negative_cache_entries', 'ネガティブキャッシュの記録数',
+                               lambda: _module_stat('negative_cache', 'entries'))
@@ -0,0 +1,107 @@
+"""
+変換失敗のネガティブキャッシュモジュール
+入力起因で変換に失敗した入力のハッシュと失敗種別を記録し、
+同じ入力の再送・再試行を解析せずに即座に拒否する
+
+失敗は変換キー（入力のハッシュ・変換オプション）単位で記録する。シートは必要な分だけ読み込むため、
+解析エラー・シート数の上限超過・リソース上限超過はいずれもシート・行範囲の指定で回避できる場合があり、
+同じ入力でも変換オプションを変えた再送は拒否しない
+"""
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from conversion_utils import conversion_key
+from metrics_registry import CACHE_LOOKUPS
+import tracing
+
+# 記録する入力数の上限（超過時は古いものから破棄）
+MAX_ENTRIES = 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_stats = {'hits': 0, 'misses': 0, 'recorded': 0}
+
+
+def get_ttl_seconds() -> float:
+    """記録の有効期間（NEGATIVE_CACHE_TTL_SECONDS、既定: 3600秒、0 で無効）"""
+    try:
+        return float(os.environ.get('NEGATIVE_CACHE_TTL_SECONDS', '3600'))
+    except ValueError:
+        return 3600.0
+
+
+def _cache_key(input_hash: str, options: dict = None) -> str:
+    # エンジン更新で解析できるようになる可能性があるため、エンジンバージョンごとに記録
+    # （変換キーはエンジンバージョンを含む）
+    return conversion_key(input_hash, **(options or {}))
+
+
+def lookup(input_hash: str, options: dict = None):
+    """
+    入力・変換オプションが既知の失敗入力かを確認
+
+    Args:
+        input_hash: 入力データの SHA-256
+        options: 変換オプション（conversion_utils.conversion_key と同じ。省略時は指定なし）
+
+    Returns:
+        {'failure_class': str, 'message': str, 'recorded_at': float}（未記録の場合は None）
+    """
+    ttl = get_ttl_seconds()
+    key = _cache_key(input_hash, options)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and time.time() - entry['recorded_at'] > ttl:
+            del _entries[key]
+            entry = None
+        if entry is None:
+            _stats['misses'] += 1
+        else:
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            entry = dict(entry)
+    result = 'miss' if entry is None else 'hit'
+    CACHE_LOOKUPS.inc(cache='negative', result=result)
+    tracing.set_attributes({'xls2xlsx.cache.negative': result})
+    return entry
+
+
+def record(input_hash: str, failure_class: str, message: str, options: dict = None):
+    """
+    入力起因の失敗を記録
+
+    Args:
+        input_hash: 入力データの SHA-256
+        failure_class: 失敗種別（conversion_utils.FAILURE_*）
+        message: クライアントに返すエラーメッセージ
+        options: 失敗した変換の変換オプション（同じ指定の再送のみ拒否する）
+    """
+    if get_ttl_seconds() <= 0:
+        return
+    key = _cache_key(input_hash, options)
+    with _lock:
+        _entries[key] = {
+            'failure_class': failure_class,
+            'message': message,
+            'recorded_at': time.time(),
+        }
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+        _stats['recorded'] += 1
+    logging.info(f"Recorded known-bad input {input_hash[:12]}… ({failure_class})")
+
+
+def get_stats() -> dict:
+    """ヒット・ミス・記録件数と現在の記録数を返す"""
+    with _lock:
+        return {**_stats, 'entries': len(_entries)}
+
+
+def clear():
+    """すべての記録を削除"""
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,132 @@
+import azure.functions as func
+import logging
+import os
+from datetime import timedelta
+from security_utils import get_security_headers, sanitize_filename, sanitize_error_message, log_security_event
+from http_utils import (
+    SIZE_THRESHOLD,
+    create_error_response,
+    create_file_response,
+    create_json_response,
+    etag_matches,
+    get_request_filename,
+)
+from columnar_writer import FORMAT_XLSX, NotAcceptable, archive_name
+from conversion_utils import conversion_key, failure_status, parse_request_options
+from metrics_registry import CACHE_LOOKUPS, REJECTIONS, STAGE_SECONDS
+import negative_cache
+import result_store
+from storage_utils import CONTENT_CONTAINER, get_blob_url_with_sas
+import tracing
+
+# 変換済みでない場合にアップロードする変換API（routePrefix を含む）
+CONVERT_PATH = '/api/convert_http'
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    入力の SHA-256 と変換オプションで変換済みの結果を問い合わせる（POST /api/probe）
+
+    リクエスト: クエリ sha256 または {"sha256": "<入力XLSの SHA-256>"}。
+    変換オプションはヘッダー・クエリ（convert_http と同じ）で指定する
+
+    - 変換済みの場合（X-Probe: hit）: 10MB未満はファイルを直接返し、10MB以上は SAS付きダウンロードURLと
+      result_url を JSON で返す。If-None-Match が ETag（"<content_hash>"）と一致する場合は 304
+    - 変換済みでない場合（X-Probe: miss）: {"status": "upload_required"} と変換APIのパスを返す。
+      クライアントは入力を convert_http にアップロードする
+    - 過去に入力起因で失敗した入力は convert_http と同じエラー応答（X-Negative-Cache: hit）
+
+    入力をアップロードせずに判定するため、大きなファイルの再送による転送を省略できる
+
+    リクエストの traceparent ヘッダーを親とするトレースのスパンを記録する
+    """
+    with tracing.start_span('probe', {'http.request.method': req.method}, carrier=req.headers) as span:
+        response = _probe(req)
+        span.set_attribute('http.response.status_code', response.status_code)
+        return response
+
+
+def _probe(req: func.HttpRequest) -> func.HttpResponse:
+    """probe の本体（main を参照）"""
+    is_production = os.environ.get('AZURE_FUNCTIONS_ENVIRONMENT') == 'Production'
+
+    input_hash = req.params.get('sha256')
+    if not input_hash:
+        try:
+            input_hash = (req.get_json() or {}).get('sha256')
+        except (ValueError, AttributeError):
+            input_hash = None
+    input_hash = input_hash.lower() if isinstance(input_hash, str) else ''
+    if not result_store.is_content_hash(input_hash):
+        return create_error_response("入力XLSの SHA-256（16進数64文字）を指定してください。", 400)
+
+    try:
+        options = parse_request_options(req.headers, req.params)
+    except NotAcceptable as e:
+        REJECTIONS.inc(reason='not_acceptable')
+        return create_error_response(str(e), 406)
+    except ValueError as e:
+        REJECTIONS.inc(reason='invalid_options')
+        return create_error_response(str(e), 400)
+
+    # 過去に入力起因で失敗した入力はアップロードさせずに拒否
+    known_failure = negative_cache.lookup(input_hash, options)
+    if known_failure:
+        REJECTIONS.inc(reason='known_bad_input')
+        return create_error_response(known_failure['message'], failure_status(known_failure['failure_class']), {
+            'X-Failure-Class': known_failure['failure_class'],
+            'X-Negative-Cache': 'hit'
+        })
+
+    try:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        with STAGE_SECONDS.time(stage='probe'):
+            content_hash = result_store.lookup(conversion_key(input_hash, **options))
+            properties = None
+            if content_hash:
+                blob_client = result_store.get_blob_client(content_hash)
+                try:
+                    properties = blob_client.get_blob_properties()
+                except ResourceNotFoundError:
+                    properties = None
+
+        result = 'miss' if properties is None else 'hit'
+        CACHE_LOOKUPS.inc(cache='probe', result=result)
+        tracing.set_attributes({'xls2xlsx.cache.probe': result})
+        if properties is None:
+            return create_json_response({
+                'status': 'upload_required',
+                'upload_url': CONVERT_PATH,
+            }, {'X-Probe': 'miss'})
+
+        etag = f'"{content_hash}"'
+        headers = {
+            'ETag': etag,
+            'Content-Location': result_store.result_path(content_hash),
+            'X-Probe': 'hit',
+        }
+        if etag_matches(req.headers.get('If-None-Match'), etag):
+            return func.HttpResponse(status_code=304, headers={**headers, **get_security_headers()})
+
+        if properties.size < SIZE_THRESHOLD:
+            # convert_http と同じファイル名・Content-Type で直接返す
+            filename = sanitize_filename(get_request_filename(req))
+            if filename.lower().endswith('.xls'):
+                filename = filename[:-4]
+            output_filename = archive_name(filename, options.get('output_format', FORMAT_XLSX))
+            with STAGE_SECONDS.time(stage='download'), tracing.start_span('download', {'xls2xlsx.output.size': properties.size}):
+                data = blob_client.download_blob(max_concurrency=4).readall()
+            return create_file_response(data, output_filename, headers,
+                                        properties.content_settings.content_type or 'application/octet-stream')
+
+        return create_json_response({
+            'status': 'hit',
+            'download_url': get_blob_url_with_sas(CONTENT_CONTAINER, content_hash, expiry=timedelta(hours=1)),
+            'result_url': result_store.result_path(content_hash),
+            'content_sha256': content_hash,
+        }, headers)
+
+    except Exception as e:
+        logging.error(f"事前確認エラー: {str(e)}", exc_info=True)
+        log_security_event('probe_error', {'error': str(e), 'input_hash': input_hash})
+        return create_error_response(sanitize_error_message(e, is_production), 500)
@@ -0,0 +1,195 @@
+"""
+要求単位のプロファイリングモジュール
+特定の入力の変換だけが遅い場合に、その変換を統計的プロファイラ（サンプリング）の下で実行し、
+フレームグラフ形式（collapsed stacks）のプロファイルと段階ごとの所要時間を
+診断用コンテナ（xls-diagnostics）に保存する
+
+プロファイルを取得する変換:
+- convert_http で X-Profile ヘッダーに PROFILING_TOKEN と同じ値を指定したリクエスト（管理者用）
+- 入力の SHA-256 が PROFILE_INPUT_HASHES に含まれる変換（HTTP・Blob・キュー・参照による変換）
+
+どちらも設定されていない場合は、ヘッダー・環境変数の確認のみでプロファイラを起動しない
+"""
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Mapping, Tuple
+
+from security_utils import log_security_event
+import tracing
+
+# プロファイルの取得を要求するヘッダー（値は PROFILING_TOKEN）
+PROFILE_HEADER = 'X-Profile'
+
+# スタックの採取間隔（秒）
+SAMPLE_INTERVAL = 0.005
+
+# 診断用コンテナ内のプロファイルの保存先
+PROFILE_PREFIX = 'profiles/'
+
+
+class SamplingProfiler:
+    """
+    スレッドのスタックを一定間隔で採取する統計的プロファイラ（コンテキストマネージャー）
+
+    with ブロックに入ったスレッドを対象に、別スレッドから sys._current_frames() で
+    スタックを採取する。対象スレッドの処理には計測用のフックを入れない
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._target = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        採取したスタックを collapsed stacks 形式で返す
+
+        Returns:
+            "<呼び出し元>;...;<関数> <サンプル数>" の行（flamegraph.pl・speedscope で表示できる）
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def get_profiling_token() -> str:
+    """プロファイルの取得を許可するトークン（PROFILING_TOKEN、未設定の場合は空）"""
+    return os.environ.get('PROFILING_TOKEN', '')
+
+
+def get_profile_hashes() -> set:
+    """プロファイルを取得する入力の SHA-256（PROFILE_INPUT_HASHES、カンマ区切り）"""
+    value = os.environ.get('PROFILE_INPUT_HASHES', '')
+    return {item.strip().lower() for item in value.split(',') if item.strip()}
+
+
+def is_requested(input_hash: str, headers: Mapping[str, str] = None) -> bool:
+    """
+    この変換のプロファイルを取得するかを判定
+
+    Args:
+        input_hash: 入力データの SHA-256
+        headers: HTTP リクエストヘッダー（HTTP 以外は None）
+
+    Returns:
+        X-Profile ヘッダーが PROFILING_TOKEN と一致する、または入力ハッシュが PROFILE_INPUT_HASHES に含まれる場合 True
+    """
+    value = headers.get(PROFILE_HEADER) if headers is not None else None
+    if value:
+        token = get_profiling_token()
+        if token and hmac.compare_digest(value.encode(), token.encode()):
+            return True
+        log_security_event('invalid_profiling_token', {'input_hash': input_hash})
+    return bool(input_hash) and input_hash in get_profile_hashes()
+
+
+def convert_profiled(xls_data: bytes, input_hash: str, source: str, engine: str = None,
+                     **options) -> Tuple[bytes, dict]:
+    """
+    プロファイラの下で変換し、プロファイルを診断用コンテナに保存
+
+    重複変換の抑止（single_flight）は使わず、この要求の入力で必ず変換する。
+    プロファイルの保存に失敗しても変換結果は返す
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        input_hash: 入力データの SHA-256
+        source: 入力元（http / blob）
+        engine: 変換エンジン
+        **options: 変換オプション（convert_xls_to_xlsx_with_stats を参照）
+
+    Returns:
+        (変換結果のバイナリデータ, 変換統計)。変換統計の 'profile_blob' に保存先の Blob 名
+        （保存に失敗した場合は None）
+
+    Raises:
+        worker_pool.convert と同じ
+    """
+    import worker_pool
+
+    with tracing.start_span('convert', {'xls2xlsx.engine': engine, 'xls2xlsx.input.size': len(xls_data),
+                                        'xls2xlsx.profiled': True}):
+        xlsx_data, stats = worker_pool.convert(xls_data, engine, profile=True, **options)
+        tracing.record_timings(stats.get('timings'))
+    profile = stats.pop('profile', '')
+    try:
+        stats['profile_blob'] = save_profile(profile, input_hash, source, len(xls_data), stats, options)
+    except Exception as e:
+        logging.warning(f"プロファイルの保存エラー: {str(e)}")
+        stats['profile_blob'] = None
+    return xlsx_data, stats
+
+
+def save_profile(profile: str, input_hash: str, source: str, input_size: int, stats: dict,
+                 options: dict = None) -> str:
+    """
+    プロファイルと段階ごとの所要時間を診断用コンテナに保存
+
+    "<日時>-<入力ハッシュ先頭16文字>.folded"（collapsed stacks）と同じ名前の .json
+    （入力・変換統計・所要時間）を保存する
+
+    Args:
+        profile: collapsed stacks 形式のプロファイル
+        input_hash: 入力データの SHA-256
+        source: 入力元（http / blob）
+        input_size: 入力サイズ（バイト）
+        stats: 変換統計
+        options: 変換オプション
+
+    Returns:
+        プロファイルの Blob 名
+    """
+    from storage_utils import DIAGNOSTICS_CONTAINER, ensure_container
+
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    name = f"{PROFILE_PREFIX}{stamp}-{input_hash[:16]}"
+    summary = {
+        'input_sha256': input_hash,
+        'input_size': input_size,
+        'source': source,
+        'engine': stats.get('engine'),
+        'format': stats.get('format'),
+        'options': {key: value for key, value in (options or {}).items() if value is not None},
+        'timings': stats.get('timings', {}),
+        'sheets': stats.get('sheets', []),
+        'sample_interval': SAMPLE_INTERVAL,
+        'samples': stats.get('profile_samples', 0),
+    }
+    container_client = ensure_container(DIAGNOSTICS_CONTAINER)
+    container_client.upload_blob(f"{name}.folded", profile.encode('utf-8'), overwrite=True,
+                                 metadata={'source_sha256': input_hash, 'source': source})
+    container_client.upload_blob(f"{name}.json", json.dumps(summary, ensure_ascii=False, default=str).encode('utf-8'),
+                                 overwrite=True)
+    logging.info(f"Saved conversion profile to {DIAGNOSTICS_CONTAINER}/{name}.folded")
+    return f"{name}.folded"
@@ -0,0 +1,357 @@
+"""
+キュー駆動の変換パイプラインモジュール
+xls-input の Blob 名をキュー（xls-convert-queue）に登録し、ワーカーがメッセージを
+まとめて取り出して並列に変換する（Blobトリガーのポーリングによる検出遅延を回避）
+
+メッセージ形式:
+- {"blob": "<xls-input 内の Blob 名>", "etag": "<ETag>"}（enqueue_blob / enqueue_input_blobs）
+- Event Grid の Microsoft.Storage.BlobCreated イベント（Storage キューをエンドポイントに指定）
+
+メッセージの traceparent / tracestate（登録時のトレースコンテキスト、CloudEvents スキーマの
+分散トレーシング拡張属性）を、変換のスパンの親にする
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from blob_conversion import OUTCOME_PENDING, process_input_blob
+from storage_utils import CONVERT_QUEUE, INPUT_CONTAINER, ensure_container, ensure_queue
+import tracing
+from worker_pool import get_pool_size
+
+# 1回の取り出しで受け取るメッセージ数の上限（Storage キューの上限は 32）。実際には並列変換数までしか
+# 受け取らない（実行待ちのメッセージは非表示期間が延長されず、他のワーカーに再び取り出されるため）
+BATCH_SIZE = 32
+
+# 取り出したメッセージの非表示期間（秒）。変換中は期間の 1/2 ごとに延長する
+VISIBILITY_TIMEOUT = 60
+
+# この回数を超えて取り出されたメッセージは poison キューに移動
+MAX_DEQUEUE_COUNT = 5
+
+# メッセージで引き継ぐトレースコンテキストのキー
+TRACE_CONTEXT_KEYS = ('traceparent', 'tracestate')
+
+# 処理結果（blob_conversion.OUTCOME_* に加えて）
+OUTCOME_MISSING = 'missing'     # 入力Blobが削除済み
+OUTCOME_POISON = 'poison'       # 再試行上限超過
+OUTCOME_FAILED = 'failed'       # 一時的な失敗（非表示期間後に再試行）
+
+_EVENT_SUBJECT_PREFIX = f"/blobServices/default/containers/{INPUT_CONTAINER}/blobs/"
+
+
+def get_max_workers() -> int:
+    """並列変換数（QUEUE_MAX_WORKERS、既定: 変換ワーカー数、ワーカープールを使用しない場合は 4）"""
+    default = get_pool_size() or 4
+    try:
+        return max(1, int(os.environ.get('QUEUE_MAX_WORKERS', str(default))))
+    except ValueError:
+        return default
+
+
+def build_message(blob_name: str, etag: str = None) -> str:
+    """
+    変換要求メッセージを作成（スパン内で作成した場合はトレースコンテキストを含める）
+
+    Args:
+        blob_name: xls-input 内の Blob 名
+        etag: Blob の ETag（指定時は変換済みの判定に使用）
+
+    Returns:
+        メッセージ本文（JSON）
+    """
+    return json.dumps({'blob': blob_name, 'etag': etag, **tracing.inject()})
+
+
+def parse_message(content: str):
+    """
+    メッセージから Blob 名と ETag を取得
+
+    Args:
+        content: メッセージ本文（JSON、または Base64 エンコードされた JSON）
+
+    Returns:
+        (Blob 名, ETag)
+
+    Raises:
+        ValueError: 形式不正、または xls-input 以外の Blob のイベント
+    """
+    body = _decode_message(content)
+
+    if 'blob' in body:
+        return body['blob'], body.get('etag')
+
+    # Event Grid の BlobCreated イベント
+    subject = body.get('subject', '')
+    if body.get('eventType') == 'Microsoft.Storage.BlobCreated' and subject.startswith(_EVENT_SUBJECT_PREFIX):
+        return subject[len(_EVENT_SUBJECT_PREFIX):], (body.get('data') or {}).get('eTag')
+
+    raise ValueError("変換対象のBlobを含まないメッセージです")
+
+
+def parse_trace_context(content: str) -> dict:
+    """
+    メッセージからトレースコンテキストを取得
+
+    Args:
+        content: メッセージ本文（parse_message と同じ形式）
+
+    Returns:
+        {'traceparent': ..., ('tracestate': ...)}（含まれない場合・形式不正の場合は空）
+    """
+    try:
+        body = _decode_message(content)
+    except ValueError:
+        return {}
+    return {key: body[key] for key in TRACE_CONTEXT_KEYS if isinstance(body.get(key), str)}
+
+
+def _decode_message(content: str) -> dict:
+    """メッセージ本文（JSON、または Base64 エンコードされた JSON）を辞書に変換"""
+    try:
+        body = json.loads(content)
+    except ValueError:
+        try:
+            body = json.loads(base64.b64decode(content, validate=True))
+        except (ValueError, binascii.Error):
+            raise ValueError("メッセージの形式が不正です")
+
+    if isinstance(body, list) and len(body) == 1:
+        # Event Grid スキーマはイベントの配列で配信される場合がある
+        body = body[0]
+    if not isinstance(body, dict):
+        raise ValueError("メッセージの形式が不正です")
+    return body
+
+
+def enqueue_blob(blob_name: str, etag: str = None):
+    """
+    Blob 名を変換キューに登録
+
+    Args:
+        blob_name: xls-input 内の Blob 名
+        etag: Blob の ETag
+    """
+    ensure_queue(CONVERT_QUEUE).send_message(build_message(blob_name, etag))
+
+
+def enqueue_input_blobs(prefix: str = None) -> int:
+    """
+    xls-input の .xls Blob をすべて変換キューに登録（一覧取得による登録）
+
+    Args:
+        prefix: 対象とする Blob 名のプレフィックス
+
+    Returns:
+        登録したメッセージ数
+    """
+    queue_client = ensure_queue(CONVERT_QUEUE)
+    count = 0
+    for blob in ensure_container(INPUT_CONTAINER).list_blobs(name_starts_with=prefix):
+        if blob.name.lower().endswith('.xls'):
+            queue_client.send_message(build_message(blob.name, blob.etag))
+            count += 1
+    logging.info(f"Enqueued {count} blobs from {INPUT_CONTAINER}")
+    return count
+
+
+def process_batch(max_workers: int = None) -> dict:
+    """
+    変換キューからメッセージをまとめて取り出し、並列に変換
+
+    取り出すメッセージ数は並列変換数まで（すべてのメッセージの変換をすぐに開始し、非表示期間を延長する）
+
+    Args:
+        max_workers: 並列変換数（省略時は QUEUE_MAX_WORKERS）
+
+    Returns:
+        処理結果ごとの件数（取り出したメッセージが無い場合は空）
+    """
+    max_workers = max_workers or get_max_workers()
+    batch_size = min(BATCH_SIZE, max_workers)
+    queue_client = ensure_queue(CONVERT_QUEUE)
+    messages = list(queue_client.receive_messages(
+        messages_per_page=batch_size,
+        max_messages=batch_size,
+        visibility_timeout=VISIBILITY_TIMEOUT,
+    ))
+    if not messages:
+        return {}
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for outcome in executor.map(lambda message: handle_message(queue_client, message), messages):
+            counts[outcome] = counts.get(outcome, 0) + 1
+    logging.info(f"Processed {len(messages)} queue messages: {counts}")
+    return counts
+
+
+def drain_queue(time_budget: float, max_workers: int = None) -> dict:
+    """
+    キューが空になるか時間予算を使い切るまでバッチ処理を繰り返す
+
+    Args:
+        time_budget: 新しいバッチの取り出しを開始してよい時間（秒）
+        max_workers: 並列変換数
+
+    Returns:
+        処理結果ごとの件数
+    """
+    deadline = time.monotonic() + time_budget
+    totals = {}
+    while time.monotonic() < deadline:
+        counts = process_batch(max_workers)
+        if not counts:
+            break
+        for outcome, count in counts.items():
+            totals[outcome] = totals.get(outcome, 0) + count
+    return totals
+
+
+def handle_message(queue_client, message) -> str:
+    """
+    1件のメッセージを処理（成功・入力起因の失敗はメッセージを削除）
+
+    時間予算内に変換が完了しなかった場合（途中経過を保存済み）は、同じ Blob の
+    メッセージを登録し直して次の実行で再開する
+
+    Args:
+        queue_client: 変換キューの QueueClient
+        message: 取り出したメッセージ
+
+    Returns:
+        処理結果（OUTCOME_*）
+    """
+    if message.dequeue_count > MAX_DEQUEUE_COUNT:
+        return _move_to_poison(queue_client, message)
+
+    try:
+        blob_name, etag = parse_message(message.content)
+    except ValueError as e:
+        logging.warning(f"Discarding queue message {message.id}: {str(e)}")
+        return _move_to_poison(queue_client, message)
+
+    extender = _VisibilityExtender(queue_client, message)
+    try:
+        metadata, size = _get_input_properties(blob_name)
+        # 登録時のトレース（なければ入力Blobのメタデータのトレース）の続きとして記録
+        carrier = parse_trace_context(message.content) or metadata
+        with tracing.start_span('queue_message', {'xls2xlsx.blob': blob_name,
+                                                  'messaging.message.id': message.id}, carrier=carrier):
+            with extender:
+                outcome, _ = process_input_blob(
+                    f"{INPUT_CONTAINER}/{blob_name}",
+                    lambda: _download_input(blob_name),
+                    source_etag=etag,
+                    metadata=metadata,
+                    size=size,
+                )
+            if outcome == OUTCOME_PENDING:
+                enqueue_blob(blob_name, etag)
+    except _BlobMissing:
+        logging.info(f"Input blob no longer exists: {blob_name}")
+        outcome = OUTCOME_MISSING
+    except Exception as e:
+        # メッセージは削除せず、非表示期間の経過後に再試行する
+        logging.error(f"Queue conversion error for {blob_name}: {str(e)}", exc_info=True)
+        return OUTCOME_FAILED
+
+    try:
+        queue_client.delete_message(message.id, extender.pop_receipt)
+    except Exception as e:
+        # 非表示期間の延長に失敗した場合は pop receipt が古く削除できない。メッセージは再び取り出されるが、
+        # 変換済みの出力はスキップされる
+        logging.warning(f"Queue message delete error for {blob_name}: {str(e)}")
+        return OUTCOME_FAILED
+    return outcome
+
+
+class _BlobMissing(Exception):
+    """メッセージ登録後に入力Blobが削除された"""
+
+
+def _get_input_properties(blob_name: str):
+    """入力Blobのメタデータ（シート・行範囲の指定）とサイズを取得（.xls 以外は ({}, None)）"""
+    from azure.core.exceptions import ResourceNotFoundError
+
+    if not blob_name.lower().endswith('.xls'):
+        return {}, None
+    try:
+        properties = ensure_container(INPUT_CONTAINER).get_blob_client(blob_name).get_blob_properties()
+        return properties.metadata or {}, properties.size
+    except ResourceNotFoundError:
+        raise _BlobMissing(blob_name)
+
+
+def _download_input(blob_name: str) -> bytes:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        return ensure_container(INPUT_CONTAINER).get_blob_client(blob_name).download_blob().readall()
+    except ResourceNotFoundError:
+        raise _BlobMissing(blob_name)
+
+
+def _move_to_poison(queue_client, message) -> str:
+    """
+    メッセージを poison キューに移動
+
+    Returns:
+        OUTCOME_POISON（移動できなかった場合は OUTCOME_FAILED。非表示期間の経過後に再び移動を試みる）
+    """
+    try:
+        ensure_queue(f"{CONVERT_QUEUE}-poison").send_message(message.content)
+        queue_client.delete_message(message.id, message.pop_receipt)
+    except Exception as e:
+        logging.error(f"Failed to move queue message {message.id} to {CONVERT_QUEUE}-poison: {str(e)}")
+        return OUTCOME_FAILED
+    logging.warning(f"Moved queue message {message.id} to {CONVERT_QUEUE}-poison "
+                    f"(dequeue count: {message.dequeue_count})")
+    return OUTCOME_POISON
+
+
+class _VisibilityExtender:
+    """変換中にバックグラウンドでメッセージの非表示期間を延長するコンテキストマネージャー"""
+
+    def __init__(self, queue_client, message):
+        self._queue_client = queue_client
+        self._message_id = message.id
+        self._lock = threading.Lock()
+        self._pop_receipt = message.pop_receipt
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def pop_receipt(self) -> str:
+        """最新の pop receipt（延長のたびに更新される）"""
+        with self._lock:
+            return self._pop_receipt
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='visibility-extender', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        while not self._stopped.wait(VISIBILITY_TIMEOUT / 2):
+            try:
+                with self._lock:
+                    updated = self._queue_client.update_message(
+                        self._message_id,
+                        pop_receipt=self._pop_receipt,
+                        visibility_timeout=VISIBILITY_TIMEOUT,
+                    )
+                    self._pop_receipt = updated.pop_receipt
+            except Exception as e:
+                logging.warning(f"メッセージの非表示期間の延長エラー: {str(e)}")
+                return
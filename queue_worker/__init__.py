@@ -0,0 +1,30 @@
+import azure.functions as func
+import logging
+import os
+from queue_pipeline import drain_queue
+from warmup_utils import schedule_startup_warmup
+
+# WARMUP_ON_STARTUP が有効な場合は起動時にバックグラウンドでウォームアップ
+schedule_startup_warmup()
+
+def main(timer: func.TimerRequest) -> None:
+    """
+    xls-convert-queue のメッセージをまとめて取り出し、xls-input のBlobを並列に変換
+
+    キューが空になるか QUEUE_DRAIN_SECONDS（既定: 240秒）を超えるまでバッチ処理を繰り返す
+
+    queueTrigger ではなくタイマートリガー（10秒ごと）で実行する。queueTrigger はメッセージを1件ずつ渡し、
+    取り出し・非表示期間・削除をホストが行うため、まとめて取り出して並列に変換し、変換中に非表示期間を
+    延長する処理（queue_pipeline）を実装できない。タイマー関数はインスタンス間で1つだけ実行される
+
+    Args:
+        timer: タイマー情報
+    """
+    try:
+        time_budget = float(os.environ.get('QUEUE_DRAIN_SECONDS', '240'))
+    except ValueError:
+        time_budget = 240.0
+
+    counts = drain_queue(time_budget)
+    if counts:
+        logging.info(f"Queue worker processed messages: {counts}")
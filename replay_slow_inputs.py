@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+記録された遅い変換の入力を再変換し、性能低下を報告するスクリプト
+
+slow_capture.py が perf-quarantine コンテナにコピーした入力と xls-diagnostics の記録
+（slow/<SHA-256>.json）をローカルのディレクトリにダウンロードし、各入力を変換エンジンごとに
+ワーカープロセス（CONVERSION_POOL_SIZE と同じサンドボックス上限）で変換して以下を集計する
+- 変換時間の中央値・最小値、変換中の RSS の最大増加量
+- 変換エラー（上限超過を含む）の失敗種別
+
+結果は履歴ファイル（JSON Lines）に追記し、同じ入力・エンジンの前回の結果より閾値以上遅い場合は
+性能低下として報告する（終了コード 1）。ダウンロード済みの入力はそのままベンチマークケースとして使用できる
+
+使い方:
+    python replay_slow_inputs.py --download              # Storage から入力を取得して再変換
+    python replay_slow_inputs.py [--dir test_output/slow_inputs] [--engines pandas,native] [--repeat 3]
+    python replay_slow_inputs.py --threshold 0.2         # 前回より 20% 以上遅い場合を性能低下とする
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+from datetime import datetime
+
+from conversion_utils import ENGINE_NATIVE, ENGINE_PANDAS, classify_failure
+from measure_cold_start import git_revision
+from slow_capture import SLOW_PREFIX
+from worker_pool import ConversionPool
+
+INPUT_DIR = os.path.join('test_output', 'slow_inputs')
+HISTORY_FILE = 'replay_history.jsonl'
+DEFAULT_ENGINES = f"{ENGINE_PANDAS},{ENGINE_NATIVE}"
+
+
+def download_inputs(directory: str) -> int:
+    """
+    記録とコピー済みの入力を Storage からダウンロード（ダウンロード済みの入力は取得しない）
+
+    Args:
+        directory: 保存先ディレクトリ（<SHA-256>.xls と <SHA-256>.json）
+
+    Returns:
+        新たにダウンロードした入力の数
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    from storage_utils import DIAGNOSTICS_CONTAINER, PERF_QUARANTINE_CONTAINER, ensure_container
+
+    os.makedirs(directory, exist_ok=True)
+    diagnostics = ensure_container(DIAGNOSTICS_CONTAINER)
+    inputs = ensure_container(PERF_QUARANTINE_CONTAINER)
+    count = 0
+    for blob in diagnostics.list_blobs(name_starts_with=SLOW_PREFIX):
+        input_hash = blob.name[len(SLOW_PREFIX):-len('.json')]
+        path = os.path.join(directory, f"{input_hash}.xls")
+        if not blob.name.endswith('.json') or os.path.exists(path):
+            continue
+        try:
+            data = inputs.get_blob_client(f"{input_hash}.xls").download_blob().readall()
+        except ResourceNotFoundError:
+            # SLOW_CAPTURE_COPY_INPUT が無効だった入力は記録のみ
+            continue
+        with open(os.path.join(directory, f"{input_hash}.json"), 'wb') as f:
+            f.write(diagnostics.get_blob_client(blob.name).download_blob().readall())
+        with open(path, 'wb') as f:
+            f.write(data)
+        count += 1
+    return count
+
+
+def load_cases(directory: str) -> list:
+    """
+    ディレクトリ内の入力と記録を読み込む
+
+    Returns:
+        [(入力名, XLSデータ, 記録（無い場合は空）)]
+    """
+    cases = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.xls'))):
+        name = os.path.basename(path)[:-len('.xls')]
+        record_path = os.path.join(directory, f"{name}.json")
+        record = {}
+        if os.path.exists(record_path):
+            with open(record_path, encoding='utf-8') as f:
+                record = json.load(f)
+        with open(path, 'rb') as f:
+            cases.append((name, f.read(), record))
+    return cases
+
+
+def recorded_options(record: dict) -> dict:
+    """記録された変換オプションを変換関数の引数に戻す（行範囲は JSON で配列になる）"""
+    options = dict(record.get('options') or {})
+    if options.get('rows') is not None:
+        options['rows'] = tuple(options['rows'])
+    return options
+
+
+def replay(cases: list, engines: list, repeat: int) -> list:
+    """
+    各入力をエンジンごとにワーカープロセスで変換
+
+    Args:
+        cases: load_cases の戻り値
+        engines: 変換エンジン
+        repeat: 繰り返し回数
+
+    Returns:
+        入力・エンジンごとの計測結果
+    """
+    results = []
+    pool = ConversionPool(1)
+    try:
+        for name, xls_data, record in cases:
+            options = recorded_options(record)
+            for engine in engines:
+                durations, peaks, failure = [], [], None
+                for _ in range(repeat):
+                    try:
+                        _, stats = pool.convert(xls_data, engine, **options)
+                    except Exception as e:
+                        failure = classify_failure(e) or type(e).__name__
+                        break
+                    durations.append(stats['timings']['convert'])
+                    if stats.get('peak_memory') is not None:
+                        peaks.append(stats['peak_memory'])
+                results.append({
+                    'input': name,
+                    'engine': engine,
+                    'input_bytes': len(xls_data),
+                    'reasons': record.get('reasons', []),
+                    'median_seconds': statistics.median(durations) if durations else None,
+                    'min_seconds': min(durations) if durations else None,
+                    'peak_memory': max(peaks) if peaks else None,
+                    'failure': failure,
+                })
+    finally:
+        pool.shutdown()
+    return results
+
+
+def load_previous(history_file: str) -> dict:
+    """履歴の各入力・エンジンの最新の結果を返す"""
+    previous = {}
+    if not os.path.exists(history_file):
+        return previous
+    with open(history_file, encoding='utf-8') as f:
+        for line in f:
+            run = json.loads(line)
+            for result in run['results']:
+                previous[(result['input'], result['engine'])] = dict(result, revision=run.get('revision'))
+    return previous
+
+
+def find_regressions(results: list, previous: dict, threshold: float) -> list:
+    """
+    前回の結果より閾値以上遅い、または前回は成功した変換が失敗した結果を返す
+
+    Returns:
+        [(計測結果, 前回の結果)]
+    """
+    regressions = []
+    for result in results:
+        before = previous.get((result['input'], result['engine']))
+        if not before:
+            continue
+        if result['failure'] and not before.get('failure'):
+            regressions.append((result, before))
+        elif result['median_seconds'] is not None and before.get('median_seconds') \
+                and result['median_seconds'] > before['median_seconds'] * (1 + threshold):
+            regressions.append((result, before))
+    return regressions
+
+
+def print_results(results: list, previous: dict):
+    """計測結果を前回の結果と並べて表示"""
+    print(f"\n{'入力':<18} {'エンジン':<8} {'サイズ':>9} {'中央値':>10} {'前回':>10} {'最大RSS増加':>12} 結果")
+    print("-" * 85)
+    for result in results:
+        before = previous.get((result['input'], result['engine']), {})
+        median = result['median_seconds']
+        old = before.get('median_seconds')
+        peak = result['peak_memory']
+        print(f"{result['input'][:16]:<18} {result['engine']:<8} {result['input_bytes'] // 1024:>7}KB "
+              f"{f'{median:.3f}s' if median is not None else '-':>10} "
+              f"{f'{old:.3f}s' if old is not None else '-':>10} "
+              f"{f'{peak // (1024 * 1024)}MB' if peak is not None else '-':>12} "
+              f"{result['failure'] or 'ok'}")
+
+
+def _describe(result: dict) -> str:
+    """計測結果の中央値（失敗した場合は失敗種別）"""
+    if result.get('failure'):
+        return result['failure']
+    return f"{result['median_seconds']:.3f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='記録された遅い変換の入力の再変換')
+    parser.add_argument('--dir', default=INPUT_DIR, help='入力と記録の保存先')
+    parser.add_argument('--download', action='store_true', help='perf-quarantine から入力をダウンロード')
+    parser.add_argument('--engines', default=DEFAULT_ENGINES, help=f'変換エンジン（既定: {DEFAULT_ENGINES}）')
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返し回数')
+    parser.add_argument('--threshold', type=float, default=0.2, help='性能低下とみなす前回からの増加率')
+    parser.add_argument('--history', default=HISTORY_FILE, help='履歴ファイル（JSON Lines）')
+    args = parser.parse_args()
+
+    if args.download:
+        print(f"ダウンロードした入力: {download_inputs(args.dir)}")
+    cases = load_cases(args.dir)
+    if not cases:
+        print(f"入力がありません: {args.dir}")
+        return 1
+
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    print("=" * 70)
+    print(f"遅い変換の再変換: {len(cases)} 入力 × {', '.join(engines)}（{args.repeat} 回）")
+    print("=" * 70)
+
+    results = replay(cases, engines, args.repeat)
+    previous = load_previous(args.history)
+    print_results(results, previous)
+
+    regressions = find_regressions(results, previous, args.threshold)
+    if regressions:
+        print(f"\n[性能低下] {len(regressions)} 件（前回から {args.threshold * 100:.0f}% 以上の増加、または失敗）")
+        for result, before in regressions:
+            print(f"   {result['input']} ({result['engine']}): {_describe(before)} → {_describe(result)}"
+                  f"（前回: {before.get('revision') or '-'}）")
+
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'timestamp': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'repeat': args.repeat,
+            'results': results,
+        }, ensure_ascii=False) + '\n')
+    print(f"\n履歴に追記しました: {args.history}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
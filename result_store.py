@@ -0,0 +1,218 @@
+"""
+内容アドレスの変換結果ストアモジュール
+変換結果を内容の SHA-256 をBlob名として xls-content コンテナに保存し、
+結果取得API（GET /api/results/{content_hash}）から再変換せずに取得できるようにする
+
+同じ内容の変換結果は1つのBlobを共有する（決定的な出力では同じ入力・変換オプションの結果は同じ内容）。
+保存済みの内容は上書きしない。convert_http が直接返す小さな結果は、応答を Storage への保存で
+待たせないようにバックグラウンドのスレッドで保存する（save_async）
+
+変換キー（入力の SHA-256・エンジン・変換オプション・ENGINE_VERSION）から内容のハッシュへの索引を
+xls-results/<変換キー>.content（空のBlob、メタデータ content_sha256）に記録し、入力をアップロードせずに
+変換済みかを問い合わせる事前確認API（POST /api/probe）が参照する（lookup）
+"""
+import logging
+import os
+import queue
+import re
+import threading
+
+from conversion_utils import ENGINE_VERSION, compute_output_hash
+from http_utils import content_disposition
+import tracing
+
+# 結果取得APIのパス（routePrefix を含む）
+RESULTS_PATH = '/api/results/'
+
+# 内容のハッシュ（SHA-256 の16進文字列）
+_CONTENT_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+# 変換キーの索引Blobの拡張子（xls-results の共有結果 <変換キー>.xlsx・<変換キー>.stats 等と区別する）
+INDEX_SUFFIX = '.content'
+
+# 保存済みの (内容のハッシュ, 変換キー)（プロセス内、同じ内容・索引の保存要求を省略する）
+MAX_REMEMBERED = 4096
+
+# バックグラウンドで保存を待つ結果の上限（超過分は保存しない）
+MAX_PENDING = 8
+
+_saved_lock = threading.Lock()
+_saved = set()
+_pending = queue.Queue(maxsize=MAX_PENDING)
+_saver = None
+
+
+def is_store_enabled() -> bool:
+    """convert_http が直接返す変換結果（10MB未満）も保存するか（STORE_HTTP_RESULTS、既定: 有効）"""
+    return os.environ.get('STORE_HTTP_RESULTS', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+
+def get_max_response_bytes() -> int:
+    """結果取得APIが関数の応答として返す最大サイズ（RESULT_MAX_RESPONSE_MB、既定: 16MB、超える場合はリダイレクト）"""
+    try:
+        megabytes = float(os.environ.get('RESULT_MAX_RESPONSE_MB', 16))
+    except ValueError:
+        megabytes = 16
+    return int(max(0.0, megabytes) * 1024 * 1024)
+
+
+def is_content_hash(value: str) -> bool:
+    """値が内容のハッシュ（小文字16進の SHA-256）か"""
+    return bool(value) and _CONTENT_HASH.match(value) is not None
+
+
+def result_path(content_hash: str) -> str:
+    """結果取得APIのパス（Content-Location・レスポンスの result_url に使用）"""
+    return f"{RESULTS_PATH}{content_hash}"
+
+
+def save(data: bytes, filename: str, content_type: str, content_hash: str = None, input_hash: str = None,
+         carrier: dict = None, conversion_key: str = None) -> str:
+    """
+    変換結果を内容のハッシュをBlob名として保存（保存済みの場合は何もしない）
+
+    変換キーを指定した場合は、内容の保存後に変換キーの索引も記録する
+
+    Args:
+        data: 変換結果のバイナリデータ
+        filename: ダウンロード時のファイル名（Content-Disposition、最初に保存した値を使用）
+        content_type: Content-Type
+        content_hash: 変換結果の SHA-256（省略時は計算する）
+        input_hash: 入力データの SHA-256（メタデータに記録）
+        carrier: 保存のスパンの親のトレースコンテキスト（省略時は現在のスパン）
+        conversion_key: 変換結果の変換キー（conversion_utils.conversion_key、索引に記録）
+
+    Returns:
+        内容のハッシュ（Blob名）
+    """
+    from storage_utils import RESULTS_CONTAINER, ensure_container
+
+    content_hash = content_hash or compute_output_hash(data)
+    if _is_saved(content_hash, conversion_key):
+        return content_hash
+
+    with tracing.start_span('store_result', {'xls2xlsx.output.size': len(data)}, carrier=carrier):
+        if not _is_saved(content_hash):
+            _upload_content(data, filename, content_type, content_hash, input_hash, carrier)
+            _remember(content_hash)
+        if conversion_key:
+            # 内容の保存後に索引を記録する（索引が存在すれば内容も存在する）
+            ensure_container(RESULTS_CONTAINER).upload_blob(
+                f"{conversion_key}{INDEX_SUFFIX}",
+                b'',
+                overwrite=True,
+                metadata={'content_sha256': content_hash, 'engine_version': ENGINE_VERSION},
+            )
+            _remember(content_hash, conversion_key)
+    return content_hash
+
+
+def _upload_content(data: bytes, filename: str, content_type: str, content_hash: str, input_hash: str,
+                    carrier: dict):
+    """変換結果を xls-content に保存（保存済みの場合は何もしない）"""
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.blob import ContentSettings
+    from storage_utils import CONTENT_CONTAINER, ensure_container
+
+    try:
+        ensure_container(CONTENT_CONTAINER).upload_blob(
+            content_hash,
+            data,
+            overwrite=False,
+            content_settings=ContentSettings(
+                content_type=content_type,
+                content_disposition=content_disposition(filename),
+            ),
+            metadata={
+                'source_sha256': input_hash or '',
+                'engine_version': ENGINE_VERSION,
+                **(carrier or tracing.inject()),
+            },
+            max_concurrency=4,
+        )
+    except ResourceExistsError:
+        # 同じ内容は他の要求・インスタンスが保存済み
+        pass
+
+
+def save_async(data: bytes, filename: str, content_type: str, content_hash: str,
+               input_hash: str = None, conversion_key: str = None) -> bool:
+    """
+    変換結果をバックグラウンドのスレッドで保存（保存に失敗しても例外を送出しない）
+
+    保存待ちが MAX_PENDING 件に達している場合は保存しない
+
+    Args:
+        save と同じ（content_hash は必須）
+
+    Returns:
+        保存済み、または保存を受け付けた場合 True
+    """
+    global _saver
+    if _is_saved(content_hash, conversion_key):
+        return True
+    with _saved_lock:
+        if _saver is None:
+            _saver = threading.Thread(target=_save_pending, name='result-store', daemon=True)
+            _saver.start()
+    try:
+        _pending.put_nowait((data, filename, content_type, content_hash, input_hash, tracing.inject(),
+                             conversion_key))
+    except queue.Full:
+        logging.warning(f"変換結果の保存待ちが上限に達したため保存しません: {content_hash}")
+        return False
+    return True
+
+
+def _save_pending():
+    """保存待ちの変換結果を順に保存（バックグラウンドのスレッド）"""
+    while True:
+        data, filename, content_type, content_hash, input_hash, carrier, conversion_key = _pending.get()
+        try:
+            save(data, filename, content_type, content_hash, input_hash, carrier=carrier or None,
+                 conversion_key=conversion_key)
+        except Exception as e:
+            logging.warning(f"変換結果の保存エラー（結果取得APIでは取得できません）: {str(e)}")
+        finally:
+            _pending.task_done()
+
+
+def _is_saved(content_hash: str, conversion_key: str = None) -> bool:
+    with _saved_lock:
+        return (content_hash, conversion_key) in _saved
+
+
+def _remember(content_hash: str, conversion_key: str = None):
+    with _saved_lock:
+        if len(_saved) >= MAX_REMEMBERED:
+            _saved.clear()
+        _saved.add((content_hash, conversion_key))
+
+
+def lookup(conversion_key: str):
+    """
+    変換キーの索引から変換結果の内容のハッシュを取得
+
+    Args:
+        conversion_key: 変換キー（conversion_utils.conversion_key）
+
+    Returns:
+        内容のハッシュ（索引が無い場合は None）
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    from storage_utils import RESULTS_CONTAINER, ensure_container
+
+    blob_client = ensure_container(RESULTS_CONTAINER).get_blob_client(f"{conversion_key}{INDEX_SUFFIX}")
+    try:
+        properties = blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+    content_hash = (properties.metadata or {}).get('content_sha256', '')
+    return content_hash if is_content_hash(content_hash) else None
+
+
+def get_blob_client(content_hash: str):
+    """内容のハッシュに対応する BlobClient"""
+    from storage_utils import CONTENT_CONTAINER, ensure_container
+
+    return ensure_container(CONTENT_CONTAINER).get_blob_client(content_hash)
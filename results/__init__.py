@@ -0,0 +1,101 @@
+import azure.functions as func
+import logging
+import os
+from datetime import timedelta
+from http_utils import RangeNotSatisfiable, create_error_response, etag_matches, parse_range
+from metrics_registry import CACHE_LOOKUPS, STAGE_SECONDS
+import result_store
+from security_utils import get_security_headers, sanitize_error_message, log_security_event
+from storage_utils import CONTENT_CONTAINER, get_blob_url_with_sas
+import tracing
+
+# 内容は変わらないため、ブラウザ・プロキシの private キャッシュに長期間保存してよい
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+# 大きな範囲の転送に使う読み取り SAS の有効期間
+REDIRECT_SAS_EXPIRY = timedelta(minutes=15)
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    内容の SHA-256 で変換結果を返す（GET / HEAD /api/results/{content_hash}）
+
+    - If-None-Match が ETag（"<content_hash>"）と一致する場合は Storage を参照せずに 304
+    - Range（単一の bytes 範囲）は要求された範囲のみを Storage から読み込んで 206。
+      If-Range が ETag と一致しない場合は全体を返す。範囲外は 416
+    - 応答が RESULT_MAX_RESPONSE_MB を超える場合は、Storage から直接ダウンロードする
+      短期の読み取り SAS URL に 307 でリダイレクト（Range ヘッダーはそのまま Blob Storage で処理される）
+
+    リクエストの traceparent ヘッダーを親とするトレースのスパンを記録する
+    """
+    with tracing.start_span('get_result', {'http.request.method': req.method}, carrier=req.headers) as span:
+        response = _get_result(req)
+        span.set_attribute('http.response.status_code', response.status_code)
+        return response
+
+
+def _get_result(req: func.HttpRequest) -> func.HttpResponse:
+    """results の本体（main を参照）"""
+    is_production = os.environ.get('AZURE_FUNCTIONS_ENVIRONMENT') == 'Production'
+    content_hash = (req.route_params.get('content_hash') or '').lower()
+    if not result_store.is_content_hash(content_hash):
+        return create_error_response("変換結果の SHA-256（16進数64文字）を指定してください。", 400)
+
+    etag = f'"{content_hash}"'
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': CACHE_CONTROL}
+
+    # 内容アドレスのため、ETag が一致すれば内容は変わっていない
+    if etag_matches(req.headers.get('If-None-Match'), etag):
+        CACHE_LOOKUPS.inc(cache='client', result='hit')
+        return func.HttpResponse(status_code=304, headers={**headers, **get_security_headers()})
+
+    try:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob_client = result_store.get_blob_client(content_hash)
+        try:
+            properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            CACHE_LOOKUPS.inc(cache='result_store', result='miss')
+            return create_error_response("指定された変換結果が見つかりません。", 404)
+        CACHE_LOOKUPS.inc(cache='result_store', result='hit')
+
+        size = properties.size
+        settings = properties.content_settings
+        headers['Content-Type'] = settings.content_type or 'application/octet-stream'
+        if settings.content_disposition:
+            headers['Content-Disposition'] = settings.content_disposition
+
+        byte_range = None
+        range_header = req.headers.get('Range')
+        if range_header and (not req.headers.get('If-Range') or etag_matches(req.headers.get('If-Range'), etag)):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                return create_error_response("要求された範囲が変換結果の範囲外です。", 416,
+                                             {**headers, 'Content-Range': f'bytes */{size}'})
+
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1
+        status_code = 200
+        if byte_range is not None:
+            status_code = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        if length > result_store.get_max_response_bytes():
+            # 大きな範囲は関数のメモリを経由せず、Blob Storage から直接ダウンロードさせる
+            location = get_blob_url_with_sas(CONTENT_CONTAINER, content_hash, expiry=REDIRECT_SAS_EXPIRY)
+            return func.HttpResponse(status_code=307, headers={
+                'Location': location, 'ETag': etag, 'Cache-Control': 'no-store', **get_security_headers()
+            })
+
+        if req.method == 'HEAD' or length <= 0:
+            body = b''
+        else:
+            with STAGE_SECONDS.time(stage='download'), tracing.start_span('download', {'xls2xlsx.output.size': length}):
+                body = blob_client.download_blob(offset=start, length=length, max_concurrency=4).readall()
+        return func.HttpResponse(body, status_code=status_code, headers={**headers, **get_security_headers()})
+
+    except Exception as e:
+        logging.error(f"変換結果の取得エラー: {str(e)}", exc_info=True)
+        log_security_event('result_fetch_error', {'error': str(e), 'content_hash': content_hash})
+        return create_error_response(sanitize_error_message(e, is_production), 500)
@@ -5,8 +5,11 @@
 import re
 import os
 import logging
+import struct
 from typing import Tuple
 
+import tracing
+
 # 定数
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 MAX_FILENAME_LENGTH = 255
@@ -14,6 +17,9 @@ XLS_MAGIC_NUMBERS = [
     b'\xd0\xcf\x11\xe0',  # OLE2/CFB (Compound File Binary) - XLS
     b'\x09\x08\x10\x00\x00\x06\x05\x00',  # BIFF5
 ]
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+OLE2_HEADER_SIZE = 512
+MIN_FILE_SIZE = 100
 
 
 def sanitize_filename(filename: str, max_length: int = MAX_FILENAME_LENGTH) -> str:
@@ -91,7 +97,7 @@ def validate_file_size(file_data: bytes, max_size: int = MAX_FILE_SIZE) -> Tuple
     if file_size > max_size:
         return False, f"ファイルサイズが上限を超えています（最大{max_size // 1024 // 1024}MB）。現在のサイズ: {file_size // 1024 // 1024}MB"
     
-    if file_size < 100:  # 最小サイズチェック（100バイト未満は異常）
+    if file_size < MIN_FILE_SIZE:  # 最小サイズチェック（100バイト未満は異常）
         return False, "ファイルサイズが小さすぎます"
     
     return True, ""
@@ -129,6 +135,39 @@ def validate_xls_format(file_data: bytes) -> Tuple[bool, str]:
     return False, "有効なXLSファイル形式ではありません。XLS形式のファイルのみサポートされています。"
 
 
+def validate_ole2_header(header: bytes, max_size: int = MAX_FILE_SIZE) -> Tuple[bool, str]:
+    """
+    OLE2（複合ファイル）ヘッダーの構造を検証
+    先頭 512 バイトだけで判定できるため、ボディ全体の受信前に不正な入力を拒否できる
+
+    Args:
+        header: ファイル先頭のバイナリデータ（OLE2_HEADER_SIZE バイト）
+        max_size: 最大許容サイズ（FAT セクタ数の上限の算出に使用）
+
+    Returns:
+        (検証成功: bool, エラーメッセージ: str)
+    """
+    invalid = "有効なXLSファイル形式ではありません。OLE2ヘッダーが不正です。"
+    if len(header) < OLE2_HEADER_SIZE or not header.startswith(OLE2_SIGNATURE):
+        return False, invalid
+
+    (major_version, byte_order, sector_shift, mini_sector_shift) = struct.unpack_from('<HHHH', header, 0x1A)
+    fat_sectors = struct.unpack_from('<I', header, 0x2C)[0]
+    mini_stream_cutoff = struct.unpack_from('<I', header, 0x38)[0]
+
+    # バージョン3は512バイト、バージョン4は4096バイトのセクタ
+    if (major_version, sector_shift) not in ((3, 9), (4, 12)):
+        return False, invalid
+    if byte_order != 0xFFFE or mini_sector_shift != 6 or mini_stream_cutoff != 4096:
+        return False, invalid
+    # FAT セクタ1つが管理する範囲から、上限サイズを超えるファイルを指すヘッダーを拒否
+    sector_size = 1 << sector_shift
+    fat_coverage = (sector_size // 4) * sector_size
+    if fat_sectors == 0 or fat_sectors > max_size // fat_coverage + 1:
+        return False, invalid
+    return True, ""
+
+
 def validate_input(file_data: bytes, filename: str) -> Tuple[bool, str, str]:
     """
     入力データを包括的に検証
@@ -197,17 +236,20 @@ def sanitize_error_message(error: Exception, is_production: bool = False) -> str
 def log_security_event(event_type: str, details: dict):
     """
     セキュリティイベントをログに記録
+    トレーシングが有効な場合は現在のスパンにもイベントとして記録し、ログにトレースIDを付与する
     
     Args:
         event_type: イベントタイプ（例: 'invalid_file_format', 'file_too_large'）
         details: イベント詳細情報
     """
+    tracing.add_event('security_event', {'event_type': event_type})
     logging.warning(
         f"Security Event: {event_type}",
         extra={
             'event_type': event_type,
             'details': details,
-            'severity': 'WARNING'
+            'severity': 'WARNING',
+            'trace_id': tracing.current_trace_id()
         }
     )
 
@@ -0,0 +1,490 @@
+"""
+スパース対応の列指向シート中間表現モジュール
+空でないセルのみを型別バッファ（float64 / SST インデックス / 真偽値）に保持し、
+疎なシートでもメモリ使用量が非空セル数に比例するようにする
+"""
+import heapq
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+import xlrd
+
+# セル種別コード
+KIND_NUMBER = 1
+KIND_TEXT = 2
+KIND_BOOL = 3
+KIND_DATE = 4
+KIND_ERROR = 5
+
+# xlrd のセル型 → 中間表現のセル種別
+_XLRD_KIND_MAP = {
+    xlrd.XL_CELL_NUMBER: KIND_NUMBER,
+    xlrd.XL_CELL_TEXT: KIND_TEXT,
+    xlrd.XL_CELL_BOOLEAN: KIND_BOOL,
+    xlrd.XL_CELL_DATE: KIND_DATE,
+    xlrd.XL_CELL_ERROR: KIND_ERROR,
+}
+
+# スキーマヒントで指定できる列型
+TYPE_TEXT = 'text'
+TYPE_NUMBER = 'number'
+TYPE_BOOL = 'bool'
+SCHEMA_TYPES = (TYPE_TEXT, TYPE_NUMBER, TYPE_BOOL)
+
+_TRUE_TEXTS = frozenset(('true', 'yes', '1'))
+_FALSE_TEXTS = frozenset(('false', 'no', '0'))
+
+
+class InputLimitError(ValueError):
+    """入力がシート数等の処理上限を超えている（同じ入力は何度変換しても失敗する）"""
+
+
+class SheetSelectionError(ValueError):
+    """シート・行範囲の指定が不正（存在しないシート名等）"""
+
+
+class SharedStrings:
+    """
+    ワークブック共通の共有文字列テーブル（SST）
+
+    文字列は一度だけ保持し、セルからはインデックスで参照する
+    """
+    __slots__ = ('strings', 'ref_count', '_index')
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ref_count = 0
+        self._index: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        """
+        文字列を登録してインデックスを返す
+
+        Args:
+            value: 文字列
+
+        Returns:
+            SST 内のインデックス
+        """
+        self.ref_count += 1
+        index = self._index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self._index[value] = index
+            self.strings.append(value)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, index: int) -> str:
+        return self.strings[index]
+
+
+class ColumnChunk:
+    """
+    1列分の非空セルを保持する列チャンク
+
+    セルは行番号の昇順で追加される前提。値は種別ごとの型付きバッファに
+    追加順で格納し、走査時は種別ごとのカーソルで取り出す
+    """
+    __slots__ = ('rows', 'kinds', 'numbers', 'strings', 'bools')
+
+    def __init__(self):
+        self.rows = array('I')      # 行番号
+        self.kinds = array('B')     # セル種別コード
+        self.numbers = array('d')   # 数値・日付シリアル値・エラーコード
+        self.strings = array('I')   # SST インデックス
+        self.bools = array('B')     # 真偽値
+
+    def append(self, row: int, kind: int, value) -> None:
+        """
+        セルを追加
+
+        Args:
+            row: 行番号（0始まり）
+            kind: セル種別コード
+            value: 値（KIND_TEXT の場合は SST インデックス）
+        """
+        self.rows.append(row)
+        self.kinds.append(kind)
+        if kind == KIND_TEXT:
+            self.strings.append(value)
+        elif kind == KIND_BOOL:
+            self.bools.append(1 if value else 0)
+        else:
+            self.numbers.append(value)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, object]]:
+        """
+        (行番号, セル種別, 値) を行順に返す
+        """
+        numbers = iter(self.numbers)
+        strings = iter(self.strings)
+        bools = iter(self.bools)
+        for row, kind in zip(self.rows, self.kinds):
+            if kind == KIND_TEXT:
+                yield row, kind, next(strings)
+            elif kind == KIND_BOOL:
+                yield row, kind, bool(next(bools))
+            else:
+                yield row, kind, next(numbers)
+
+    def nbytes(self) -> int:
+        """
+        バッファの使用バイト数を返す
+        """
+        return sum(
+            len(buf) * buf.itemsize
+            for buf in (self.rows, self.kinds, self.numbers, self.strings, self.bools)
+        )
+
+
+class SparseSheet:
+    """
+    非空セルのみを列チャンク単位で保持するシート
+    """
+    __slots__ = ('name', 'columns', 'nrows', 'ncols', 'declared_nrows', 'declared_ncols')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.columns: Dict[int, ColumnChunk] = {}
+        self.nrows = 0  # データ範囲の行数（最終非空行 + 1）
+        self.ncols = 0  # データ範囲の列数（最終非空列 + 1）
+        self.declared_nrows = 0  # XLS 上の使用範囲の行数（DIMENSIONS レコード含む）
+        self.declared_ncols = 0  # XLS 上の使用範囲の列数（DIMENSIONS レコード含む）
+
+    def add_cell(self, row: int, col: int, kind: int, value) -> None:
+        """
+        セルを追加（同一列内では行番号の昇順で追加すること）
+        """
+        chunk = self.columns.get(col)
+        if chunk is None:
+            chunk = self.columns[col] = ColumnChunk()
+        chunk.append(row, kind, value)
+        if row >= self.nrows:
+            self.nrows = row + 1
+        if col >= self.ncols:
+            self.ncols = col + 1
+
+    @property
+    def cell_count(self) -> int:
+        """
+        非空セル数
+        """
+        return sum(len(chunk) for chunk in self.columns.values())
+
+    @property
+    def trimmed_cells(self) -> int:
+        """
+        XLS 上の使用範囲から除外したセル数（実データ範囲外の領域）
+        """
+        declared = max(self.declared_nrows, self.nrows) * max(self.declared_ncols, self.ncols)
+        return declared - self.nrows * self.ncols
+
+    def nbytes(self) -> int:
+        """
+        列チャンクの使用バイト数を返す
+        """
+        return sum(chunk.nbytes() for chunk in self.columns.values())
+
+    def iter_cells(self) -> Iterator[Tuple[int, int, int, object]]:
+        """
+        (行番号, 列番号, セル種別, 値) を行優先順に返す
+        """
+        streams = [_tag_column(col, self.columns[col]) for col in sorted(self.columns)]
+        return heapq.merge(*streams)
+
+    def iter_rows(self) -> Iterator[Tuple[int, List[Tuple[int, int, object]]]]:
+        """
+        (行番号, [(列番号, セル種別, 値), ...]) を行順に返す
+        空行は返さない
+        """
+        current_row = -1
+        cells: List[Tuple[int, int, object]] = []
+        for row, col, kind, value in self.iter_cells():
+            if row != current_row:
+                if cells:
+                    yield current_row, cells
+                current_row = row
+                cells = []
+            cells.append((col, kind, value))
+        if cells:
+            yield current_row, cells
+
+
+def _tag_column(col: int, chunk: ColumnChunk) -> Iterator[Tuple[int, int, int, object]]:
+    """
+    列チャンクのセルに列番号を付けて返す
+    """
+    for row, kind, value in chunk:
+        yield row, col, kind, value
+
+
+def build_sparse_sheet(sheet, sst: SharedStrings, name: str = None, schema: dict = None,
+                       row_range: Tuple[int, int] = None) -> SparseSheet:
+    """
+    xlrd のシートから中間表現を構築
+
+    空セル・空白セル・空文字列セルは保持しない。セルは BIFF 上の型のまま保持し、
+    スキーマヒントが指定された列のみ指定の型に変換する
+
+    Args:
+        sheet: xlrd.sheet.Sheet
+        sst: 文字列の登録先となる共有文字列テーブル
+        name: シート名（省略時は xlrd のシート名）
+        schema: スキーマヒント {'default': 列型 or None, 'columns': {列番号: 列型}}
+        row_range: 読み込む行範囲 (開始行, 終了行)（0始まり・終了行は含まない・None は最終行まで）。
+            指定時は開始行が中間表現の先頭行になる
+
+    Returns:
+        SparseSheet
+    """
+    sparse = SparseSheet(name if name is not None else sheet.name)
+    sparse.declared_nrows, sparse.declared_ncols = clip_extent(declared_extent(sheet), row_range)
+    start, stop = _resolve_row_range(sheet, row_range)
+    kind_map = _XLRD_KIND_MAP
+    column_types = schema.get('columns', {}) if schema else {}
+    default_type = schema.get('default') if schema else None
+    datemode = sheet.book.datemode
+    for row in range(start, stop):
+        types = sheet.row_types(row)
+        values = sheet.row_values(row)
+        for col, cell_type in enumerate(types):
+            kind = kind_map.get(cell_type)
+            if kind is None:
+                continue
+            value = values[col]
+            if kind == KIND_TEXT and not value:
+                continue
+            target = column_types.get(col, default_type)
+            if target is not None:
+                kind, value = coerce_cell(kind, value, target, datemode)
+            if kind == KIND_TEXT:
+                value = sst.intern(value)
+            sparse.add_cell(row - start, col, kind, value)
+    return sparse
+
+
+def coerce_cell(kind: int, value, target: str, datemode: int = 0) -> Tuple[int, object]:
+    """
+    セル値をスキーマヒントの列型に変換
+
+    変換できない値は元の型のまま返す
+
+    Args:
+        kind: セル種別コード
+        value: セル値（KIND_TEXT の場合は文字列）
+        target: 変換先の列型（text / number / bool）
+        datemode: 日付モード（日付→文字列変換に使用）
+
+    Returns:
+        (セル種別コード, 値)
+    """
+    if target == TYPE_TEXT:
+        if kind == KIND_NUMBER:
+            return KIND_TEXT, str(int(value)) if value.is_integer() else repr(value)
+        if kind == KIND_BOOL:
+            return KIND_TEXT, 'TRUE' if value else 'FALSE'
+        if kind == KIND_DATE:
+            return KIND_TEXT, xlrd.xldate_as_datetime(value, datemode).isoformat(sep=' ')
+        if kind == KIND_ERROR:
+            return KIND_TEXT, xlrd.error_text_from_code.get(int(value), '#N/A')
+    elif target == TYPE_NUMBER:
+        if kind == KIND_TEXT:
+            try:
+                return KIND_NUMBER, float(value.strip().replace(',', ''))
+            except ValueError:
+                pass
+        elif kind == KIND_BOOL:
+            return KIND_NUMBER, 1.0 if value else 0.0
+    elif target == TYPE_BOOL:
+        if kind in (KIND_NUMBER, KIND_DATE):
+            return KIND_BOOL, value != 0
+        if kind == KIND_TEXT:
+            text = value.strip().lower()
+            if text in _TRUE_TEXTS:
+                return KIND_BOOL, True
+            if text in _FALSE_TEXTS:
+                return KIND_BOOL, False
+    return kind, value
+
+
+def declared_extent(sheet) -> Tuple[int, int]:
+    """
+    XLS 上の使用範囲（行数, 列数）を返す
+
+    書式だけが設定された空セルや、実データより大きい DIMENSIONS レコードも含む
+
+    Args:
+        sheet: xlrd.sheet.Sheet
+
+    Returns:
+        (行数, 列数)
+    """
+    # DIMENSIONS レコードの値は xlrd の非公開属性にのみ保持される
+    return (
+        max(sheet.nrows, getattr(sheet, '_dimnrows', 0)),
+        max(sheet.ncols, getattr(sheet, '_dimncols', 0)),
+    )
+
+
+def data_extent(sheet, row_range: Tuple[int, int] = None) -> Tuple[int, int]:
+    """
+    実データ範囲（行数, 列数）を返す
+
+    空セル・空白セル・空文字列セルは無視する
+
+    Args:
+        sheet: xlrd.sheet.Sheet
+        row_range: 対象の行範囲（build_sparse_sheet を参照）。行数は開始行からの行数
+
+    Returns:
+        (最終非空行 + 1, 最終非空列 + 1)
+    """
+    nrows = ncols = 0
+    kind_map = _XLRD_KIND_MAP
+    start, stop = _resolve_row_range(sheet, row_range)
+    for row in range(start, stop):
+        types = sheet.row_types(row)
+        values = sheet.row_values(row)
+        for col in range(len(types) - 1, -1, -1):
+            if types[col] in kind_map and values[col] != '':
+                nrows = row - start + 1
+                if col >= ncols:
+                    ncols = col + 1
+                break
+    return nrows, ncols
+
+
+def clip_extent(extent: Tuple[int, int], row_range: Tuple[int, int] = None) -> Tuple[int, int]:
+    """
+    使用範囲（行数, 列数）を行範囲内に切り詰める
+
+    Args:
+        extent: (行数, 列数)
+        row_range: 行範囲（build_sparse_sheet を参照）
+
+    Returns:
+        行範囲内の (行数, 列数)
+    """
+    if row_range is None:
+        return extent
+    start, stop = row_range
+    nrows = extent[0] if stop is None else min(extent[0], stop)
+    return max(0, nrows - start), extent[1]
+
+
+def _resolve_row_range(sheet, row_range: Tuple[int, int] = None) -> Tuple[int, int]:
+    """行範囲をシートの行数内の (開始行, 終了行) に変換"""
+    if row_range is None:
+        return 0, sheet.nrows
+    start, stop = row_range
+    stop = sheet.nrows if stop is None else min(stop, sheet.nrows)
+    return min(start, stop), stop
+
+
+def select_sheet_indices(sheet_names: List[str], selection: List[str] = None) -> List[int]:
+    """
+    シート指定をシート番号（0始まり）の一覧に変換
+
+    各指定はシート名に一致すればそのシート、一致せず数字のみの場合は
+    1始まりのシート番号として扱う。重複は除き、指定順を保つ
+
+    Args:
+        sheet_names: ブックのシート名一覧
+        selection: シート名またはシート番号の一覧（None は全シート）
+
+    Returns:
+        シート番号の一覧
+
+    Raises:
+        SheetSelectionError: 存在しないシートの指定
+    """
+    if selection is None:
+        return list(range(len(sheet_names)))
+    positions = {name: index for index, name in reversed(list(enumerate(sheet_names)))}
+    indices = []
+    for item in selection:
+        if item in positions:
+            index = positions[item]
+        elif item.isdigit() and 1 <= int(item) <= len(sheet_names):
+            index = int(item) - 1
+        else:
+            raise SheetSelectionError(f"指定されたシートが見つかりません: {item}")
+        if index not in indices:
+            indices.append(index)
+    return indices
+
+
+def open_xls_book(xls_data, on_demand: bool = True, ragged_rows: bool = True):
+    """
+    XLS データを xlrd で開く（行は詰め物なし、シートは必要時に読み込み）
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ（bytes-like）
+        on_demand: シートを必要時に読み込むか
+        ragged_rows: 各行を最終セルまでで打ち切るか（False の場合は全行をシートの列数に揃える）
+
+    Returns:
+        xlrd.Book
+    """
+    return xlrd.open_workbook(
+        file_contents=xls_data,
+        on_demand=on_demand,
+        ragged_rows=ragged_rows,
+        logfile=_NullLog(),
+    )
+
+
+def load_sparse_workbook(
+    xls_data,
+    max_sheets: int = None,
+    schema: dict = None,
+    sheets: List[str] = None,
+    rows: Tuple[int, int] = None,
+) -> Tuple[List[SparseSheet], SharedStrings, int]:
+    """
+    XLS データを中間表現に読み込む
+
+    シートは1枚ずつ読み込み、変換後すぐに xlrd 側のデータを解放する。
+    シートを指定した場合、指定外のシートは解析しない
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        max_sheets: シート数上限（超過時は読み込み前に InputLimitError）
+        schema: スキーマヒント（build_sparse_sheet を参照）
+        sheets: 読み込むシート（select_sheet_indices を参照、None は全シート）
+        rows: 各シートで読み込む行範囲（build_sparse_sheet を参照）
+
+    Returns:
+        (シート一覧, 共有文字列テーブル, 日付モード（0: 1900年, 1: 1904年）)
+
+    Raises:
+        InputLimitError: シート数制限超過
+        SheetSelectionError: 存在しないシートの指定
+    """
+    book = open_xls_book(xls_data)
+    try:
+        indices = select_sheet_indices(book.sheet_names(), sheets)
+        if max_sheets is not None and len(indices) > max_sheets:
+            raise InputLimitError(f"シート数が多すぎます（最大{max_sheets}シート）")
+        sst = SharedStrings()
+        sheets = []
+        for index in indices:
+            sheets.append(build_sparse_sheet(book.sheet_by_index(index), sst, schema=schema, row_range=rows))
+            book.unload_sheet(index)
+        return sheets, sst, book.datemode
+    finally:
+        book.release_resources()
+
+
+class _NullLog:
+    """
+    xlrd の警告出力を抑止するダミーログ
+    """
+    def write(self, _text):
+        pass
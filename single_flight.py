@@ -0,0 +1,280 @@
+"""
+重複変換の抑止（single-flight）モジュール
+同じ変換キーの変換が同時に要求された場合、最初の要求だけが変換を実行し、
+後続の要求はその結果を待って共有する
+
+- プロセス内: 変換キー → Future の対応表
+- インスタンス間（DISTRIBUTED_SINGLE_FLIGHT 有効時）: ロックBlobのリースで排他し、
+  変換結果を xls-results コンテナで共有
+"""
+import os
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Tuple
+
+from columnar_writer import FORMAT_XLSX, archive_name
+from conversion_utils import compute_input_hash, conversion_key
+from metrics_registry import CACHE_LOOKUPS
+import tracing
+import worker_pool
+
+# リース期間（秒、15〜60）。変換中は期間の 1/3 ごとに更新する
+LEASE_DURATION = 60
+
+# ロック取得待ちのポーリング間隔（秒）
+LOCK_POLL_INTERVAL = 0.5
+
+# 共有する変換統計のBlobの拡張子（xls-results/<変換キー>.stats、JSON）
+STATS_SUFFIX = '.stats'
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+_inflight_lock = threading.Lock()
+_inflight = {}
+
+# 統計（プロセス内）
+_stats_lock = threading.Lock()
+_stats = {'leaders': 0, 'coalesced': 0, 'shared_results': 0}
+
+
+def is_distributed_enabled() -> bool:
+    """インスタンス間の重複抑止（DISTRIBUTED_SINGLE_FLIGHT）が有効かを返す"""
+    return os.environ.get('DISTRIBUTED_SINGLE_FLIGHT', '').lower() in _TRUE_VALUES
+
+
+def get_lock_wait_seconds() -> float:
+    """ロック取得の最大待ち時間（SINGLE_FLIGHT_WAIT_SECONDS、既定: 120秒）"""
+    try:
+        return float(os.environ.get('SINGLE_FLIGHT_WAIT_SECONDS', '120'))
+    except ValueError:
+        return 120.0
+
+
+def get_stats() -> dict:
+    """プロセス内の重複抑止統計を返す"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def run_single_flight(key: str, fn: Callable[[], object]) -> Tuple[object, bool]:
+    """
+    同じキーの処理をプロセス内で1回だけ実行
+
+    Args:
+        key: 処理を識別するキー
+        fn: 実行する処理（引数なし）
+
+    Returns:
+        (処理結果, 他の要求の結果を共有した場合 True)
+
+    Raises:
+        Exception: fn が送出した例外（待機していた要求にも同じ例外を送出）
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not is_leader:
+        _count('coalesced')
+        return future.result(), True
+
+    _count('leaders')
+    try:
+        result = fn()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result, False
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def convert_coalesced(xls_data: bytes, engine: str = None, input_hash: str = None,
+                      **options) -> Tuple[bytes, dict, bool]:
+    """
+    重複抑止付きで XLS を XLSX に変換
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        engine: 変換エンジン（省略時は環境変数 CONVERSION_ENGINE）
+        input_hash: 計算済みの入力ハッシュ（省略時は計算する）
+        **options: 変換オプション（convert_xls_to_xlsx_with_stats を参照）
+
+    Returns:
+        (XLSXファイルのバイナリデータ, 変換統計, 他の要求の結果を共有した場合 True)
+
+    Raises:
+        convert_xls_to_xlsx_with_stats と同じ
+        worker_pool.WorkerCrashed / WorkerTimeout: 変換ワーカーの異常終了・制限時間超過
+    """
+    key = conversion_key(input_hash or compute_input_hash(xls_data), engine, **options)
+
+    def convert():
+        if is_distributed_enabled():
+            return _convert_with_blob_lock(key, xls_data, engine, options)
+        xlsx_data, stats = worker_pool.convert(xls_data, engine, **options)
+        return xlsx_data, stats, False
+
+    with tracing.start_span('convert', {'xls2xlsx.engine': engine, 'xls2xlsx.input.size': len(xls_data)}):
+        (xlsx_data, stats, shared), coalesced = run_single_flight(key, convert)
+        if coalesced:
+            logging.info(f"Coalesced with in-flight conversion: {key}")
+        result = 'hit' if coalesced or shared else 'miss'
+        CACHE_LOOKUPS.inc(cache='single_flight', result=result)
+        tracing.set_attributes({
+            'xls2xlsx.cache.single_flight': result,
+            'xls2xlsx.engine': stats['engine'],
+            'xls2xlsx.sheet_count': len(stats['sheets']) or None,
+        })
+        if result == 'miss':
+            # 変換ワーカーで計測した解析・書き出しの所要時間を子スパンとして記録
+            tracing.record_timings(stats.get('timings'))
+    return xlsx_data, stats, coalesced or shared
+
+
+def _convert_with_blob_lock(key: str, xls_data: bytes, engine: str, options: dict) -> Tuple[bytes, dict, bool]:
+    """
+    ロックBlobのリースでインスタンス間を排他して変換
+
+    リース取得後、他のインスタンスが保存した結果があればそれを返す。
+    Storage に接続できない・待ち時間を超えた場合はロックなしで変換する
+    """
+    lease = None
+    try:
+        try:
+            lease = _acquire_lock(key)
+            cached = _load_result(key, options.get('output_format'))
+            if cached is not None:
+                _count('shared_results')
+                logging.info(f"Reusing conversion result from another instance: {key}")
+                return cached[0], cached[1], True
+        except Exception as e:
+            logging.warning(f"分散ロックエラー（ロックなしで変換）: {str(e)}")
+
+        with _LeaseRenewer(lease):
+            xlsx_data, stats = worker_pool.convert(xls_data, engine, **options)
+        if lease is not None:
+            try:
+                _save_result(key, xlsx_data, stats)
+            except Exception as e:
+                logging.warning(f"変換結果の保存エラー（無視可能）: {str(e)}")
+        return xlsx_data, stats, False
+    finally:
+        if lease is not None:
+            try:
+                lease.release()
+            except Exception as e:
+                logging.warning(f"リース解放エラー（期限切れで解放されます）: {str(e)}")
+
+
+def _acquire_lock(key: str):
+    """
+    ロックBlobのリースを取得（他のインスタンスが保持中の場合は解放まで待機）
+
+    Returns:
+        BlobLeaseClient（待ち時間を超えた場合は None）
+    """
+    from azure.core.exceptions import HttpResponseError, ResourceExistsError
+    from storage_utils import LOCK_CONTAINER, ensure_container
+
+    blob_client = ensure_container(LOCK_CONTAINER).get_blob_client(key)
+    try:
+        blob_client.upload_blob(b'', overwrite=False)
+    except ResourceExistsError:
+        # 既存のロックBlobはそのまま使用
+        pass
+    except HttpResponseError as e:
+        # リース中のロックBlobへの書き込みは 412 で拒否される
+        if e.status_code != 412:
+            raise
+
+    deadline = time.monotonic() + get_lock_wait_seconds()
+    while True:
+        try:
+            return blob_client.acquire_lease(lease_duration=LEASE_DURATION)
+        except HttpResponseError as e:
+            if e.status_code != 409:
+                raise
+        if time.monotonic() >= deadline:
+            logging.warning(f"ロック取得待ちがタイムアウトしました: {key}")
+            return None
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def _load_result(key: str, output_format: str = None):
+    """
+    共有済みの変換結果を取得
+
+    Returns:
+        (変換結果のバイナリ, 変換統計)（未保存の場合は None）
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    from storage_utils import RESULTS_CONTAINER, ensure_container
+
+    container = ensure_container(RESULTS_CONTAINER)
+    try:
+        # 統計は変換結果より先に保存するため、統計が無ければ変換結果も共有されていない
+        stats = json.loads(container.get_blob_client(f"{key}{STATS_SUFFIX}").download_blob().readall())
+        data = container.get_blob_client(_result_blob_name(key, output_format)).download_blob().readall()
+    except ResourceNotFoundError:
+        return None
+    return data, stats
+
+
+def _save_result(key: str, data: bytes, stats: dict):
+    """変換結果と変換統計（シート単位の統計を含む）を共有用コンテナに保存"""
+    from storage_utils import RESULTS_CONTAINER, ensure_container
+
+    # 所要時間は変換したインスタンスの計測値のため共有しない
+    summary = {name: value for name, value in stats.items() if name != 'timings'}
+    container = ensure_container(RESULTS_CONTAINER)
+    container.upload_blob(f"{key}{STATS_SUFFIX}", json.dumps(summary).encode('utf-8'), overwrite=True)
+    container.upload_blob(_result_blob_name(key, stats['format']), data, overwrite=True)
+
+
+def _result_blob_name(key: str, output_format: str = None) -> str:
+    """共有する変換結果のBlob名（出力形式の拡張子。例: "<変換キー>.xlsx"、"<変換キー>.csv.zip"）"""
+    return archive_name(key, output_format or FORMAT_XLSX)
+
+
+class _LeaseRenewer:
+    """変換中にバックグラウンドでリースを更新するコンテキストマネージャー"""
+
+    def __init__(self, lease):
+        self._lease = lease
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self._lease is not None:
+            self._thread = threading.Thread(target=self._run, name='lease-renewer', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return False
+
+    def _run(self):
+        while not self._stopped.wait(LEASE_DURATION / 3):
+            try:
+                self._lease.renew()
+            except Exception as e:
+                logging.warning(f"リース更新エラー: {str(e)}")
+                return
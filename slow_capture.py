@@ -0,0 +1,324 @@
+"""
+遅い変換の記録モジュール
+入力サイズに対して所要時間・メモリ使用量が閾値を超えた変換（および CPU 時間・経過時間・
+メモリの上限で中断された変換）について、入力ハッシュ・BIFF レコードの走査による
+ワークブック統計・段階ごとの所要時間・エンジンを診断用コンテナ（xls-diagnostics）に記録する
+
+SLOW_CAPTURE_COPY_INPUT を有効にした場合は、入力を perf-quarantine コンテナにコピーし、
+replay_slow_inputs.py でエンジンごとに再変換してベンチマークとして使用できるようにする
+
+BIFF レコードの走査と保存は応答を待たせないようにバックグラウンドのスレッドで行う（result_store.save_async と同じ）
+"""
+import io
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+from datetime import datetime, timezone
+
+from conversion_utils import FAILURE_CPU_LIMIT, FAILURE_MEMORY_LIMIT, FAILURE_TIMEOUT
+from metrics_registry import SLOW_CONVERSIONS
+from security_utils import OLE2_SIGNATURE
+import tracing
+
+# 診断用コンテナ内の記録の保存先（slow/<入力の SHA-256>.json）
+SLOW_PREFIX = 'slow/'
+
+# 閾値の判定理由
+REASON_LATENCY = 'latency'
+REASON_MEMORY = 'memory'
+
+# 上限で中断された変換（遅い変換として記録する失敗種別）
+RESOURCE_FAILURES = (FAILURE_MEMORY_LIMIT, FAILURE_CPU_LIMIT, FAILURE_TIMEOUT)
+
+# 記録済みの入力ハッシュ（プロセス内、同じ入力の記録の重複を抑止）
+MAX_RECORDED = 1024
+
+# バックグラウンドで記録を待つ変換の上限（超過分は記録しない）
+MAX_PENDING = 4
+
+# BIFF レコード種別
+_BOF = 0x0809
+_BOUNDSHEET = 0x0085
+_SST = 0x00FC
+_CONTINUE = 0x003C
+_FORMAT = 0x041E
+_FONT = 0x0031
+_XF = 0x00E0
+_MERGEDCELLS = 0x00E5
+_NAME = 0x0018
+_ROW = 0x0208
+_FORMULA = 0x0006
+_SHRFMLA = 0x04BC
+_LABELSST = 0x00FD
+_LABEL = 0x0204
+_NUMBER = 0x0203
+_RK = 0x027E
+_BOOLERR = 0x0205
+_BLANK = 0x0201
+_MULRK = 0x00BD
+_MULBLANK = 0x00BE
+
+# 値を持つセルのレコード（1レコード1セル）
+_VALUE_RECORDS = {
+    _LABELSST: 'text_cells', _LABEL: 'text_cells', _NUMBER: 'number_cells', _RK: 'number_cells',
+    _BOOLERR: 'bool_error_cells', _FORMULA: 'formula_cells',
+}
+
+_recorded_lock = threading.Lock()
+_recorded = set()
+_capturing = set()
+_pending = queue.Queue(maxsize=MAX_PENDING)
+_recorder = None
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def get_seconds_per_mb() -> float:
+    """入力 1MB あたりの変換時間の閾値（SLOW_CONVERSION_SECONDS_PER_MB、既定: 5秒、0 で無効）"""
+    return _env_float('SLOW_CONVERSION_SECONDS_PER_MB', 5.0)
+
+
+def get_min_seconds() -> float:
+    """遅い変換とみなす最小の変換時間（SLOW_CONVERSION_MIN_SECONDS、既定: 10秒）"""
+    return _env_float('SLOW_CONVERSION_MIN_SECONDS', 10.0)
+
+
+def get_memory_ratio() -> float:
+    """入力サイズに対する変換中の RSS 増加量の閾値（SLOW_CONVERSION_MEMORY_RATIO、既定: 40倍、0 で無効）"""
+    return _env_float('SLOW_CONVERSION_MEMORY_RATIO', 40.0)
+
+
+def get_min_memory() -> int:
+    """メモリを多く使った変換とみなす最小の RSS 増加量（SLOW_CONVERSION_MIN_MEMORY_MB、既定: 256MB）"""
+    return int(_env_float('SLOW_CONVERSION_MIN_MEMORY_MB', 256) * 1024 * 1024)
+
+
+def is_copy_enabled() -> bool:
+    """遅い変換の入力を perf-quarantine コンテナにコピーするか（SLOW_CAPTURE_COPY_INPUT）"""
+    return os.environ.get('SLOW_CAPTURE_COPY_INPUT', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def slow_reasons(input_size: int, stats: dict) -> list:
+    """
+    変換統計から閾値を超えた項目を判定
+
+    Args:
+        input_size: 入力サイズ（バイト）
+        stats: 変換統計（timings の convert、peak_memory を使用）
+
+    Returns:
+        閾値を超えた項目（REASON_LATENCY / REASON_MEMORY）。超えていない場合は空
+    """
+    reasons = []
+    megabytes = input_size / (1024 * 1024)
+    seconds = (stats.get('timings') or {}).get('convert')
+    per_mb = get_seconds_per_mb()
+    if per_mb and seconds is not None and seconds > max(get_min_seconds(), per_mb * megabytes):
+        reasons.append(REASON_LATENCY)
+    peak_memory = stats.get('peak_memory')
+    ratio = get_memory_ratio()
+    if ratio and peak_memory is not None and peak_memory > max(get_min_memory(), ratio * input_size):
+        reasons.append(REASON_MEMORY)
+    return reasons
+
+
+def scan_workbook(xls_data: bytes) -> dict:
+    """
+    Workbook ストリームの BIFF レコードを走査してワークブックの統計を集計
+
+    セルの値は解析せず、レコードの種別と長さのみを数える（変換より十分に速い）
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+
+    Returns:
+        レコード数・シート数・セルの種類別の数・共有文字列数・書式数など
+        （ストリームを取り出せない場合は 'error' のみ）
+    """
+    from xlrd.compdoc import CompDoc, CompDocError
+
+    if not xls_data.startswith(OLE2_SIGNATURE):
+        # 複合ファイルに格納されていない BIFF5 のストリーム
+        stream = xls_data
+    else:
+        try:
+            compdoc = CompDoc(xls_data, logfile=io.StringIO())
+            stream = compdoc.get_named_stream('Workbook') or compdoc.get_named_stream('Book')
+        except (CompDocError, struct.error, IndexError, ValueError) as e:
+            return {'error': str(e)}
+    if not stream:
+        return {'error': 'Workbook ストリームがありません'}
+
+    counts = {
+        'stream_bytes': len(stream), 'records': 0, 'biff_version': None, 'sheets': 0, 'rows': 0,
+        'text_cells': 0, 'number_cells': 0, 'bool_error_cells': 0, 'formula_cells': 0, 'blank_cells': 0,
+        'shared_formulas': 0, 'sst_strings': 0, 'sst_unique_strings': 0, 'continue_records': 0,
+        'formats': 0, 'fonts': 0, 'xfs': 0, 'merged_ranges': 0, 'names': 0,
+    }
+    offset = 0
+    end = len(stream) - 4
+    while offset <= end:
+        record_type, length = struct.unpack_from('<HH', stream, offset)
+        offset += 4
+        counts['records'] += 1
+        if record_type in _VALUE_RECORDS:
+            counts[_VALUE_RECORDS[record_type]] += 1
+        elif record_type == _MULRK and length >= 6:
+            counts['number_cells'] += (length - 6) // 6
+        elif record_type in (_BLANK, _MULBLANK):
+            counts['blank_cells'] += 1 if record_type == _BLANK else max(0, (length - 6) // 2)
+        elif record_type == _ROW:
+            counts['rows'] += 1
+        elif record_type == _BOUNDSHEET:
+            counts['sheets'] += 1
+        elif record_type == _SST and length >= 8:
+            counts['sst_strings'], counts['sst_unique_strings'] = struct.unpack_from('<II', stream, offset)
+        elif record_type == _CONTINUE:
+            counts['continue_records'] += 1
+        elif record_type == _SHRFMLA:
+            counts['shared_formulas'] += 1
+        elif record_type == _FORMAT:
+            counts['formats'] += 1
+        elif record_type == _FONT:
+            counts['fonts'] += 1
+        elif record_type == _XF:
+            counts['xfs'] += 1
+        elif record_type == _MERGEDCELLS and length >= 2:
+            counts['merged_ranges'] += struct.unpack_from('<H', stream, offset)[0]
+        elif record_type == _NAME:
+            counts['names'] += 1
+        elif record_type == _BOF and counts['biff_version'] is None and length >= 2:
+            counts['biff_version'] = hex(struct.unpack_from('<H', stream, offset)[0])
+        offset += length
+    return counts
+
+
+def capture(xls_data: bytes, input_hash: str, source: str, reasons: list, engine: str,
+            stats: dict = None, options: dict = None) -> bool:
+    """
+    遅い変換を記録（診断用コンテナへの記録と、有効時は入力のコピー）
+
+    メトリクスのみ呼び出し元で記録し、BIFF レコードの走査と保存はバックグラウンドのスレッドで行う。
+    同じ入力はプロセス内で1回だけ記録する（保存に失敗した入力は次の要求で記録し直す）。
+    記録待ちが MAX_PENDING 件に達している場合は記録しない。保存に失敗しても例外は送出しない
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        input_hash: 入力データの SHA-256
+        source: 入力元（http / blob）
+        reasons: 判定理由（slow_reasons の戻り値、または RESOURCE_FAILURES の失敗種別）
+        engine: 変換エンジン
+        stats: 変換統計（上限で中断された変換は None）
+        options: 変換オプション
+
+    Returns:
+        記録を受け付けた場合 True
+    """
+    global _recorder
+    for reason in reasons:
+        SLOW_CONVERSIONS.inc(reason=reason)
+    tracing.set_attributes({'xls2xlsx.slow': ','.join(reasons)})
+    with _recorded_lock:
+        if input_hash in _recorded or input_hash in _capturing:
+            return False
+        if _recorder is None:
+            _recorder = threading.Thread(target=_capture_pending, name='slow-capture', daemon=True)
+            _recorder.start()
+        try:
+            _pending.put_nowait((xls_data, input_hash, source, reasons, engine, stats, options))
+        except queue.Full:
+            logging.warning(f"遅い変換の記録待ちが上限に達したため記録しません: {input_hash}")
+            return False
+        _capturing.add(input_hash)
+    return True
+
+
+def wait_pending():
+    """記録待ちの変換をすべて記録し終えるまで待機"""
+    _pending.join()
+
+
+def _capture_pending():
+    """記録待ちの変換を順に記録（バックグラウンドのスレッド）"""
+    while True:
+        xls_data, input_hash, source, reasons, engine, stats, options = _pending.get()
+        try:
+            saved = _write_record(xls_data, input_hash, source, reasons, engine, stats, options)
+        except Exception as e:
+            logging.warning(f"遅い変換の記録エラー: {str(e)}")
+            saved = False
+        finally:
+            del xls_data
+            _pending.task_done()
+        with _recorded_lock:
+            _capturing.discard(input_hash)
+            if saved:
+                if len(_recorded) >= MAX_RECORDED:
+                    _recorded.clear()
+                _recorded.add(input_hash)
+
+
+def _write_record(xls_data: bytes, input_hash: str, source: str, reasons: list, engine: str,
+                  stats: dict, options: dict) -> bool:
+    """記録を診断用コンテナに保存し、有効時は入力をコピー（保存した場合 True）"""
+    stats = stats or {}
+    logging.warning(f"Slow conversion ({', '.join(reasons)}): {input_hash} "
+                    f"({len(xls_data)} bytes, timings: {stats.get('timings')})")
+    record = {
+        'input_sha256': input_hash,
+        'input_size': len(xls_data),
+        'source': source,
+        'reasons': reasons,
+        'engine': stats.get('engine', engine),
+        'options': {key: value for key, value in (options or {}).items() if value is not None},
+        'timings': stats.get('timings', {}),
+        'peak_memory': stats.get('peak_memory'),
+        'sheets': stats.get('sheets', []),
+        'workbook': scan_workbook(xls_data),
+        'input_copied': is_copy_enabled(),
+        'captured_at': datetime.now(timezone.utc).isoformat(),
+    }
+    try:
+        from storage_utils import DIAGNOSTICS_CONTAINER, PERF_QUARANTINE_CONTAINER, ensure_container
+
+        if record['input_copied']:
+            ensure_container(PERF_QUARANTINE_CONTAINER).upload_blob(
+                f"{input_hash}.xls", xls_data, overwrite=True, metadata={'source_sha256': input_hash}
+            )
+        ensure_container(DIAGNOSTICS_CONTAINER).upload_blob(
+            f"{SLOW_PREFIX}{input_hash}.json",
+            json.dumps(record, ensure_ascii=False, default=str).encode('utf-8'),
+            overwrite=True,
+        )
+    except Exception as e:
+        logging.warning(f"遅い変換の記録エラー: {str(e)}")
+        return False
+    return True
+
+
+def capture_if_slow(xls_data: bytes, input_hash: str, source: str, stats: dict, options: dict = None) -> list:
+    """
+    変換統計が閾値を超えていれば記録
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        input_hash: 入力データの SHA-256
+        source: 入力元（http / blob）
+        stats: 変換統計（他の要求の結果を共有した場合は渡さない）
+        options: 変換オプション
+
+    Returns:
+        閾値を超えた項目（超えていない場合は空）
+    """
+    reasons = slow_reasons(len(xls_data), stats)
+    if reasons:
+        capture(xls_data, input_hash, source, reasons, stats.get('engine'), stats, options)
+    return reasons
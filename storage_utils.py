@@ -0,0 +1,193 @@
+"""
+Blob Storage ユーティリティモジュール
+プロセス内で共有する BlobServiceClient（HTTP 接続プール）とコンテナ作成処理を提供
+"""
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# 変換対象の入力コンテナ
+INPUT_CONTAINER = 'xls-input'
+
+# 変換結果の出力コンテナ
+OUTPUT_CONTAINER = 'xls-output'
+
+# 変換できない入力の隔離コンテナ
+QUARANTINE_CONTAINER = 'xls-quarantine'
+
+# 変換キー単位の変換結果（インスタンス間で共有）
+RESULTS_CONTAINER = 'xls-results'
+
+# 内容の SHA-256 をBlob名とする変換結果（結果取得API）
+CONTENT_CONTAINER = 'xls-content'
+
+# インスタンス間の排他制御用ロックBlob
+LOCK_CONTAINER = 'xls-locks'
+
+# 再開可能な変換の途中経過（シート単位のチェックポイント）
+CHECKPOINT_CONTAINER = 'xls-checkpoints'
+
+# 診断情報（要求単位のプロファイル）
+DIAGNOSTICS_CONTAINER = 'xls-diagnostics'
+
+# 遅い変換の入力のコピー（オフラインでの再現用、SLOW_CAPTURE_COPY_INPUT 有効時のみ）
+PERF_QUARANTINE_CONTAINER = 'perf-quarantine'
+
+# 変換対象Blob名のキュー（キュー駆動パイプライン）
+CONVERT_QUEUE = 'xls-convert-queue'
+
+_client_lock = threading.Lock()
+_blob_service_client = None
+_queue_service_client = None
+_ensured_containers = set()
+_ensured_queues = set()
+
+
+def get_connection_string() -> str:
+    """
+    Storage 接続文字列を取得
+
+    Returns:
+        接続文字列（未設定の場合はローカル開発用ストレージ）
+    """
+    return os.environ.get('AzureWebJobsStorage', 'UseDevelopmentStorage=true')
+
+
+def is_local_storage(connection_string: str = None) -> bool:
+    """
+    ローカル開発環境（Azurite）の接続文字列かどうかを判定
+    """
+    connection_string = connection_string or get_connection_string()
+    return 'UseDevelopmentStorage' in connection_string or '127.0.0.1' in connection_string
+
+
+def get_blob_service_client():
+    """
+    プロセス内で共有する BlobServiceClient を取得
+
+    クライアントは HTTP 接続プールを保持するため、呼び出しごとに作成せず再利用する
+
+    Returns:
+        BlobServiceClient
+    """
+    global _blob_service_client
+    if _blob_service_client is None:
+        with _client_lock:
+            if _blob_service_client is None:
+                # Storage SDK は初回使用時に読み込む（コールドスタート短縮）
+                from azure.storage.blob import BlobServiceClient
+
+                _blob_service_client = BlobServiceClient.from_connection_string(get_connection_string())
+    return _blob_service_client
+
+
+def get_queue_service_client():
+    """
+    プロセス内で共有する QueueServiceClient を取得
+
+    Returns:
+        QueueServiceClient
+    """
+    global _queue_service_client
+    if _queue_service_client is None:
+        with _client_lock:
+            if _queue_service_client is None:
+                # Queue SDK はキュー駆動パイプライン使用時のみ読み込む
+                from azure.storage.queue import QueueServiceClient
+
+                _queue_service_client = QueueServiceClient.from_connection_string(get_connection_string())
+    return _queue_service_client
+
+
+def ensure_queue(queue_name: str):
+    """
+    キューが存在しない場合は作成
+
+    Args:
+        queue_name: キュー名
+
+    Returns:
+        QueueClient
+    """
+    from azure.core.exceptions import ResourceExistsError
+
+    queue_client = get_queue_service_client().get_queue_client(queue_name)
+    if queue_name in _ensured_queues:
+        return queue_client
+    try:
+        queue_client.create_queue()
+    except ResourceExistsError:
+        pass
+    except Exception as e:
+        logging.warning(f"キュー作成チェックエラー（無視可能）: {str(e)}")
+        return queue_client
+    _ensured_queues.add(queue_name)
+    return queue_client
+
+
+def ensure_container(container_name: str):
+    """
+    コンテナが存在しない場合は作成（プライベートアクセス）
+
+    確認済みのコンテナはプロセス内で記録し、以降の確認リクエストを省略する
+
+    Args:
+        container_name: コンテナ名
+
+    Returns:
+        ContainerClient
+    """
+    container_client = get_blob_service_client().get_container_client(container_name)
+    if container_name in _ensured_containers:
+        return container_client
+    try:
+        if not container_client.exists():
+            container_client.create_container()
+            # パブリックアクセスを明示的に無効化
+            container_client.set_container_access_policy(
+                signed_identifiers={},
+                public_access=None
+            )
+        _ensured_containers.add(container_name)
+    except Exception as e:
+        logging.warning(f"コンテナ作成チェックエラー（無視可能）: {str(e)}")
+    return container_client
+
+
+def get_blob_url_with_sas(container_name: str, blob_name: str, expiry: timedelta = timedelta(hours=1),
+                          permission=None, sign_local: bool = False) -> str:
+    """
+    SAS付きのBlob URLを生成
+
+    ローカル開発環境（Azurite）では既定でSAS生成をスキップ
+
+    Args:
+        container_name: コンテナ名
+        blob_name: Blob名
+        expiry: 有効期間（既定: 1時間）
+        permission: BlobSasPermissions（既定: 読み取りのみ）
+        sign_local: Azurite でもSASを生成する（クライアントからのアップロード用）
+
+    Returns:
+        Blob URL
+    """
+    from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+    blob_service_client = get_blob_service_client()
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+    if is_local_storage() and not sign_local:
+        # Azurite用のURL（SASなし）
+        return f"{blob_client.url}"
+
+    # Azure本番環境用のSAS付きURL
+    sas_token = generate_blob_sas(
+        account_name=blob_service_client.account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=blob_service_client.credential.account_key,
+        permission=permission or BlobSasPermissions(read=True),
+        expiry=datetime.utcnow() + expiry
+    )
+    return f"{blob_client.url}?{sas_token}"
@@ -0,0 +1,1293 @@
+#!/usr/bin/env python3
+"""
+変換パイプライン機能（重複抑止・キャッシュ等）の検証テスト
+"""
+import base64
+import io
+import os
+import sys
+import threading
+import time
+import zipfile
+
+import azure.functions as func
+import xlwt
+
+import convert_http
+from benchmark_conversion import create_workbook
+from checkpoint import CheckpointPending, convert_resumable
+import negative_cache
+from conversion_utils import (
+    ENGINE_VERSION,
+    classify_failure,
+    compute_input_hash,
+    compute_output_hash,
+    conversion_key,
+    convert_xls_to_xlsx_with_stats,
+    failure_status,
+    parse_request_options,
+)
+from blob_conversion import is_output_up_to_date
+import queue_pipeline
+from queue_pipeline import OUTCOME_FAILED, build_message, handle_message, parse_message
+from single_flight import convert_coalesced, get_stats, run_single_flight
+from warmup_utils import get_warmup_xls
+from worker_pool import ConversionPool, PoolBusy, WorkerCrashed, WorkerTimeout
+
+
+def _xlsx_parts(data: bytes) -> dict:
+    """XLSX のパーツ一覧（作成日時を含む docProps/core.xml を除く）"""
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return {name: zf.read(name) for name in zf.namelist() if name != 'docProps/core.xml'}
+
+
+def test_conversion_key():
+    """変換キーのテスト"""
+    print("\n[TEST] 変換キー")
+
+    input_hash = compute_input_hash(get_warmup_xls())
+    base = conversion_key(input_hash, 'native')
+    checks = [
+        ("同じ入力・オプションは同じキー", conversion_key(input_hash, 'native') == base),
+        ("既定値のオプションは省略時と同じキー", conversion_key(input_hash, 'native', raw=False) == base),
+        ("エンジンが異なれば別キー", conversion_key(input_hash, 'pandas') != base),
+        ("オプションが異なれば別キー", conversion_key(input_hash, 'native', raw=True) != base),
+        ("入力が異なれば別キー", conversion_key(compute_input_hash(b'other'), 'native') != base),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_single_flight():
+    """同時実行の重複抑止のテスト"""
+    print("\n[TEST] 同時実行の重複抑止")
+
+    calls = []
+    results = []
+    started = threading.Event()
+
+    def slow_work():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return 'result'
+
+    def request():
+        results.append(run_single_flight('same-key', slow_work))
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    shared = sum(1 for _, coalesced in results if coalesced)
+    checks = [
+        ("処理は1回だけ実行", len(calls) == 1),
+        ("全要求が同じ結果を取得", all(result == 'result' for result, _ in results)),
+        ("後続の4要求が結果を共有", shared == 4),
+    ]
+
+    # 例外は待機中の要求にも伝播し、次の要求では再実行される
+    def failing_work():
+        time.sleep(0.1)
+        raise ValueError('boom')
+
+    errors = []
+
+    def failing_request():
+        try:
+            run_single_flight('failing-key', failing_work)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=failing_request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    checks.append(("例外を待機中の要求にも送出", errors == ['boom'] * 3))
+    checks.append(("完了後はキーを解放", run_single_flight('failing-key', lambda: 'retry') == ('retry', False)))
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_convert_coalesced():
+    """重複抑止付き変換のテスト"""
+    print("\n[TEST] 重複抑止付き変換")
+
+    xls_data = get_warmup_xls()
+    before = get_stats()
+    outputs = []
+
+    def request():
+        outputs.append(convert_coalesced(xls_data, engine='pandas'))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    after = get_stats()
+    executed = after['leaders'] - before['leaders']
+    coalesced = sum(1 for _, _, shared in outputs if shared)
+    checks = [
+        ("全要求が変換結果を取得", len(outputs) == 4 and len({data for data, _, _ in outputs}) == 1),
+        ("変換回数 + 共有回数 = 要求数", executed + coalesced == 4),
+        ("統計に共有回数を記録", after['coalesced'] - before['coalesced'] == coalesced),
+    ]
+
+    # インスタンス間で共有する結果は出力形式の拡張子で保存し、シート単位の統計も共有する
+    import single_flight
+    import storage_utils
+    container = _MemoryBlobContainer()
+    ensure_container = storage_utils.ensure_container
+    storage_utils.ensure_container = lambda name: container
+    stats = {'engine': 'native', 'format': 'csv', 'raw': False, 'trimmed_cells': 0,
+             'sheets': [{'name': '売上', 'rows': 2, 'cols': 3, 'trimmed_cells': 0}],
+             'timings': {'convert': 0.1}}
+    try:
+        missing = single_flight._load_result('shared-key', 'csv')
+        single_flight._save_result('shared-key', b'zip', stats)
+        shared = single_flight._load_result('shared-key', 'csv')
+    finally:
+        storage_utils.ensure_container = ensure_container
+    checks.extend([
+        ("未共有の結果は None", missing is None),
+        ("出力形式の拡張子で保存", 'shared-key.csv.zip' in container.blobs and 'shared-key.xlsx' not in container.blobs),
+        ("シート単位の統計を共有", shared == (b'zip', {name: value for name, value in stats.items() if name != 'timings'})),
+    ])
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed (変換 {executed} 回, 共有 {coalesced} 回)")
+    return passed == len(checks)
+
+
+def test_output_up_to_date():
+    """Blobトリガーの変換済み判定のテスト"""
+    print("\n[TEST] 変換済み出力の判定")
+
+    metadata = {
+        'source_etag': '"0x1"',
+        'source_sha256': 'abc',
+        'engine': 'native',
+        'engine_version': ENGINE_VERSION,
+    }
+    checks = [
+        ("ETag 一致でスキップ", is_output_up_to_date(metadata, 'native', source_etag='"0x1"')),
+        ("内容ハッシュ一致でスキップ（再アップロード）",
+         is_output_up_to_date(metadata, 'native', source_etag='"0x2"', input_hash='abc')),
+        ("内容が変われば再変換", not is_output_up_to_date(metadata, 'native', source_etag='"0x2"', input_hash='def')),
+        ("エンジンが変われば再変換", not is_output_up_to_date(metadata, 'pandas', source_etag='"0x1"')),
+        ("エンジンバージョンが変われば再変換",
+         not is_output_up_to_date({**metadata, 'engine_version': '0'}, 'native', source_etag='"0x1"')),
+        ("出力が無ければ変換", not is_output_up_to_date(None, 'native', input_hash='abc')),
+    ]
+
+    # アップロードSASで書き込まれた上限超過の入力は読み込まずに拒否
+    from blob_conversion import OUTCOME_REJECTED, process_input_blob
+    from security_utils import MAX_FILE_SIZE
+
+    reads = []
+    outcome = process_input_blob('xls-input/huge.xls', lambda: reads.append(1) or b'', size=MAX_FILE_SIZE + 1)
+    checks.append(("サイズ上限超過は読み込まずに拒否",
+                   outcome == (OUTCOME_REJECTED, 'limit_exceeded') and not reads))
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_negative_cache():
+    """既知の失敗入力の即時拒否のテスト"""
+    print("\n[TEST] ネガティブキャッシュ")
+
+    negative_cache.clear()
+    # OLE2 ヘッダーのみ正しい壊れたXLS（ヘッダーの検証は通過し、解析で失敗する）
+    xls_data = get_warmup_xls()
+    broken = xls_data[:512] + b'\x00' * (len(xls_data) - 512)
+
+    def post():
+        request = func.HttpRequest('POST', '/api/convert_http', headers={'X-Filename': 'broken.xls'}, body=broken)
+        return convert_http.main(request)
+
+    first = post()
+    before = negative_cache.get_stats()
+    second = post()
+    after = negative_cache.get_stats()
+
+    checks = [
+        ("初回は解析エラーで 400", first.status_code == 400 and first.headers.get('X-Failure-Class') == 'parse_error'),
+        ("初回はキャッシュ未使用", first.headers.get('X-Negative-Cache') is None),
+        ("再送は解析せずに拒否", second.status_code == 400 and second.headers.get('X-Negative-Cache') == 'hit'),
+        ("同じエラーメッセージを返す", first.get_body() == second.get_body()),
+        ("ヒット件数を記録", after['hits'] - before['hits'] == 1),
+    ]
+
+    # シート数の上限超過はシートの指定で回避できるため、変換オプションごとに記録する
+    wb = xlwt.Workbook()
+    for index in range(101):
+        wb.add_sheet(f'S{index}').write(0, 0, index)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    def post_sheets(sheets=None):
+        headers = {'X-Filename': 'many.xls', **({'X-Sheets': sheets} if sheets else {})}
+        return convert_http.main(func.HttpRequest('POST', '/api/convert_http', headers=headers,
+                                                  body=buffer.getvalue()))
+
+    whole = post_sheets()
+    selected = post_sheets('1')
+    whole_again = post_sheets()
+    checks += [
+        ("全シートの変換は上限超過で拒否", whole.status_code == 400
+         and whole.headers.get('X-Failure-Class') == 'limit_exceeded'),
+        ("シートを指定した再送は変換", selected.status_code == 200 and selected.headers.get('X-Negative-Cache') is None),
+        ("同じ指定の再送は拒否", whole_again.status_code == 400 and whole_again.headers.get('X-Negative-Cache') == 'hit'),
+    ]
+
+    # シートは必要な分だけ読み込むため、1シートの解析エラーは他のシートを指定した再送を拒否しない
+    negative_cache.record('sheet-hash', 'parse_error', 'message', {'sheets': ['2']})
+    checks.append(("解析エラーも変換オプションごとに記録",
+                   negative_cache.lookup('sheet-hash', {'sheets': ['2']}) is not None
+                   and negative_cache.lookup('sheet-hash', {'sheets': ['1']}) is None
+                   and negative_cache.lookup('sheet-hash') is None))
+
+    # 有効期間 0 の場合は記録しない
+    negative_cache.clear()
+    os.environ['NEGATIVE_CACHE_TTL_SECONDS'] = '0'
+    try:
+        negative_cache.record('hash', 'parse_error', 'message')
+        checks.append(("TTL 0 で無効化", negative_cache.lookup('hash') is None))
+    finally:
+        del os.environ['NEGATIVE_CACHE_TTL_SECONDS']
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_queue_messages():
+    """変換キューのメッセージ形式のテスト"""
+    print("\n[TEST] 変換キューのメッセージ")
+
+    event = (
+        '{"eventType": "Microsoft.Storage.BlobCreated",'
+        ' "subject": "/blobServices/default/containers/xls-input/blobs/2024/report.xls",'
+        ' "data": {"eTag": "0x8D1"}}'
+    )
+    other_container = event.replace('xls-input', 'xls-output')
+    checks = [
+        ("登録メッセージの往復", parse_message(build_message('a.xls', '"0x1"')) == ('a.xls', '"0x1"')),
+        ("Base64 エンコードされたメッセージ",
+         parse_message(base64.b64encode(build_message('b.xls').encode()).decode()) == ('b.xls', None)),
+        ("Event Grid の BlobCreated イベント", parse_message(event) == ('2024/report.xls', '0x8D1')),
+        ("Event Grid のイベント配列", parse_message(f"[{event}]") == ('2024/report.xls', '0x8D1')),
+    ]
+    for label, content in (("不正な形式を拒否", 'not json'), ("他コンテナのイベントを拒否", other_container)):
+        try:
+            parse_message(content)
+            checks.append((label, False))
+        except ValueError:
+            checks.append((label, True))
+
+    # pop receipt が無効でメッセージを削除できない場合は一時的な失敗として数える
+    class StaleReceiptQueue:
+        def delete_message(self, message_id, pop_receipt):
+            raise RuntimeError("The specified pop receipt did not match")
+
+    class Message:
+        id = 'message-1'
+        pop_receipt = 'stale'
+        dequeue_count = 1
+        content = build_message('notes.txt')
+
+    try:
+        outcome = handle_message(StaleReceiptQueue(), Message())
+    except Exception:
+        outcome = None
+    checks.append(("削除エラーは failed", outcome == OUTCOME_FAILED))
+
+    # 取り出すのは並列変換数まで。poison キューに移動できないメッセージはバッチを中断しない
+    class Queue(StaleReceiptQueue):
+        def __init__(self, messages):
+            self.messages = messages
+            self.receive_args = None
+
+        def receive_messages(self, **kwargs):
+            self.receive_args = kwargs
+            return self.messages[:kwargs['max_messages']]
+
+        def send_message(self, content):
+            raise RuntimeError("poison queue unavailable")
+
+    class PoisonMessage(Message):
+        dequeue_count = queue_pipeline.MAX_DEQUEUE_COUNT + 1
+
+    queue = Queue([PoisonMessage(), Message(), Message()])
+    ensure_queue = queue_pipeline.ensure_queue
+    queue_pipeline.ensure_queue = lambda name: queue
+    try:
+        counts = queue_pipeline.process_batch(max_workers=2)
+    except Exception:
+        counts = None
+    finally:
+        queue_pipeline.ensure_queue = ensure_queue
+    checks.extend([
+        ("並列変換数までを取り出す", queue.receive_args['max_messages'] == 2),
+        ("poison の移動エラーでもバッチを継続", counts == {OUTCOME_FAILED: 2}),
+    ])
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_worker_pool():
+    """変換ワーカープールのテスト"""
+    print("\n[TEST] 変換ワーカープール")
+
+    xls_data = get_warmup_xls()
+    expected, _ = convert_xls_to_xlsx_with_stats(xls_data, 'pandas')
+    os.environ['POOL_MAX_JOBS'] = '2'
+    pool = ConversionPool(1)
+    try:
+        outputs = [pool.convert(xls_data, 'pandas')[0] for _ in range(3)]
+        checks = [
+            ("ワーカーの変換結果が一致", all(_xlsx_parts(output) == _xlsx_parts(expected) for output in outputs)),
+            ("ジョブ数の上限で入れ替え", pool.get_stats()['recycled'] == 1),
+        ]
+
+        try:
+            pool.convert(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 1024, 'native')
+            checks.append(("変換エラーを呼び出し元で送出", False))
+        except Exception as e:
+            checks.append(("変換エラーを呼び出し元で送出", classify_failure(e) == 'parse_error'))
+
+        # 変換中にワーカーが終了した場合は WorkerCrashed を送出し、次の変換は新しいワーカーで行う
+        worker = pool._idle.get()
+        pool._idle.put(worker)
+        large_xls = create_workbook(20000, 10)
+        timer = threading.Timer(0.3, worker.kill)
+        timer.start()
+        try:
+            pool.convert(large_xls, 'native')
+            crashed = False
+        except WorkerCrashed:
+            crashed = True
+        timer.join()
+        checks.append(("ワーカーの異常終了を検出", crashed))
+        checks.append(("異常終了後も変換可能", len(pool.convert(xls_data, 'native')[0]) > 0))
+        checks.append(("死活確認", pool.check_health() == {'healthy': 1, 'replaced': 0}))
+
+        # 全ワーカーが使用中のまま待機時間を過ぎた場合は PoolBusy（再試行可能）
+        os.environ['POOL_ACQUIRE_TIMEOUT_SECONDS'] = '1'
+        worker = pool._idle.get()
+        try:
+            pool.convert(xls_data, 'native')
+            busy = False
+        except PoolBusy:
+            busy = True
+        finally:
+            pool._idle.put(worker)
+        checks.append(("空き待ちの上限で PoolBusy", busy and pool.get_stats()['busy'] == 1))
+    finally:
+        pool.shutdown()
+        del os.environ['POOL_MAX_JOBS']
+        os.environ.pop('POOL_ACQUIRE_TIMEOUT_SECONDS', None)
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_sandbox_limits():
+    """変換ワーカーのリソース上限（CPU 時間・メモリ・経過時間）のテスト"""
+    print("\n[TEST] 変換ワーカーのリソース上限")
+
+    large_xls = create_workbook(20000, 10)
+    small_xls = get_warmup_xls()
+    checks = []
+
+    def breach(settings):
+        """設定した上限で大きな入力を変換し、(失敗種別, 上限超過後も変換可能か) を返す"""
+        os.environ.update(settings)
+        pool = ConversionPool(1)
+        try:
+            try:
+                pool.convert(large_xls, 'pandas')
+                failure_class = None
+            except Exception as e:
+                failure_class = classify_failure(e)
+            recovered = len(pool.convert(small_xls, 'native')[0]) > 0
+            return failure_class, recovered
+        finally:
+            pool.shutdown()
+            for name in settings:
+                del os.environ[name]
+
+    failure_class, recovered = breach({'SANDBOX_MAX_CPU_SECONDS': '1'})
+    checks.append(("CPU 時間の上限超過は cpu_limit（422）",
+                   failure_class == 'cpu_limit' and failure_status(failure_class) == 422))
+    checks.append(("CPU 時間の上限超過後も変換可能", recovered))
+
+    failure_class, recovered = breach({'SANDBOX_MAX_MEMORY_MB': '30'})
+    checks.append(("メモリの上限超過は memory_limit（413）",
+                   failure_class == 'memory_limit' and failure_status(failure_class) == 413))
+    checks.append(("メモリの上限超過後も変換可能", recovered))
+
+    failure_class, recovered = breach({'POOL_JOB_TIMEOUT_SECONDS': '1'})
+    checks.append(("経過時間の上限超過は timeout（422）",
+                   failure_class == 'timeout' and failure_status(failure_class) == 422))
+    checks.append(("WorkerTimeout は TimeoutError", issubclass(WorkerTimeout, TimeoutError)))
+
+    # 経過時間の上限超過はインスタンスの負荷でも発生するため、入力Blobを隔離せず再試行させる
+    import blob_conversion
+    import slow_capture
+
+    class _MissingOutput:
+        def get_blob_client(self, name):
+            return self
+
+        def get_blob_properties(self):
+            raise RuntimeError("BlobNotFound")
+
+    def timed_out(*args, **kwargs):
+        raise WorkerTimeout("conversion timed out")
+
+    quarantined = []
+    saved = (blob_conversion.ensure_container, blob_conversion.convert_coalesced,
+             blob_conversion.quarantine_blob, slow_capture.capture)
+    blob_conversion.ensure_container = lambda name: _MissingOutput()
+    blob_conversion.convert_coalesced = timed_out
+    blob_conversion.quarantine_blob = lambda *args: quarantined.append(args)
+    slow_capture.capture = lambda *args, **kwargs: None
+    try:
+        blob_conversion.process_input_blob('xls-input/slow.xls', lambda: small_xls)
+        retried = False
+    except WorkerTimeout:
+        retried = True
+    finally:
+        (blob_conversion.ensure_container, blob_conversion.convert_coalesced,
+         blob_conversion.quarantine_blob, slow_capture.capture) = saved
+    checks.append(("経過時間の上限超過は隔離せず再試行", retried and not quarantined))
+
+    # 上限超過時のメッセージが案内するシート・行範囲を指定した再送は、ネガティブキャッシュで拒否しない
+    negative_cache.clear()
+    input_hash = compute_input_hash(large_xls)
+    for failure_class in ('memory_limit', 'cpu_limit'):
+        negative_cache.record(input_hash, failure_class, 'message', {})
+    checks.append(("上限超過は同じ指定の再送のみ拒否", negative_cache.lookup(input_hash, {}) is not None
+                   and negative_cache.lookup(input_hash, {'rows': (0, 1000)}) is None
+                   and negative_cache.lookup(input_hash, {'sheets': ['1']}) is None))
+    negative_cache.clear()
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+class _MemoryCheckpointStore:
+    """テスト用のメモリ上のチェックポイント保存先"""
+
+    def __init__(self):
+        self.state = None
+        self.parts = {}
+        self.sheet_writes = 0
+
+    def load_state(self):
+        return dict(self.state, sheets=list(self.state['sheets'])) if self.state else None
+
+    def save_state(self, state):
+        self.state = dict(state, sheets=list(state['sheets']))
+        return True
+
+    def save_sheet(self, position, sheet_xml, strings):
+        self.sheet_writes += 1
+        self.parts[position] = (sheet_xml, list(strings))
+
+    def load_sheet(self, position):
+        import zlib
+        return zlib.decompress(self.parts[position][0])
+
+    def load_strings(self, position):
+        return self.parts[position][1]
+
+    def discard(self):
+        self.state = None
+        self.parts.clear()
+
+
+def test_checkpoint_resume():
+    """シート単位のチェックポイントからの再開テスト"""
+    print("\n[TEST] チェックポイントからの再開")
+
+    wb = xlwt.Workbook()
+    for index in range(4):
+        ws = wb.add_sheet(f'シート{index}')
+        for row in range(30):
+            ws.write(row, 0, f'共通{row % 5}')
+            ws.write(row, 1, f'シート{index}-{row}')
+            ws.write(row, 2, row * index)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    xls_data = buffer.getvalue()
+    input_hash = compute_input_hash(xls_data)
+    expected, expected_stats = convert_xls_to_xlsx_with_stats(xls_data, 'native')
+
+    os.environ['CHECKPOINT_MIN_SHEETS'] = '2'
+    store = _MemoryCheckpointStore()
+    try:
+        # 時間予算 0: 1回の実行で1シートずつ進める
+        progress = []
+        result = None
+        while result is None and len(progress) < 10:
+            try:
+                result = convert_resumable(xls_data, input_hash, store=store, time_budget=0)
+            except CheckpointPending as e:
+                progress.append((e.completed, e.total))
+        xlsx_data, stats = result
+
+        store_single = _MemoryCheckpointStore()
+        checks = [
+            ("1シートずつ進捗", progress == [(1, 4), (2, 4), (3, 4)]),
+            ("各シートを1回だけ変換", store.sheet_writes == 4),
+            ("一括変換と同じ XLSX", _xlsx_parts(xlsx_data) == _xlsx_parts(expected)),
+            ("変換統計が一致", stats['sheets'] == expected_stats['sheets']
+             and stats['trimmed_cells'] == expected_stats['trimmed_cells']),
+            ("時間予算内なら1回で完了", convert_resumable(xls_data, input_hash, store=store_single) is not None),
+            ("シート数が下限未満は対象外",
+             convert_resumable(xls_data, input_hash, sheets=['1'], store=_MemoryCheckpointStore()) is None),
+        ]
+
+        # 変換ワーカー（サンドボックス）での実行。途中経過の通知は進捗を保ったまま親プロセスに返る
+        import pickle
+        pending = pickle.loads(pickle.dumps(CheckpointPending(2, 4)))
+        pool = ConversionPool(1)
+        try:
+            pool_result = pool.convert_resumable(xls_data, input_hash, sheets=['1'])
+        finally:
+            pool.shutdown()
+        checks.extend([
+            ("CheckpointPending を pickle で受け渡し", (pending.completed, pending.total) == (2, 4)),
+            ("ワーカーでの実行（対象外は None）", pool_result is None),
+        ])
+    finally:
+        del os.environ['CHECKPOINT_MIN_SHEETS']
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_metrics():
+    """プロセス内メトリクスと Prometheus 形式の出力のテスト"""
+    print("\n[TEST] メトリクス")
+
+    import metrics_registry
+
+    counter = metrics_registry.Counter('test_events_total', 'テスト用', ('kind',))
+    histogram = metrics_registry.Histogram('test_seconds', 'テスト用', buckets=(0.1, 1))
+
+    def record():
+        for index in range(1000):
+            counter.inc(kind='a')
+            histogram.observe(0.05 if index % 2 else 0.5)
+
+    # 終了したスレッドのシャードも集計に残る
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(2, kind='b')
+    counter_text = '\n'.join(counter.render())
+    histogram_text = '\n'.join(histogram.render())
+
+    metrics_registry.clear()
+    request = func.HttpRequest('POST', '/api/convert_http', headers={'X-Filename': 'metrics.xls'},
+                               body=get_warmup_xls())
+    response = convert_http.main(request)
+    text = metrics_registry.render()
+
+    import metrics as metrics_function
+    endpoint = metrics_function.main(func.HttpRequest('GET', '/api/metrics', body=b''))
+
+    checks = [
+        ("スレッドごとの記録を合算", 'xls2xlsx_test_events_total{kind="a"} 4000' in counter_text
+         and 'xls2xlsx_test_events_total{kind="b"} 2' in counter_text),
+        ("ヒストグラムは累積バケット",
+         'xls2xlsx_test_seconds_bucket{le="0.1"} 2000' in histogram_text
+         and 'xls2xlsx_test_seconds_bucket{le="1"} 4000' in histogram_text
+         and 'xls2xlsx_test_seconds_count 4000' in histogram_text),
+        ("変換件数を記録", response.status_code == 200
+         and 'xls2xlsx_conversions_total{source="http",outcome="success"' in text),
+        ("段階ごとの所要時間を記録", all(f'xls2xlsx_stage_seconds_count{{stage="{stage}"}} 1' in text
+                                          for stage in ('ingest', 'convert', 'request'))),
+        ("キャッシュの参照を記録", 'xls2xlsx_cache_lookups_total{cache="negative",result="miss"} 1' in text),
+        ("metrics 関数は Prometheus 形式", endpoint.status_code == 200
+         and endpoint.headers.get('Content-Type', '').startswith('text/plain; version=0.0.4')),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_tracing():
+    """トレーシングのスパンとトレースコンテキストの引き継ぎのテスト"""
+    print("\n[TEST] トレーシング")
+
+    import json
+    import tempfile
+    import tracing
+    from queue_pipeline import parse_trace_context
+
+    disabled = [
+        ("無効時はスパンを作成しない", not tracing.is_enabled() and tracing.inject() == {}),
+    ]
+    try:
+        import opentelemetry.sdk  # noqa: F401
+    except ImportError:
+        print("  ⚠️ opentelemetry-sdk が無いためスパンの検証を省略")
+        checks = disabled
+    else:
+        traceparent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+        wb = xlwt.Workbook()
+        for index in range(3):
+            ws = wb.add_sheet(f'シート{index}')
+            for row in range(20):
+                ws.write(row, 0, f'シート{index}-{row}')
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        temp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(temp_dir.name, 'traces.jsonl')
+        os.environ.update(OTEL_TRACES_EXPORTER='file', OTEL_TRACES_FILE=path, CONVERSION_ENGINE='native')
+        tracing.shutdown()
+        try:
+            request = func.HttpRequest('POST', '/api/convert_http',
+                                       headers={'X-Filename': 'trace.xls', 'traceparent': traceparent},
+                                       body=buffer.getvalue())
+            response = convert_http.main(request)
+            with tracing.start_span('enqueue'):
+                message = build_message('a.xls')
+            tracing.flush()
+            with open(path, encoding='utf-8') as f:
+                spans = {span['name']: span for span in map(json.loads, f)}
+        finally:
+            for name in ('OTEL_TRACES_EXPORTER', 'OTEL_TRACES_FILE', 'CONVERSION_ENGINE'):
+                os.environ.pop(name, None)
+            tracing.shutdown()
+            temp_dir.cleanup()
+
+        root = spans.get('convert_http', {})
+        trace_ids = {span['context']['trace_id'] for span in spans.values() if span['name'] != 'enqueue'}
+        checks = disabled + [
+            ("段階ごとのスパン", response.status_code == 200
+             and {'convert_http', 'ingest', 'convert', 'parse', 'write'} <= set(spans)),
+            ("traceparent ヘッダーのトレースを継続", trace_ids == {'0x0af7651916cd43dd8448eb211c80319c'}
+             and root.get('parent_id') == '0xb7ad6b7169203331'),
+            ("ファイルサイズ・シート数・エンジン・キャッシュの属性",
+             root.get('attributes', {}).get('xls2xlsx.sheet_count') == 3
+             and root['attributes'].get('xls2xlsx.engine') == 'native'
+             and root['attributes'].get('xls2xlsx.input.size') == len(request.get_body())
+             and root['attributes'].get('xls2xlsx.cache.negative') == 'miss'),
+            ("キューメッセージにトレースコンテキスト",
+             parse_trace_context(message).get('traceparent', '').split('-')[1]
+             == spans['enqueue']['context']['trace_id'][2:]
+             and parse_message(message) == ('a.xls', None)),
+        ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_profiling():
+    """要求単位のプロファイリングのテスト"""
+    print("\n[TEST] 要求単位のプロファイリング")
+
+    import json
+    import profiling
+    import storage_utils
+    import worker_pool
+
+    xls_data = create_workbook(3000, 10)
+    input_hash = compute_input_hash(xls_data)
+
+    os.environ['PROFILING_TOKEN'] = 'secret-token'
+    try:
+        requested = [
+            ("未設定ではプロファイルしない", not profiling.is_requested('a' * 64, {})),
+            ("トークンが一致するヘッダー", profiling.is_requested('a' * 64, {'X-Profile': 'secret-token'})),
+            ("トークンが一致しないヘッダーは無視", not profiling.is_requested('a' * 64, {'X-Profile': 'guess'})),
+        ]
+        os.environ['PROFILE_INPUT_HASHES'] = f"{'b' * 64}, {input_hash}"
+        requested.append(("PROFILE_INPUT_HASHES の入力", profiling.is_requested(input_hash)))
+    finally:
+        os.environ.pop('PROFILING_TOKEN', None)
+        os.environ.pop('PROFILE_INPUT_HASHES', None)
+
+    _, stats = worker_pool.convert(xls_data, 'native', profile=True)
+    pool = ConversionPool(1)
+    try:
+        _, pool_stats = pool.convert(xls_data, 'native', profile=True)
+    finally:
+        pool.shutdown()
+
+    # 診断用コンテナへの保存（Storage の代わりにメモリ上のコンテナを使用）
+    class _Container:
+        def __init__(self):
+            self.blobs = {}
+
+        def upload_blob(self, name, data, overwrite=False, metadata=None):
+            self.blobs[name] = data
+
+    container = _Container()
+    ensure_container = storage_utils.ensure_container
+    storage_utils.ensure_container = lambda name: container
+    try:
+        _, saved_stats = profiling.convert_profiled(xls_data, input_hash, 'http', 'native')
+    finally:
+        storage_utils.ensure_container = ensure_container
+    saved = saved_stats.get('profile_blob') or ''
+    summary = json.loads(container.blobs.get(saved.replace('.folded', '.json'), b'{}'))
+
+    folded = stats.get('profile', '')
+    checks = requested + [
+        ("collapsed stacks 形式のプロファイル", stats.get('profile_samples', 0) > 0
+         and all(line.rsplit(' ', 1)[1].isdigit() for line in folded.splitlines())
+         and 'convert_xls_to_xlsx_with_stats (conversion_utils.py' in folded),
+        ("ワーカープロセスでのプロファイル", 'convert_xls_to_xlsx_with_stats' in pool_stats.get('profile', '')),
+        ("プロファイルと所要時間を保存", saved.startswith('profiles/') and saved in container.blobs
+         and summary.get('input_sha256') == input_hash and 'parse' in summary.get('timings', {})
+         and 'profile' not in saved_stats),
+        ("無効時はプロファイラを起動しない", 'profile' not in worker_pool.convert(xls_data, 'native')[1]),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_slow_capture():
+    """遅い変換の記録のテスト"""
+    print("\n[TEST] 遅い変換の記録")
+
+    import json
+    import slow_capture
+    import storage_utils
+
+    xls_data = create_workbook(3000, 10)
+    input_hash = compute_input_hash(xls_data)
+    megabyte = 1024 * 1024
+
+    os.environ['SLOW_CONVERSION_MIN_SECONDS'] = '1'
+    try:
+        reasons = [
+            ("閾値未満は記録しない", slow_capture.slow_reasons(megabyte, {'timings': {'convert': 0.5}}) == []),
+            ("1MB あたりの変換時間の超過", slow_capture.slow_reasons(
+                megabyte, {'timings': {'convert': 6.0}}) == [slow_capture.REASON_LATENCY]),
+            ("入力サイズに対するメモリ使用量の超過", slow_capture.slow_reasons(
+                megabyte, {'timings': {'convert': 0.5}, 'peak_memory': 512 * megabyte}) == [slow_capture.REASON_MEMORY]),
+        ]
+        os.environ['SLOW_CONVERSION_SECONDS_PER_MB'] = '0'
+        reasons.append(("0 で判定を無効化", slow_capture.slow_reasons(
+            megabyte, {'timings': {'convert': 60.0}}) == []))
+    finally:
+        os.environ.pop('SLOW_CONVERSION_MIN_SECONDS', None)
+        os.environ.pop('SLOW_CONVERSION_SECONDS_PER_MB', None)
+
+    workbook = slow_capture.scan_workbook(xls_data)
+    pool = ConversionPool(1)
+    try:
+        _, pool_stats = pool.convert(xls_data, 'native')
+    finally:
+        pool.shutdown()
+
+    # 診断用コンテナへの記録（Storage の代わりにメモリ上のコンテナを使用）
+    class _Container:
+        def __init__(self):
+            self.blobs = {}
+
+        def upload_blob(self, name, data, overwrite=False, metadata=None):
+            self.blobs[name] = data
+
+    containers = {}
+    ensure_container = storage_utils.ensure_container
+    storage_utils.ensure_container = lambda name: containers.setdefault(name, _Container())
+    os.environ['SLOW_CAPTURE_COPY_INPUT'] = 'true'
+    try:
+        stats = dict(pool_stats, timings={'convert': 60.0})
+        captured = slow_capture.capture_if_slow(xls_data, input_hash, 'http', stats, {'sheets': ['Sheet1']})
+        duplicate = slow_capture.capture(xls_data, input_hash, 'http', captured, 'native', stats)
+        slow_capture.wait_pending()
+
+        # 保存に失敗した入力は記録済みにせず、次の要求で記録し直す
+        retry_hash = compute_input_hash(b'slow-capture-retry')
+        storage_utils.ensure_container = lambda name: None
+        failed = slow_capture.capture(xls_data, retry_hash, 'blob', ['timeout'], 'native')
+        slow_capture.wait_pending()
+        storage_utils.ensure_container = lambda name: containers.setdefault(name, _Container())
+        retried = slow_capture.capture(xls_data, retry_hash, 'blob', ['timeout'], 'native')
+        slow_capture.wait_pending()
+    finally:
+        storage_utils.ensure_container = ensure_container
+        os.environ.pop('SLOW_CAPTURE_COPY_INPUT', None)
+    diagnostics = containers.get(storage_utils.DIAGNOSTICS_CONTAINER, _Container()).blobs
+    quarantine = containers.get(storage_utils.PERF_QUARANTINE_CONTAINER, _Container()).blobs
+    record = json.loads(diagnostics.get(f"slow/{input_hash}.json", b'{}'))
+
+    checks = reasons + [
+        ("BIFF レコードの走査", workbook.get('sheets') == 1 and workbook.get('rows') == 3001
+         and workbook.get('number_cells', 0) + workbook.get('text_cells', 0) == 30010),
+        ("ワーカープロセスのメモリ使用量", isinstance(pool_stats.get('peak_memory'), int)),
+        ("記録と入力のコピー", captured == [slow_capture.REASON_LATENCY]
+         and record.get('workbook', {}).get('rows') == 3001 and record.get('options') == {'sheets': ['Sheet1']}
+         and quarantine.get(f"{input_hash}.xls") == xls_data),
+        ("同じ入力は1回だけ記録", duplicate is False),
+        ("保存に失敗した入力は再記録", failed is True and retried is True
+         and f"slow/{retry_hash}.json" in diagnostics),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_deterministic_output():
+    """決定的な出力と ETag のテスト"""
+    print("\n[TEST] 決定的な出力と ETag")
+
+    import openpyxl
+    import xlsx_writer
+
+    xls_data = create_workbook(200, 6)
+    fixed = xlsx_writer.FIXED_TIMESTAMP.timetuple()[:6]
+
+    def zip_times(data):
+        return {info.date_time for info in zipfile.ZipFile(io.BytesIO(data)).infolist()}
+
+    outputs = {}
+    for engine, output_format in (('pandas', 'xlsx'), ('native', 'xlsx'), ('native', 'csv')):
+        first, _ = convert_xls_to_xlsx_with_stats(xls_data, engine, output_format=output_format)
+        second, _ = convert_xls_to_xlsx_with_stats(xls_data, engine, output_format=output_format)
+        outputs[(engine, output_format)] = (first, second)
+
+    pandas_output = outputs[('pandas', 'xlsx')][0]
+    names = zipfile.ZipFile(io.BytesIO(pandas_output)).namelist()
+    properties = openpyxl.load_workbook(io.BytesIO(pandas_output)).properties
+
+    os.environ['DETERMINISTIC_OUTPUT'] = 'false'
+    try:
+        current, _ = convert_xls_to_xlsx_with_stats(xls_data, 'native')
+    finally:
+        os.environ.pop('DETERMINISTIC_OUTPUT', None)
+
+    def post():
+        request = func.HttpRequest('POST', '/api/convert_http', headers={'X-Filename': 'etag.xls'}, body=xls_data)
+        return convert_http.main(request)
+
+    first_response, second_response = post(), post()
+    etag = first_response.headers.get('ETag', '')
+
+    checks = [
+        ("同じ入力から同じバイト列", all(first == second for first, second in outputs.values())),
+        ("ZIP エントリの日時を固定", all(zip_times(first) == {fixed} for first, _ in outputs.values())),
+        ("openpyxl のパーツ順序と作成・更新日時を固定", names[0] == '[Content_Types].xml'
+         and names[1:] == sorted(names[1:]) and properties.created == properties.modified == xlsx_writer.FIXED_TIMESTAMP),
+        ("DETERMINISTIC_OUTPUT=false では現在の日時", zip_times(current) != {fixed}),
+        ("ETag は出力の SHA-256", etag == f'"{compute_output_hash(first_response.get_body())}"'
+         and second_response.headers.get('ETag') == etag),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+class _MemoryBlobProperties:
+    def __init__(self, blob):
+        self.size = len(blob['data'])
+        self.content_settings = blob['content_settings']
+        self.metadata = blob['metadata']
+
+
+class _MemoryDownloader:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+
+class _MemoryBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+        self.url = f"http://127.0.0.1:10000/devstoreaccount1/xls-content/{name}"
+
+    def get_blob_properties(self):
+        from azure.core.exceptions import ResourceNotFoundError
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError('not found')
+        return _MemoryBlobProperties(self.container.blobs[self.name])
+
+    def download_blob(self, offset=0, length=None, max_concurrency=1):
+        from azure.core.exceptions import ResourceNotFoundError
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError('not found')
+        self.container.downloads.append((offset, length))
+        data = self.container.blobs[self.name]['data']
+        return _MemoryDownloader(data[offset:offset + length if length is not None else None])
+
+
+class _MemoryBlobContainer:
+    """テスト用のメモリ上の Blob コンテナ（結果取得API・事前確認API）"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.downloads = []
+
+    def upload_blob(self, name, data, overwrite=False, content_settings=None, metadata=None, **kwargs):
+        from azure.core.exceptions import ResourceExistsError
+        if name in self.blobs and not overwrite:
+            raise ResourceExistsError('exists')
+        self.blobs[name] = {'data': data, 'content_settings': content_settings, 'metadata': metadata}
+
+    def get_blob_client(self, name):
+        return _MemoryBlobClient(self, name)
+
+
+def test_result_endpoint():
+    """結果取得APIのテスト"""
+    print("\n[TEST] 結果取得API")
+
+    import result_store
+    import results as results_function
+    import storage_utils
+
+    xlsx_data, _ = convert_xls_to_xlsx_with_stats(create_workbook(300, 6), 'native')
+    content_hash = compute_output_hash(xlsx_data)
+    etag = f'"{content_hash}"'
+    size = len(xlsx_data)
+
+    def get(headers=None, content_hash=content_hash, method='GET'):
+        request = func.HttpRequest(method, f'/api/results/{content_hash}', headers=headers or {},
+                                   route_params={'content_hash': content_hash}, body=b'')
+        return results_function.main(request)
+
+    # Storage の代わりにメモリ上のコンテナを使用
+    container = _MemoryBlobContainer()
+    ensure_container = storage_utils.ensure_container
+    storage_utils.ensure_container = lambda name: container
+    try:
+        saved = result_store.save(xlsx_data, 'report.xlsx', 'application/zip', input_hash='a' * 64)
+        full = get()
+        partial = get({'Range': 'bytes=100-199'})
+        suffix = get({'Range': 'bytes=-50'})
+        not_modified = get({'If-None-Match': f'W/"{"0" * 64}", {etag}'})
+        stale_range = get({'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        unsatisfiable = get({'Range': f'bytes={size}-'})
+        head = get(method='HEAD')
+        missing = get(content_hash='f' * 64)
+        invalid = get(content_hash='not-a-hash')
+        os.environ['RESULT_MAX_RESPONSE_MB'] = '0.0001'
+        try:
+            redirected = get({'Range': 'bytes=0-'})
+        finally:
+            os.environ.pop('RESULT_MAX_RESPONSE_MB', None)
+    finally:
+        storage_utils.ensure_container = ensure_container
+
+    os.environ['STORE_HTTP_RESULTS'] = 'false'
+    try:
+        unstored = convert_http.main(func.HttpRequest('POST', '/api/convert_http', body=get_warmup_xls()))
+    finally:
+        os.environ.pop('STORE_HTTP_RESULTS', None)
+    stored = convert_http.main(func.HttpRequest('POST', '/api/convert_http', body=get_warmup_xls()))
+
+    checks = [
+        ("内容の SHA-256 で保存", saved == content_hash and content_hash in container.blobs),
+        ("全体を返す", full.status_code == 200 and full.get_body() == xlsx_data and full.headers.get('ETag') == etag
+         and full.headers.get('Content-Disposition') == 'attachment; filename="report.xlsx"'),
+        ("Range は要求範囲のみ読み込んで 206", partial.status_code == 206
+         and partial.get_body() == xlsx_data[100:200]
+         and partial.headers.get('Content-Range') == f'bytes 100-199/{size}' and (100, 100) in container.downloads),
+        ("末尾からの範囲", suffix.status_code == 206 and suffix.get_body() == xlsx_data[-50:]),
+        ("If-None-Match が一致すれば 304", not_modified.status_code == 304 and not not_modified.get_body()),
+        ("If-Range が一致しなければ全体", stale_range.status_code == 200 and stale_range.get_body() == xlsx_data),
+        ("範囲外は 416", unsatisfiable.status_code == 416
+         and unsatisfiable.headers.get('Content-Range') == f'bytes */{size}'),
+        ("HEAD は本文なし", head.status_code == 200 and not head.get_body()),
+        ("未保存は 404・不正なハッシュは 400", missing.status_code == 404 and invalid.status_code == 400),
+        ("大きな応答は SAS URL にリダイレクト", redirected.status_code == 307
+         and redirected.headers.get('Location', '').endswith(content_hash)),
+        ("convert_http は Content-Location を返す",
+         stored.headers.get('Content-Location') == result_store.result_path(compute_output_hash(stored.get_body()))
+         and 'Content-Location' not in unstored.headers),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_probe():
+    """事前確認APIとクライアントのテスト"""
+    print("\n[TEST] 事前確認API")
+
+    import json
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl, urlsplit
+    import probe as probe_function
+    import result_store
+    import storage_utils
+    import xls2xlsx_client
+
+    class _Handler(BaseHTTPRequestHandler):
+        """probe / convert_http を呼び出すローカルの HTTP サーバー"""
+
+        def do_POST(self):
+            parts = urlsplit(self.path)
+            function = probe_function if parts.path == xls2xlsx_client.PROBE_PATH else convert_http
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            response = function.main(func.HttpRequest('POST', parts.path, headers=dict(self.headers),
+                                                      params=dict(parse_qsl(parts.query)), body=body))
+            requests.append(parts.path)
+            self.send_response(response.status_code)
+            for name, value in response.headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(response.get_body())
+
+        def log_message(self, *args):
+            pass
+
+    def probe(input_hash, headers=None, params=None, body=b''):
+        request = func.HttpRequest('POST', '/api/probe', headers=headers or {},
+                                   params=dict(params or {}, **({'sha256': input_hash} if input_hash else {})),
+                                   body=body)
+        return probe_function.main(request)
+
+    temp_dir = tempfile.TemporaryDirectory()
+    work_dir = temp_dir.name
+    xls_path = os.path.join(work_dir, 'probe.xls')
+    with open(xls_path, 'wb') as f:
+        f.write(create_workbook(137, 4))
+    empty_path = os.path.join(work_dir, 'empty.xls')
+    open(empty_path, 'wb').close()
+    with open(xls_path, 'rb') as f:
+        input_hash = compute_input_hash(f.read())
+
+    # 変換結果の保存はバックグラウンドではなく応答前に行う（他のテストの保存待ちと独立させる）
+    def save_now(data, filename, content_type, content_hash, input_hash=None, conversion_key=None):
+        result_store.save(data, filename, content_type, content_hash, input_hash, conversion_key=conversion_key)
+        return True
+
+    containers = {}
+    requests = []
+    ensure_container, save_async = storage_utils.ensure_container, result_store.save_async
+    storage_utils.ensure_container = lambda name: containers.setdefault(name, _MemoryBlobContainer())
+    result_store.save_async = save_now
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        miss = probe(input_hash)
+        uploaded = xls2xlsx_client.convert_file(xls_path, base_url, os.path.join(work_dir, 'first.xlsx'))
+        probed = xls2xlsx_client.convert_file(xls_path, base_url, os.path.join(work_dir, 'second.xlsx'))
+        # ASCII 以外のファイル名（X-Filename はパーセントエンコードして送る）
+        japanese_path = os.path.join(work_dir, '売上.xls')
+        with open(xls_path, 'rb') as source, open(japanese_path, 'wb') as f:
+            f.write(source.read())
+        japanese = xls2xlsx_client.convert_file(japanese_path, base_url)
+        japanese_hit = probe(input_hash, {'X-Filename': '%E5%A3%B2%E4%B8%8A.xls'})
+        content_hash = uploaded['content_sha256']
+        hit = probe(input_hash, {'X-Filename': 'report.xls'})
+        by_body = probe(None, body=json.dumps({'sha256': input_hash.upper()}).encode())
+        other_options = probe(input_hash, params={'rows': '1-10'})
+        not_modified = probe(input_hash, {'If-None-Match': f'"{content_hash}"'})
+        size_threshold = probe_function.SIZE_THRESHOLD
+        probe_function.SIZE_THRESHOLD = 0
+        try:
+            large = probe(input_hash)
+        finally:
+            probe_function.SIZE_THRESHOLD = size_threshold
+        invalid = probe('not-a-hash')
+        bad_hash = compute_input_hash(b'probe-known-bad')
+        negative_cache.record(bad_hash, 'parse_error', 'XLSファイルの解析に失敗しました。')
+        known_bad = probe(bad_hash)
+        with open(uploaded['output_path'], 'rb') as f:
+            first_output = f.read()
+        with open(probed['output_path'], 'rb') as f:
+            second_output = f.read()
+        hashes_match = xls2xlsx_client.hash_file(xls_path) == input_hash \
+            and xls2xlsx_client.hash_file(empty_path) == compute_input_hash(b'')
+    finally:
+        server.shutdown()
+        server.server_close()
+        storage_utils.ensure_container, result_store.save_async = ensure_container, save_async
+        temp_dir.cleanup()
+
+    large_body = json.loads(large.get_body()) if large.status_code == 200 else {}
+
+    checks = [
+        ("mmap のハッシュは入力ハッシュと同じ", hashes_match),
+        ("クライアントの変換オプションはサーバーと同じ書式", parse_request_options(
+            {}, xls2xlsx_client.build_query(sheets='Sales,3', rows='1-1000', output_format='csv'))
+         == {'sheets': ['Sales', '3'], 'rows': (0, 1000), 'output_format': 'csv'}),
+        ("未変換は upload_required", miss.status_code == 200 and miss.headers.get('X-Probe') == 'miss'
+         and json.loads(miss.get_body()).get('status') == 'upload_required'),
+        ("クライアントは未変換の場合のみアップロード", uploaded['probe'] == 'miss' and probed['probe'] == 'hit'
+         and requests.count('/api/convert_http') == 1 and first_output == second_output
+         and compute_output_hash(first_output) == content_hash),
+        ("変換済みは直接返す", hit.status_code == 200 and hit.get_body() == first_output
+         and hit.headers.get('ETag') == f'"{content_hash}"'
+         and hit.headers.get('Content-Disposition') == 'attachment; filename="report.xlsx"'
+         and hit.headers.get('Content-Location') == result_store.result_path(content_hash)),
+        ("ASCII 以外のファイル名", japanese['probe'] == 'hit'
+         and japanese['output_path'] == os.path.join(work_dir, '売上.xlsx')
+         and japanese_hit.headers.get('Content-Disposition')
+         == "attachment; filename=\"__.xlsx\"; filename*=UTF-8''%E5%A3%B2%E4%B8%8A.xlsx"),
+        ("JSON ボディのハッシュ", by_body.status_code == 200 and by_body.headers.get('X-Probe') == 'hit'),
+        ("変換オプションが異なれば未変換", other_options.headers.get('X-Probe') == 'miss'),
+        ("If-None-Match が一致すれば 304", not_modified.status_code == 304 and not not_modified.get_body()),
+        ("大きな結果はダウンロードURL", large_body.get('status') == 'hit'
+         and content_hash in large_body.get('download_url', '')
+         and large_body.get('result_url') == result_store.result_path(content_hash)),
+        ("不正なハッシュは 400・既知の失敗入力は拒否", invalid.status_code == 400
+         and known_bad.status_code == 400 and known_bad.headers.get('X-Negative-Cache') == 'hit'),
+    ]
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def main():
+    """メインテスト実行"""
+    print("=" * 70)
+    print("変換パイプライン機能検証テスト")
+    print("=" * 70)
+
+    tests = [
+        ("変換キー", test_conversion_key),
+        ("同時実行の重複抑止", test_single_flight),
+        ("重複抑止付き変換", test_convert_coalesced),
+        ("変換済み出力の判定", test_output_up_to_date),
+        ("ネガティブキャッシュ", test_negative_cache),
+        ("変換キューのメッセージ", test_queue_messages),
+        ("変換ワーカープール", test_worker_pool),
+        ("チェックポイントからの再開", test_checkpoint_resume),
+        ("変換ワーカーのリソース上限", test_sandbox_limits),
+        ("メトリクス", test_metrics),
+        ("トレーシング", test_tracing),
+        ("要求単位のプロファイリング", test_profiling),
+        ("遅い変換の記録", test_slow_capture),
+        ("決定的な出力と ETag", test_deterministic_output),
+        ("結果取得API", test_result_endpoint),
+        ("事前確認API", test_probe),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            passed = test_func()
+            results.append((test_name, passed))
+        except Exception as e:
+            print(f"\n  ❌ テスト実行エラー: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    print("テスト結果サマリー")
+    print("=" * 70)
+
+    passed_count = sum(1 for _, passed in results if passed)
+    total_count = len(results)
+
+    for test_name, passed in results:
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"{status}: {test_name}")
+
+    print("=" * 70)
+    print(f"総合結果: {passed_count}/{total_count} テスト成功 ({passed_count/total_count*100:.0f}%)")
+    print("=" * 70)
+
+    return 0 if passed_count == total_count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
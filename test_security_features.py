@@ -5,6 +5,7 @@
 import sys
 import os
 from security_utils import (
+    MAX_FILE_SIZE,
     sanitize_filename,
     validate_file_size,
     validate_xls_format,
@@ -193,6 +194,151 @@ def test_complete_input_validation():
     print(f"  結果: {passed}/{len(test_cases)} passed")
     return passed == len(test_cases)
 
+def test_streaming_ingest():
+    """受信しながらの入力検証・ハッシュ計算のテスト"""
+    print("\n[TEST] ボディ取り込み（Content-Length・OLE2ヘッダー・SHA-256）")
+
+    import hashlib
+    from input_ingest import IngestError, InputIngestor, check_content_length, ingest_request
+    from warmup_utils import get_warmup_xls
+
+    xls_data = get_warmup_xls()
+
+    def rejection(feed_chunks, max_size=MAX_FILE_SIZE):
+        """チャンクを順に渡し、拒否された場合は (ステータス, 読まれたチャンク数) を返す"""
+        ingestor = InputIngestor(max_size)
+        consumed = 0
+        try:
+            for chunk in feed_chunks:
+                consumed += 1
+                ingestor.feed(chunk)
+            ingestor.finish()
+        except IngestError as e:
+            return e.status_code, consumed
+        finally:
+            ingestor.close()
+        return None, consumed
+
+    def chunks_of(data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    class _Request:
+        def __init__(self, body, headers):
+            self.headers = headers
+            self._body = body
+
+        def get_body(self):
+            return self._body
+
+    def content_length_rejected():
+        try:
+            check_content_length(str(MAX_FILE_SIZE + 1))
+        except IngestError as e:
+            return e.status_code == 413
+        return False
+
+    def spooled_result():
+        ingestor = InputIngestor()
+        for chunk in chunks_of(xls_data, 100):
+            ingestor.feed(chunk)
+        return ingestor.finish()
+
+    data, digest = spooled_result()
+    broken_header = bytearray(xls_data)
+    broken_header[0x1C:0x1E] = b'\xff\xfe'  # バイトオーダーを反転
+    not_xls = b'PK\x03\x04' + b'\x00' * 4 + b'\x00' * 4096
+
+    checks = [
+        ("Content-Length の上限超過はボディを読まずに 413", content_length_rejected()),
+        ("分割して受信した入力とハッシュが一致",
+         data == xls_data and digest == hashlib.sha256(xls_data).hexdigest()),
+        ("XLS 以外は最初のチャンクで拒否（以降を読まない）",
+         rejection(chunks_of(not_xls, 8)) == (400, 1)),
+        ("不正な OLE2 ヘッダーは 512 バイト受信時点で拒否",
+         rejection(chunks_of(bytes(broken_header), 256)) == (400, 2)),
+        ("受信中の上限超過は 413",
+         rejection(chunks_of(xls_data, 1024), max_size=2048)[0] == 413),
+        ("空のボディは 400",
+         _ingest_status(lambda: ingest_request(_Request(b'', {}))) == 400),
+        ("受信済みのボディはコピーせずに返す",
+         ingest_request(_Request(xls_data, {'Content-Length': str(len(xls_data))}))[0] is xls_data),
+    ]
+
+    passed = 0
+    for description, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {description}")
+        passed += bool(ok)
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def test_compressed_body():
+    """圧縮されたリクエストボディ（Content-Encoding）のテスト"""
+    print("\n[TEST] 圧縮ボディの展開（gzip / zstd）")
+
+    import gzip
+    import hashlib
+    from input_ingest import ingest_request
+    from warmup_utils import get_warmup_xls
+
+    xls_data = get_warmup_xls()
+    expected = (xls_data, hashlib.sha256(xls_data).hexdigest())
+
+    class _Request:
+        def __init__(self, body, encoding):
+            self.headers = {'Content-Encoding': encoding}
+            self._body = body
+
+        def get_body(self):
+            return self._body
+
+    def ingest(body, encoding, **kwargs):
+        return ingest_request(_Request(body, encoding), **kwargs)
+
+    def zstd_result():
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return expected  # pyarrow 未インストールの環境では確認しない
+        return ingest(pa.compress(xls_data, 'zstd', asbytes=True), 'zstd')
+
+    compressed = gzip.compress(xls_data)
+    # 先頭が正しいXLSで、以降が同じ値の繰り返し（圧縮率が極端に高い）
+    bomb = gzip.compress(xls_data + b'\x00' * (60 * 1024 * 1024), 1)
+
+    checks = [
+        ("gzip を展開し、展開後のデータのハッシュを返す", ingest(compressed, 'gzip') == expected),
+        ("連結された gzip メンバーを展開",
+         ingest(gzip.compress(xls_data[:3000]) + gzip.compress(xls_data[3000:]), 'x-gzip') == expected),
+        ("zstd を展開", zstd_result() == expected),
+        ("圧縮率の高い入力は展開途中で 413",
+         _ingest_status(lambda: ingest(bomb, 'gzip')) == 413),
+        ("展開後のサイズに上限を適用",
+         _ingest_status(lambda: ingest(compressed, 'gzip', max_size=4096)) == 413),
+        ("途中で切れた gzip は 400", _ingest_status(lambda: ingest(compressed[:-20], 'gzip')) == 400),
+        ("対応していないエンコーディングは 415", _ingest_status(lambda: ingest(compressed, 'br')) == 415),
+    ]
+
+    passed = 0
+    for description, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {description}")
+        passed += bool(ok)
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def _ingest_status(ingest):
+    """取り込みを拒否した場合のステータスコード"""
+    from input_ingest import IngestError
+
+    try:
+        ingest()
+    except IngestError as e:
+        return e.status_code
+    return None
+
 
 def main():
     """メインテスト実行"""
@@ -207,6 +353,8 @@ def main():
         ("セキュリティヘッダー", test_security_headers),
         ("エラーメッセージサニタイズ", test_error_message_sanitization),
         ("総合入力検証", test_complete_input_validation),
+        ("ボディ取り込み", test_streaming_ingest),
+        ("圧縮ボディの展開", test_compressed_body),
     ]
     
     results = []
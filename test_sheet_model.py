@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+スパース中間表現とネイティブ変換エンジンの検証テスト
+"""
+import io
+import sys
+import zipfile
+from datetime import datetime
+
+import openpyxl
+import xlwt
+
+from sheet_model import (
+    KIND_BOOL,
+    KIND_NUMBER,
+    KIND_TEXT,
+    ColumnChunk,
+    SharedStrings,
+    SheetSelectionError,
+    SparseSheet,
+    load_sparse_workbook,
+)
+from columnar_writer import NotAcceptable
+from conversion_utils import (
+    convert_xls_to_xlsx,
+    convert_xls_to_xlsx_with_stats,
+    parse_blob_options,
+    parse_request_options,
+    parse_row_range,
+    parse_schema_hint,
+)
+
+
+def make_sparse_xls() -> bytes:
+    """疎なテスト用XLSを作成"""
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('疎なシート')
+    ws.write(0, 0, '名前')
+    ws.write(0, 1, '値')
+    ws.write(1, 0, 'りんご')
+    ws.write(1, 1, 150)
+    ws.write(2, 2, True)
+    ws.write(3, 3, datetime(2024, 1, 2, 3, 4), xlwt.easyxf(num_format_str='yyyy-mm-dd hh:mm'))
+    ws.write(60000, 250, 'りんご')
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_column_chunk():
+    """列チャンクの型別バッファのテスト"""
+    print("\n[TEST] 列チャンク")
+
+    chunk = ColumnChunk()
+    chunk.append(0, KIND_NUMBER, 1.5)
+    chunk.append(3, KIND_TEXT, 7)
+    chunk.append(9, KIND_BOOL, True)
+
+    expected = [(0, KIND_NUMBER, 1.5), (3, KIND_TEXT, 7), (9, KIND_BOOL, True)]
+    result = list(chunk)
+    if result == expected:
+        print(f"  ✅ {result}")
+        return True
+    print(f"  ❌ {result} (期待: {expected})")
+    return False
+
+
+def test_row_order_iteration():
+    """行優先順の走査のテスト"""
+    print("\n[TEST] 行優先順の走査")
+
+    sst = SharedStrings()
+    sheet = SparseSheet('test')
+    sheet.add_cell(0, 2, KIND_NUMBER, 3.0)
+    sheet.add_cell(5, 2, KIND_NUMBER, 4.0)
+    sheet.add_cell(0, 0, KIND_TEXT, sst.intern('a'))
+    sheet.add_cell(5, 1, KIND_TEXT, sst.intern('a'))
+
+    rows = [(row, [col for col, _, _ in cells]) for row, cells in sheet.iter_rows()]
+    expected = [(0, [0, 2]), (5, [1, 2])]
+
+    passed = 0
+    if rows == expected:
+        print(f"  ✅ 行順: {rows}")
+        passed += 1
+    else:
+        print(f"  ❌ 行順: {rows} (期待: {expected})")
+
+    if len(sst) == 1 and sst.ref_count == 2:
+        print("  ✅ 共有文字列の重複排除")
+        passed += 1
+    else:
+        print(f"  ❌ 共有文字列: unique={len(sst)}, refs={sst.ref_count}")
+
+    print(f"  結果: {passed}/2 passed")
+    return passed == 2
+
+
+def test_sparse_memory():
+    """疎なシートのメモリ使用量が非空セル数に比例することのテスト"""
+    print("\n[TEST] 疎なシートのメモリ使用量")
+
+    sheets, sst, _ = load_sparse_workbook(make_sparse_xls())
+    sheet = sheets[0]
+
+    passed = 0
+    if sheet.cell_count == 7 and (sheet.nrows, sheet.ncols) == (60001, 251):
+        print(f"  ✅ 非空セル数: {sheet.cell_count}, 範囲: {sheet.nrows}x{sheet.ncols}")
+        passed += 1
+    else:
+        print(f"  ❌ 非空セル数: {sheet.cell_count}, 範囲: {sheet.nrows}x{sheet.ncols}")
+
+    # 1セルあたり最大 4(行) + 1(種別) + 8(値) バイト
+    if sheet.nbytes() <= sheet.cell_count * 13:
+        print(f"  ✅ バッファサイズ: {sheet.nbytes()} bytes")
+        passed += 1
+    else:
+        print(f"  ❌ バッファサイズ: {sheet.nbytes()} bytes")
+
+    print(f"  結果: {passed}/2 passed")
+    return passed == 2
+
+
+def test_native_conversion():
+    """ネイティブエンジンによる変換結果のテスト"""
+    print("\n[TEST] ネイティブエンジン変換")
+
+    xlsx_data = convert_xls_to_xlsx(make_sparse_xls(), engine='native')
+    ws = openpyxl.load_workbook(io.BytesIO(xlsx_data))['疎なシート']
+
+    test_cases = [
+        ('A1', '名前'),
+        ('B2', 150),
+        ('C3', True),
+        ('D4', datetime(2024, 1, 2, 3, 4)),
+        ('IQ60001', 'りんご'),
+    ]
+
+    passed = 0
+    for ref, expected in test_cases:
+        value = ws[ref].value
+        if value == expected:
+            print(f"  ✅ {ref}: {value!r}")
+            passed += 1
+        else:
+            print(f"  ❌ {ref}: {value!r} (期待: {expected!r})")
+
+    print(f"  結果: {passed}/{len(test_cases)} passed")
+    return passed == len(test_cases)
+
+
+def test_phantom_range_trimming():
+    """書式のみの空セルによる使用範囲の除外テスト"""
+    print("\n[TEST] 使用範囲のトリミング")
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('ERP')
+    ws.write(0, 0, 'コード')
+    ws.write(0, 1, '数量')
+    ws.write(1, 0, 'A001')
+    ws.write(1, 1, 10)
+    formatted = xlwt.easyxf('pattern: pattern solid, fore_colour yellow')
+    for row in range(2, 1000):
+        ws.write(row, 30, None, formatted)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    passed = 0
+    for engine in ('pandas', 'native'):
+        _, stats = convert_xls_to_xlsx_with_stats(buffer.getvalue(), engine=engine)
+        sheet = stats['sheets'][0]
+        # 宣言範囲 1000行x31列 → 実データ範囲 2行x2列
+        expected_trimmed = 1000 * 31 - 2 * 2
+        if (sheet['rows'], sheet['cols']) == (2, 2) and stats['trimmed_cells'] == expected_trimmed:
+            print(f"  ✅ {engine}: {sheet['rows']}x{sheet['cols']}, trimmed={stats['trimmed_cells']}")
+            passed += 1
+        else:
+            print(f"  ❌ {engine}: {sheet} (期待 trimmed={expected_trimmed})")
+
+    print(f"  結果: {passed}/2 passed")
+    return passed == 2
+
+
+def test_narrow_header_row():
+    """1行目が実データ範囲より狭いシートの変換テスト"""
+    print("\n[TEST] 1行目が狭いシート")
+
+    # A1 のタイトルの下に3列の表
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('表')
+    ws.write(0, 0, 'タイトル')
+    for row in range(1, 4):
+        for col in range(3):
+            ws.write(row, col, row * 10 + col)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    passed = 0
+    for engine in ('pandas', 'native'):
+        try:
+            output, stats = convert_xls_to_xlsx_with_stats(buffer.getvalue(), engine=engine)
+            values = [list(row) for row in openpyxl.load_workbook(io.BytesIO(output)).active.iter_rows(values_only=True)]
+        except Exception as e:
+            print(f"  ❌ {engine}: {type(e).__name__}: {e}")
+            continue
+        sheet = stats['sheets'][0]
+        if (sheet['rows'], sheet['cols']) == (4, 3) and values[0][0] == 'タイトル' \
+                and values[1:] == [[10, 11, 12], [20, 21, 22], [30, 31, 32]]:
+            print(f"  ✅ {engine}: {sheet['rows']}x{sheet['cols']}")
+            passed += 1
+        else:
+            print(f"  ❌ {engine}: {sheet} {values}")
+
+    print(f"  結果: {passed}/2 passed")
+    return passed == 2
+
+
+def test_raw_mode_and_schema_hint():
+    """raw モードとスキーマヒントのテスト"""
+    print("\n[TEST] raw モードとスキーマヒント")
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('raw')
+    ws.write(0, 0, 'id')
+    ws.write(0, 1, 'id')
+    ws.write(0, 2, 2024)
+    ws.write(1, 0, 1)
+    ws.write(1, 1, '1,234')
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    def first_rows(xlsx_data):
+        ws = openpyxl.load_workbook(io.BytesIO(xlsx_data)).active
+        return [[cell.value for cell in row] for row in ws.iter_rows()]
+
+    test_cases = [
+        ('pandas raw', 'pandas', {'raw': True}, [['id', 'id', 2024], [1, '1,234', None]]),
+        ('native', 'native', {}, [['id', 'id', 2024], [1, '1,234', None]]),
+        ('pandas text', 'pandas', {'schema': parse_schema_hint('text')}, [['id', 'id', '2024'], ['1', '1,234', None]]),
+        ('native text', 'native', {'schema': parse_schema_hint('text')}, [['id', 'id', '2024'], ['1', '1,234', None]]),
+        ('pandas number', 'pandas', {'schema': parse_schema_hint('{"columns": {"B": "number"}}')}, [['id', 'id', 2024], [1, 1234, None]]),
+        ('native number', 'native', {'schema': parse_schema_hint('{"columns": {"1": "number"}}')}, [['id', 'id', 2024], [1, 1234, None]]),
+    ]
+
+    passed = 0
+    for label, engine, options, expected in test_cases:
+        rows = first_rows(convert_xls_to_xlsx(buffer.getvalue(), engine=engine, **options))
+        if rows == expected:
+            print(f"  ✅ {label}: {rows}")
+            passed += 1
+        else:
+            print(f"  ❌ {label}: {rows} (期待: {expected})")
+
+    try:
+        parse_schema_hint('{"default": "decimal"}')
+        print("  ❌ 未対応の列型が受理されました")
+    except ValueError:
+        print("  ✅ 未対応の列型を拒否")
+        passed += 1
+
+    total = len(test_cases) + 1
+    print(f"  結果: {passed}/{total} passed")
+    return passed == total
+
+
+def test_sheet_and_row_selection():
+    """シート・行範囲指定のテスト"""
+    print("\n[TEST] シート・行範囲の指定")
+
+    wb = xlwt.Workbook()
+    for name in ('売上', '在庫', '集計'):
+        ws = wb.add_sheet(name)
+        for row in range(10):
+            ws.write(row, 0, f"{name}{row + 1}")
+            ws.write(row, 1, row + 1)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    xls_data = buffer.getvalue()
+
+    def sheets_of(xlsx_data):
+        book = openpyxl.load_workbook(io.BytesIO(xlsx_data))
+        return {ws.title: [[cell.value for cell in row] for row in ws.iter_rows()] for ws in book.worksheets}
+
+    test_cases = [
+        ('native シート名・番号', 'native', {'sheets': ['集計', '1']},
+         {'集計': [[f"集計{row}", row] for row in range(1, 11)], '売上': [[f"売上{row}", row] for row in range(1, 11)]}),
+        ('native 行範囲', 'native', {'sheets': ['2'], 'rows': parse_row_range('3-4')},
+         {'在庫': [['在庫3', 3], ['在庫4', 4]]}),
+        ('native 範囲外の行', 'native', {'sheets': ['2'], 'rows': parse_row_range('20-')}, {'在庫': []}),
+        ('pandas raw 行範囲', 'pandas', {'sheets': ['在庫'], 'rows': parse_row_range('9-'), 'raw': True},
+         {'在庫': [['在庫9', 9], ['在庫10', 10]]}),
+        ('pandas ヘッダー付き行範囲', 'pandas', {'sheets': ['在庫'], 'rows': parse_row_range('-3')},
+         {'在庫': [['在庫1', 1], ['在庫2', 2], ['在庫3', 3]]}),
+    ]
+
+    passed = 0
+    for label, engine, options, expected in test_cases:
+        result = sheets_of(convert_xls_to_xlsx(xls_data, engine=engine, **options))
+        if result == expected and list(result) == list(expected):
+            print(f"  ✅ {label}")
+            passed += 1
+        else:
+            print(f"  ❌ {label}: {result} (期待: {expected})")
+
+    checks = [
+        ("行範囲の解析", [parse_row_range(text) for text in ('10-20', '10-', '-20', '5')]
+         == [(9, 20), (9, None), (0, 20), (4, 5)]),
+        ("ヘッダーのパーセントエンコード",
+         parse_request_options({'X-Sheets': '%E5%A3%B2%E4%B8%8A,2', 'X-Rows': '1-5'}, {})
+         == {'sheets': ['売上', '2'], 'rows': (0, 5)}),
+        ("Blob名の指定", parse_blob_options('2024/report@sheets=2@rows=1-5.xls') == {'sheets': ['2'], 'rows': (0, 5)}),
+        ("メタデータの指定が優先", parse_blob_options('report@sheets=2.xls', {'sheets': '%E5%9C%A8%E5%BA%AB'})
+         == {'sheets': ['在庫']}),
+    ]
+    for text in ('0-5', '5-3', 'a-b'):
+        try:
+            parse_row_range(text)
+            checks.append((f"不正な行範囲を拒否: {text}", False))
+        except ValueError:
+            checks.append((f"不正な行範囲を拒否: {text}", True))
+    for engine in ('native', 'pandas'):
+        try:
+            convert_xls_to_xlsx(xls_data, engine=engine, sheets=['存在しない'])
+            checks.append((f"{engine} 存在しないシートを拒否", False))
+        except SheetSelectionError:
+            checks.append((f"{engine} 存在しないシートを拒否", True))
+
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    total = len(test_cases) + len(checks)
+    print(f"  結果: {passed}/{total} passed")
+    return passed == total
+
+
+def test_columnar_outputs():
+    """CSV・Parquet・Arrow IPC 出力のテスト"""
+    print("\n[TEST] 列指向形式・CSV 出力")
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('売上')
+    for col, title in enumerate(('名前', '値', '日付', '混在')):
+        ws.write(0, col, title)
+    for row in range(1, 4):
+        ws.write(row, 0, f"商品{row}")
+        ws.write(row, 1, row * 1.5)
+        ws.write(row, 2, datetime(2024, 1, row), xlwt.easyxf(num_format_str='yyyy-mm-dd'))
+        ws.write(row, 3, row if row % 2 else 'x')
+    wb.add_sheet('空').write(2, 1, True)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    xls_data = buffer.getvalue()
+
+    def entries(data):
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        return {name: archive.read(name) for name in archive.namelist()}
+
+    csv_files = entries(convert_xls_to_xlsx(xls_data, output_format='csv'))
+    checks = [
+        ("シートごとの CSV", list(csv_files) == ['売上.csv', '空.csv']),
+        ("CSV の値・日付", csv_files.get('売上.csv', b'').decode('utf-8').splitlines()[1] == '商品1,1.5,2024-01-01,1'),
+        ("空行を保持", csv_files.get('空.csv') == b'\r\n\r\n,TRUE\r\n'),
+        ("Accept ヘッダーで形式を選択",
+         parse_request_options({'Accept': 'application/vnd.apache.parquet, */*'}, {}) == {'output_format': 'parquet'}),
+        ("クエリが Accept より優先", parse_request_options({'Accept': 'text/csv'}, {'format': 'xlsx'}) == {}),
+        ("CSV の ZIP は application/zip",
+         parse_request_options({'Accept': 'application/zip'}, {}) == {'output_format': 'csv'}),
+    ]
+    # ZIP で返す CSV は Accept: text/csv に応答できない（406）
+    try:
+        parse_request_options({'Accept': 'text/csv'}, {})
+        checks.append(("text/csv は NotAcceptable", False))
+    except NotAcceptable:
+        checks.append(("text/csv は NotAcceptable", True))
+
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        print("  ⚠️ pyarrow が無いため Parquet / Arrow IPC の検証を省略")
+    else:
+        parquet_files = entries(convert_xls_to_xlsx(xls_data, output_format='parquet'))
+        table = pa.parquet.read_table(pa.BufferReader(parquet_files['売上.parquet']))
+        checks.append(("Parquet の列型", [str(field.type) for field in table.schema]
+                       == ['string', 'double', 'timestamp[ms]', 'string']))
+        checks.append(("1行目を列名に使用", table.column_names == ['名前', '値', '日付', '混在']))
+        checks.append(("Parquet の値", table.column('値').to_pylist() == [1.5, 3.0, 4.5]))
+        arrow_files = entries(convert_xls_to_xlsx(xls_data, output_format='arrow', raw=True))
+        table = pa.ipc.open_file(pa.BufferReader(arrow_files['空.arrow'])).read_all()
+        checks.append(("raw モードは列記号を列名に使用",
+                       table.column_names == ['A', 'B'] and table.column('B').to_pylist() == [None, None, True]))
+
+    passed = 0
+    for label, ok in checks:
+        print(f"  {'✅' if ok else '❌'} {label}")
+        passed += ok
+
+    print(f"  結果: {passed}/{len(checks)} passed")
+    return passed == len(checks)
+
+
+def main():
+    """メインテスト実行"""
+    print("=" * 70)
+    print("スパース中間表現検証テスト")
+    print("=" * 70)
+
+    tests = [
+        ("列チャンク", test_column_chunk),
+        ("行優先順の走査", test_row_order_iteration),
+        ("疎なシートのメモリ使用量", test_sparse_memory),
+        ("ネイティブエンジン変換", test_native_conversion),
+        ("使用範囲のトリミング", test_phantom_range_trimming),
+        ("1行目が狭いシート", test_narrow_header_row),
+        ("raw モードとスキーマヒント", test_raw_mode_and_schema_hint),
+        ("シート・行範囲の指定", test_sheet_and_row_selection),
+        ("列指向形式・CSV 出力", test_columnar_outputs),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            passed = test_func()
+            results.append((test_name, passed))
+        except Exception as e:
+            print(f"\n  ❌ テスト実行エラー: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    print("テスト結果サマリー")
+    print("=" * 70)
+
+    passed_count = sum(1 for _, passed in results if passed)
+    total_count = len(results)
+
+    for test_name, passed in results:
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"{status}: {test_name}")
+
+    print("=" * 70)
+    print(f"総合結果: {passed_count}/{total_count} テスト成功 ({passed_count/total_count*100:.0f}%)")
+    print("=" * 70)
+
+    return 0 if passed_count == total_count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
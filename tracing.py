@@ -0,0 +1,243 @@
+"""
+分散トレーシングモジュール
+OpenTelemetry のスパンで入力の取り込み・検証・変換（解析・書き出し）・Storage 入出力を
+1つのトレースにまとめ、キュー・Blob 経由の処理にもトレースコンテキスト（W3C traceparent）を引き継ぐ
+
+エクスポーターは OTEL_TRACES_EXPORTER で選択する:
+- none（既定）: スパンを作成しない
+- console: 標準出力に JSON で出力
+- file: OTEL_TRACES_FILE（既定: traces.jsonl）に1行1スパンの JSON で追記
+- otlp: OTLP/HTTP で送信（opentelemetry-exporter-otlp-proto-http が必要。送信先は OTEL_EXPORTER_OTLP_ENDPOINT）
+
+opentelemetry-sdk が無い場合・none の場合は何もしない（スパンの作成・SDK の import を行わない）
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Mapping
+
+EXPORTER_NONE = 'none'
+EXPORTER_CONSOLE = 'console'
+EXPORTER_FILE = 'file'
+EXPORTER_OTLP = 'otlp'
+EXPORTERS = (EXPORTER_NONE, EXPORTER_CONSOLE, EXPORTER_FILE, EXPORTER_OTLP)
+
+DEFAULT_TRACES_FILE = 'traces.jsonl'
+DEFAULT_SERVICE_NAME = 'xls2xlsx'
+
+# 変換統計の timings のうち、変換スパンの子スパンとして記録する段階（実行順）
+TIMING_STAGES = ('parse', 'write')
+
+_tracer_lock = threading.Lock()
+_tracer = None
+_provider = None
+_initialized = False
+
+
+class _NoopSpan:
+    """トレーシング無効時のスパン（記録を行わない）"""
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, attributes: Mapping):
+        pass
+
+    def add_event(self, name: str, attributes: Mapping = None):
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def get_exporter_name() -> str:
+    """スパンのエクスポーター（OTEL_TRACES_EXPORTER、既定: none）"""
+    name = os.environ.get('OTEL_TRACES_EXPORTER', EXPORTER_NONE).strip().lower()
+    if name not in EXPORTERS:
+        logging.warning(f"未対応の OTEL_TRACES_EXPORTER です（トレーシングを無効化）: {name}")
+        return EXPORTER_NONE
+    return name
+
+
+def get_tracer():
+    """
+    プロセス内で共有する Tracer を返す（初回呼び出し時に初期化）
+
+    Returns:
+        Tracer（トレーシングが無効・SDK が無い場合は None）
+    """
+    global _tracer, _provider, _initialized
+    if _initialized:
+        return _tracer
+    with _tracer_lock:
+        if not _initialized:
+            name = get_exporter_name()
+            if name != EXPORTER_NONE:
+                try:
+                    _provider = _create_provider(name)
+                    _tracer = _provider.get_tracer(__name__)
+                except ImportError as e:
+                    logging.warning(f"OpenTelemetry を利用できません（トレーシングを無効化）: {str(e)}")
+            _initialized = True
+    return _tracer
+
+
+def _create_provider(name: str):
+    """エクスポーターを設定した TracerProvider を作成"""
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    if name == EXPORTER_OTLP:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif name == EXPORTER_FILE:
+        path = os.environ.get('OTEL_TRACES_FILE', DEFAULT_TRACES_FILE)
+        exporter = ConsoleSpanExporter(
+            out=open(path, 'a', encoding='utf-8'),
+            formatter=lambda span: span.to_json(indent=None) + '\n',
+        )
+    else:
+        exporter = ConsoleSpanExporter()
+
+    resource = Resource.create({'service.name': os.environ.get('OTEL_SERVICE_NAME', DEFAULT_SERVICE_NAME)})
+    provider = TracerProvider(resource=resource)
+    # エクスポートはバックグラウンドスレッドで行い、リクエストの処理時間に含めない
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider
+
+
+def is_enabled() -> bool:
+    """トレーシングが有効か"""
+    return get_tracer() is not None
+
+
+@contextmanager
+def start_span(name: str, attributes: Mapping = None, carrier: Mapping[str, str] = None):
+    """
+    スパンを開始して現在のスパンにする（例外は記録してそのまま送出）
+
+    Args:
+        name: スパン名
+        attributes: スパンの属性
+        carrier: 親のトレースコンテキスト（traceparent / tracestate を含む HTTP ヘッダー・
+            メッセージ・Blob メタデータ）。省略時は現在のスパンを親にする
+
+    Yields:
+        スパン（トレーシング無効時は何も記録しないスパン）
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+
+    context = None
+    if carrier is not None:
+        from opentelemetry.propagate import extract
+        context = extract(_normalize_carrier(carrier))
+    with tracer.start_as_current_span(name, context=context, attributes=_clean(attributes)) as span:
+        yield span
+
+
+def record_timings(timings: Mapping[str, float], stages=TIMING_STAGES):
+    """
+    変換統計の所要時間から、現在のスパンの子スパンを記録
+
+    変換は常駐ワーカーのサブプロセスで実行される場合があるため、サブプロセスでは
+    スパンを作成せず、返された所要時間を現在のスパンの開始時刻から順に並べて記録する
+
+    Args:
+        timings: 段階ごとの所要時間（秒）。変換統計の 'timings'
+        stages: 記録する段階（実行順）
+    """
+    if get_tracer() is None or not timings:
+        return
+    from opentelemetry import trace
+
+    parent = trace.get_current_span()
+    start = getattr(parent, 'start_time', None)
+    if start is None:
+        return
+    for stage in stages:
+        if stage not in timings:
+            continue
+        end = start + int(timings[stage] * 1e9)
+        _tracer.start_span(stage, start_time=start).end(end_time=end)
+        start = end
+
+
+def inject() -> dict:
+    """
+    現在のトレースコンテキストを返す（キューメッセージ・Blob メタデータに付与する）
+
+    Returns:
+        {'traceparent': ..., ('tracestate': ...)}（トレーシング無効時・スパン外は空）
+    """
+    if get_tracer() is None:
+        return {}
+    from opentelemetry.propagate import inject as inject_context
+
+    carrier = {}
+    inject_context(carrier)
+    return carrier
+
+
+def current_trace_id() -> str:
+    """現在のスパンのトレースID（16進数、トレーシング無効時・スパン外は None）"""
+    if get_tracer() is None:
+        return None
+    from opentelemetry import trace
+
+    span_context = trace.get_current_span().get_span_context()
+    return format(span_context.trace_id, '032x') if span_context.is_valid else None
+
+
+def set_attributes(attributes: Mapping):
+    """現在のスパンに属性を記録（トレーシング無効時・スパン外は何もしない）"""
+    if get_tracer() is None:
+        return
+    from opentelemetry import trace
+
+    trace.get_current_span().set_attributes(_clean(attributes) or {})
+
+
+def add_event(name: str, attributes: Mapping = None):
+    """現在のスパンにイベントを記録（トレーシング無効時・スパン外は何もしない）"""
+    if get_tracer() is None:
+        return
+    from opentelemetry import trace
+
+    trace.get_current_span().add_event(name, _clean(attributes))
+
+
+def flush(timeout_millis: int = 30000) -> bool:
+    """未送信のスパンをエクスポート（テスト・スクリプト終了時用）"""
+    if _provider is None:
+        return True
+    return _provider.force_flush(timeout_millis)
+
+
+def shutdown():
+    """エクスポーターを終了し、次回の呼び出しで設定（OTEL_TRACES_EXPORTER）を読み直す（テスト用）"""
+    global _tracer, _provider, _initialized
+    with _tracer_lock:
+        if _provider is not None:
+            _provider.shutdown()
+        _tracer = _provider = None
+        _initialized = False
+
+
+def _normalize_carrier(carrier: Mapping[str, str]) -> dict:
+    """ヘッダー名の大文字・小文字の違いを吸収（Blob メタデータ・HTTP ヘッダー）"""
+    return {str(key).lower(): value for key, value in carrier.items() if value}
+
+
+def _clean(attributes: Mapping):
+    """値が None の属性を除く（OpenTelemetry の属性値に None は使えない）"""
+    if not attributes:
+        return None
+    return {key: value for key, value in attributes.items() if value is not None}
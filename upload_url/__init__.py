@@ -0,0 +1,51 @@
+import azure.functions as func
+import logging
+import uuid
+from datetime import timedelta
+from security_utils import MAX_FILE_SIZE, sanitize_filename
+from http_utils import create_error_response, create_json_response, get_request_filename
+from storage_utils import INPUT_CONTAINER, ensure_container, get_blob_url_with_sas
+
+# アップロード用SASの有効期間
+UPLOAD_SAS_EXPIRY = timedelta(minutes=15)
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    xls-input への直接アップロード用の短期SAS URLを発行
+
+    クライアントは upload_url に PUT（x-ms-blob-type: BlockBlob）でアップロードし、
+    返却された blob を convert_reference に指定して変換する。
+    ファイルが HTTP リクエストボディを経由しないため、大きなファイルでもワーカーのメモリを消費しない
+    """
+    logging.info('Upload URL requested.')
+
+    try:
+        # 元のファイル名を残しつつ、他のアップロードと衝突しない Blob 名を生成
+        raw_filename = get_request_filename(req, 'upload.xls')
+        base_name = sanitize_filename(raw_filename)
+        if base_name.lower().endswith('.xls'):
+            base_name = base_name[:-4]
+        blob_name = sanitize_filename(f"{uuid.uuid4().hex}-{base_name}"[:250] + '.xls')
+
+        from azure.storage.blob import BlobSasPermissions
+
+        ensure_container(INPUT_CONTAINER)
+        upload_url = get_blob_url_with_sas(
+            INPUT_CONTAINER,
+            blob_name,
+            expiry=UPLOAD_SAS_EXPIRY,
+            permission=BlobSasPermissions(create=True, write=True),
+            sign_local=True
+        )
+
+        return create_json_response({
+            'blob': blob_name,
+            'upload_url': upload_url,
+            'expires_in': int(UPLOAD_SAS_EXPIRY.total_seconds()),
+            'max_size': MAX_FILE_SIZE,
+            'headers': {'x-ms-blob-type': 'BlockBlob'}
+        }, status_code=201)
+
+    except Exception as e:
+        logging.error(f"アップロードURL発行エラー: {str(e)}", exc_info=True)
+        return create_error_response("アップロードURLの発行に失敗しました。", 500)
@@ -0,0 +1,14 @@
+import azure.functions as func
+import logging
+from warmup_utils import warm_up
+
+def main(warmupContext: func.Context) -> None:
+    """
+    新しいインスタンスがトラフィックを受ける前に呼び出されるウォームアップトリガー
+    （Premium / Dedicated プランでスケールアウト時に実行）
+
+    Args:
+        warmupContext: ウォームアップコンテキスト
+    """
+    timings = warm_up()
+    logging.info(f"Function App instance is warm: {timings['total']:.3f}s")
@@ -0,0 +1,137 @@
+"""
+ウォームアップユーティリティモジュール
+新しいワーカーがトラフィックを受ける前に、重いモジュールの読み込み・変換経路の初回実行・
+Storage クライアント作成を済ませ、初回リクエストのレイテンシを削減する
+"""
+import base64
+import gc
+import logging
+import os
+import threading
+import time
+import zlib
+
+# ウォームアップ用の小さなXLS（1シート・文字列/数値/日付/真偽値を各1セル、zlib+base64）
+WARMUP_XLS = (
+    'eNrtWE1oE0EU/mY32/zQ5qemQiuUULTW2kLEi5d2q6A9GaIXRQVNTQ6lJi3BH+rFas1RELyoeCnU'
+    'g5daPfiDCooXD0JFEUUQEsWDCIJgwUOb9c3LrKTVQgNaqMy3zJs3b2bevJ15b2Z2X8xEihO3WkpY'
+    'hF6YKDt+1FXJBCW/WwiD6h1Hsm7uo+RorCr4fbSQdRYeNDz3yjWU612CgWnPE6LAB0qHMILEcC4T'
+    'W0HsYBtSQtrQQ1TgGkmCaGarGpkeZbqG6U1u+ZBpH0suMO2htkVxADN2onOb8uL9RhvXBSH13uU+'
+    '71iyBU14Jr34zEVRaWthe34wdWyVVbR66jEJWtD+TC6Tl+UQriMAjBK6s9nudLqIKC32JGadGPDd'
+    'jerHMS1fWbkAyX8slHuXkPtoERfLLxkeYAzOEQ6SAjl1xFMJ5FOpfPbEyBw6yCvAiVpYl7+eFBDr'
+    'k8R/yrxNmBCv45/j03FyoFRAbvC8IYQXbAgNHCj1RNMIMR/hcAmTRXM3vr3cPZC0D7NkjA+BylGx'
+    'QVoGB2dlD+oc5BqDqazpZH4z03OsdR3zLUyjZDHl7ckmxewa5zbnubadxtnKeGVvrOI7iC982XOv'
+    'tfDR3kT8VH/pdHTqjT2BNjq60tRfPuPoEl3i6hWJ+7abC7WtvGfa/NsW4zPCynZHnYchzMugIkSY'
+    'VkpydsSvkqHmqlIyqWQqXeIPugTrkrPziKwRrOugITe8208N0mMZPpKZPEKv0Yg7PJ19VYd0ABoa'
+    'GhoaGhoaGhpLQqgruaku5Za68nvVf515SmX9m+S/xV4M03OcPip3Ikd5HqM1+c9aWMLVJZbZx/1f'
+    'KLGPRs9jCANsx1DN/kufbKL6fZbdMfz3QqjW8cu12PmPx/8Ja9bVow=='
+)
+
+_warmup_lock = threading.Lock()
+_warmup_result = None
+
+
+def get_warmup_xls() -> bytes:
+    """ウォームアップ用XLSのバイナリを返す"""
+    return zlib.decompress(base64.b64decode(WARMUP_XLS))
+
+
+def is_warm() -> bool:
+    """このプロセスでウォームアップが完了しているかを返す"""
+    return _warmup_result is not None
+
+
+def warm_up(include_storage: bool = True) -> dict:
+    """
+    プロセスをウォームアップ（プロセスごとに1回だけ実行）
+
+    1. 埋め込みXLSを検証・変換し、両エンジンの import と初回実行コストを前払い
+    2. 共有 BlobServiceClient を作成し、出力コンテナの存在確認をキャッシュ
+    3. 変換ワーカープールが有効な場合はワーカーを起動
+    4. 起動時に確保したオブジェクトを gc.freeze() で GC 対象外にする
+
+    Args:
+        include_storage: Storage クライアントの準備も行うか
+
+    Returns:
+        ステージごとの所要時間（秒）。2回目以降は初回の結果を返す
+    """
+    global _warmup_result
+    if _warmup_result is not None:
+        return _warmup_result
+
+    with _warmup_lock:
+        if _warmup_result is not None:
+            return _warmup_result
+
+        # 重いモジュールはウォームアップ実行時に読み込む
+        from security_utils import validate_input
+        from conversion_utils import convert_xls_to_xlsx, get_default_engine, SUPPORTED_ENGINES
+
+        timings = {}
+        start = time.perf_counter()
+        xls_data = get_warmup_xls()
+
+        stage_start = time.perf_counter()
+        is_valid, _, error_message = validate_input(xls_data, 'warmup.xls')
+        if not is_valid:
+            raise ValueError(f"ウォームアップ用XLSの検証に失敗しました: {error_message}")
+        timings['validate'] = time.perf_counter() - stage_start
+
+        # 既定エンジンを先に実行し、残りのエンジンも読み込んでおく（ヘッダーで切り替え可能なため）
+        default_engine = get_default_engine()
+        engines = [default_engine] + [e for e in SUPPORTED_ENGINES if e != default_engine]
+        for engine in engines:
+            stage_start = time.perf_counter()
+            convert_xls_to_xlsx(xls_data, engine=engine)
+            timings[f'convert_{engine}'] = time.perf_counter() - stage_start
+
+        if include_storage:
+            stage_start = time.perf_counter()
+            try:
+                from storage_utils import OUTPUT_CONTAINER, ensure_container
+                ensure_container(OUTPUT_CONTAINER)
+            except Exception as e:
+                # Storage に接続できなくても変換経路のウォームアップは有効
+                logging.warning(f"ウォームアップ中のStorage準備エラー（無視可能）: {str(e)}")
+            timings['storage'] = time.perf_counter() - stage_start
+
+        # 変換ワーカープール（CONVERSION_POOL_SIZE）を起動（ワーカー側のウォームアップは各プロセスで実行）
+        stage_start = time.perf_counter()
+        import worker_pool
+        if worker_pool.get_pool() is not None:
+            timings['pool'] = time.perf_counter() - stage_start
+
+        # import 済みモジュール等の長寿命オブジェクトを世代別 GC の走査対象から外す
+        stage_start = time.perf_counter()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        timings['gc_freeze'] = time.perf_counter() - stage_start
+
+        timings['total'] = time.perf_counter() - start
+        _warmup_result = timings
+        logging.info(f"Warm-up completed in {timings['total']:.3f}s: {timings}")
+        return _warmup_result
+
+
+def schedule_startup_warmup():
+    """
+    WARMUP_ON_STARTUP が有効な場合、バックグラウンドスレッドでウォームアップを開始
+
+    ウォームアップトリガーが使えないプラン（従量課金プラン等）向けの起動時フック
+    """
+    if os.environ.get('WARMUP_ON_STARTUP', '').lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+    if is_warm():
+        return None
+
+    def _run():
+        try:
+            warm_up()
+        except Exception as e:
+            logging.warning(f"起動時ウォームアップエラー（無視可能）: {str(e)}")
+
+    thread = threading.Thread(target=_run, name='startup-warmup', daemon=True)
+    thread.start()
+    return thread
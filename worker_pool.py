@@ -0,0 +1,689 @@
+"""
+変換ワーカープール（常駐サブプロセス）モジュール
+変換処理は CPU 負荷が高く GIL を保持するため、同一インスタンスの同時リクエストが直列化される。
+import・ウォームアップ済みのサブプロセスで変換を実行し、同時変換数をワーカー数（CONVERSION_POOL_SIZE、
+既定: CPU コア数）までスケールさせる。CONVERSION_POOL_SIZE=0 では呼び出し元のスレッドで変換し、
+以下のサンドボックスの上限は適用されない
+
+- 全ワーカーが使用中の場合は POOL_ACQUIRE_TIMEOUT_SECONDS まで待機し、空かなければ PoolBusy を送出する
+  （待機中の要求が関数のタイムアウトを超えないよう、再試行可能なエラーとして呼び出し元に返す）
+
+- 入出力データは一時ファイル（/dev/shm が使える場合は共有メモリ上）で受け渡し、
+  プロセス間の通信はファイルパスと変換統計のみ
+- 一定時間使用されていないワーカーは使用前に ping で死活確認し、応答が無ければ入れ替える
+- ジョブ数（POOL_MAX_JOBS）・起動時からの RSS 増加量（POOL_MAX_RSS_GROWTH_MB）の上限で入れ替える
+- ワーカーはサンドボックスとして動作する。アドレス空間（SANDBOX_MAX_MEMORY_MB）と
+  1件あたりの CPU 時間（SANDBOX_MAX_CPU_SECONDS）を setrlimit で制限し、親プロセスは
+  経過時間（POOL_JOB_TIMEOUT_SECONDS）を監視して超過したワーカーを強制終了する。
+  上限を超えた変換は MemoryLimitExceeded / CpuLimitExceeded / WorkerTimeout として呼び出し元に返し、
+  ワーカーは入れ替える
+- シート単位のチェックポイントによる変換（convert_resumable）もワーカーで実行し、同じ上限を適用する
+"""
+import atexit
+import logging
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from multiprocessing.connection import Connection
+from typing import Tuple
+
+import checkpoint
+from conversion_utils import (
+    FAILURE_TIMEOUT,
+    CpuLimitExceeded,
+    MemoryLimitExceeded,
+    ResourceLimitExceeded,
+    convert_xls_to_xlsx_with_stats,
+    get_default_engine,
+)
+from profiling import SamplingProfiler
+
+# 使用前に死活確認を行うアイドル時間（秒）
+HEALTH_CHECK_INTERVAL = 30
+
+# 死活確認・起動完了の応答待ち時間（秒）
+PING_TIMEOUT = 5
+STARTUP_TIMEOUT = 120
+
+# 共有メモリ上の一時ファイル置き場（存在しない環境では通常の一時ディレクトリ）
+_SHM_DIR = '/dev/shm'
+
+# ワーカープロセスに設定する環境変数（ワーカー内ではプールを作成しない）
+_WORKER_ENV = 'XLS2XLSX_POOL_WORKER'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class WorkerCrashed(RuntimeError):
+    """変換中にワーカープロセスが終了した"""
+
+
+class PoolBusy(RuntimeError):
+    """全ワーカーが使用中で、待機時間内に空かなかった（再試行可能）"""
+
+
+class WorkerTimeout(ResourceLimitExceeded, TimeoutError):
+    """変換が制限時間内に完了しなかった（ワーカーは強制終了して入れ替える）"""
+    failure_class = FAILURE_TIMEOUT
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def get_pool_size() -> int:
+    """ワーカー数（CONVERSION_POOL_SIZE、既定: CPU コア数、0 = プールを使用せずスレッドで変換（サンドボックスなし））"""
+    return max(0, _env_int('CONVERSION_POOL_SIZE', os.cpu_count() or 1))
+
+
+def get_max_jobs() -> int:
+    """ワーカーを入れ替えるまでのジョブ数（POOL_MAX_JOBS、既定: 200）"""
+    return max(1, _env_int('POOL_MAX_JOBS', 200))
+
+
+def get_max_rss_growth() -> int:
+    """ワーカーを入れ替える RSS 増加量（POOL_MAX_RSS_GROWTH_MB、既定: 512MB）をバイト数で返す"""
+    return max(1, _env_int('POOL_MAX_RSS_GROWTH_MB', 512)) * 1024 * 1024
+
+
+def get_job_timeout() -> float:
+    """1件の変換の制限時間（POOL_JOB_TIMEOUT_SECONDS、既定: 240秒）"""
+    return float(max(1, _env_int('POOL_JOB_TIMEOUT_SECONDS', 240)))
+
+
+def get_acquire_timeout() -> float:
+    """全ワーカーが使用中の場合の待機時間の上限（POOL_ACQUIRE_TIMEOUT_SECONDS、既定: 30秒）"""
+    return float(max(0, _env_int('POOL_ACQUIRE_TIMEOUT_SECONDS', 30)))
+
+
+def get_max_memory() -> int:
+    """ワーカーのアドレス空間の上限（起動完了時からの増加量、SANDBOX_MAX_MEMORY_MB、既定: 1024MB、0 = 無制限）をバイト数で返す"""
+    return max(0, _env_int('SANDBOX_MAX_MEMORY_MB', 1024)) * 1024 * 1024
+
+
+def get_max_cpu_seconds() -> int:
+    """1件の変換の CPU 時間の上限（SANDBOX_MAX_CPU_SECONDS、既定: 120秒、0 = 無制限）"""
+    return max(0, _env_int('SANDBOX_MAX_CPU_SECONDS', 120))
+
+
+def current_rss() -> int:
+    """
+    現在のプロセスの RSS（バイト）を返す
+
+    /proc を読めない環境では最大 RSS（getrusage）を返す
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    現在のプロセスの最大 RSS（VmHWM）を現在の RSS にリセット
+
+    Returns:
+        リセットできた場合 True（/proc/self/clear_refs に書き込めない環境では False）
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """現在のプロセスの最大 RSS（バイト、/proc を読めない環境では None）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _temp_dir() -> str:
+    if os.path.isdir(_SHM_DIR) and os.access(_SHM_DIR, os.W_OK):
+        return _SHM_DIR
+    return tempfile.gettempdir()
+
+
+def get_pool():
+    """
+    プロセス内で共有するワーカープールを返す（初回呼び出し時にワーカーを起動）
+
+    Returns:
+        ConversionPool（CONVERSION_POOL_SIZE が 0、またはワーカープロセス内の場合は None）
+    """
+    global _pool
+    if os.environ.get(_WORKER_ENV) or get_pool_size() == 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConversionPool(get_pool_size())
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def convert(xls_data: bytes, engine: str = None, profile: bool = False, **options) -> Tuple[bytes, dict]:
+    """
+    XLS を変換（プール有効時はワーカープロセス、無効時は呼び出し元スレッドで実行）
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        engine: 変換エンジン
+        profile: 変換を実行するプロセスで統計的プロファイラを動作させる
+        **options: 変換オプション（convert_xls_to_xlsx_with_stats を参照）
+
+    Returns:
+        (変換結果のバイナリデータ, 変換統計)。profile 指定時は変換統計の 'profile' に
+        collapsed stacks 形式のプロファイル、'profile_samples' にサンプル数。
+        ワーカーで変換した場合は 'peak_memory' に変換中の RSS の最大増加量（バイト、計測できない環境では含まない）
+
+    Raises:
+        convert_xls_to_xlsx_with_stats と同じ例外（ワーカーから再送出）
+        WorkerCrashed / WorkerTimeout: ワーカーの異常終了・制限時間超過
+        PoolBusy: 全ワーカーが使用中で待機時間内に空かなかった
+    """
+    pool = get_pool()
+    if pool is None:
+        return _convert_in_process(xls_data, engine, profile, options)
+    # 既定のエンジンはワーカーの起動時ではなく呼び出し時の設定（CONVERSION_ENGINE）で決める
+    return pool.convert(xls_data, engine or get_default_engine(), profile=profile, **options)
+
+
+def convert_resumable(xls_data: bytes, input_hash: str, **options):
+    """
+    シート単位のチェックポイントを保存しながら変換（checkpoint.convert_resumable を参照）
+
+    プール有効時はワーカープロセスで実行し、サンドボックスの上限を適用する
+
+    Args:
+        xls_data: XLSファイルのバイナリデータ
+        input_hash: 入力データのハッシュ
+        **options: 変換オプション
+
+    Returns:
+        (XLSXファイルのバイナリデータ, 変換統計)。チェックポイントの対象外の場合は None
+
+    Raises:
+        checkpoint.convert_resumable と同じ例外（CheckpointPending を含む）
+        WorkerCrashed / WorkerTimeout / PoolBusy: convert を参照
+    """
+    pool = get_pool()
+    if pool is None:
+        return checkpoint.convert_resumable(xls_data, input_hash, **options)
+    return pool.convert_resumable(xls_data, input_hash, **options)
+
+
+def _convert_in_process(xls_data: bytes, engine: str, profile: bool, options: dict) -> Tuple[bytes, dict]:
+    """現在のスレッドで変換（profile 指定時はプロファイルを変換統計に追加）"""
+    if not profile:
+        return convert_xls_to_xlsx_with_stats(xls_data, engine, **options)
+    with SamplingProfiler() as profiler:
+        output, stats = convert_xls_to_xlsx_with_stats(xls_data, engine, **options)
+    stats.update(profile=profiler.collapsed(), profile_samples=profiler.samples)
+    return output, stats
+
+
+def get_stats() -> dict:
+    """ワーカープールの統計を返す（プール未使用の場合は workers: 0）"""
+    pool = _pool
+    if pool is None:
+        return {'workers': 0}
+    return pool.get_stats()
+
+
+class ConversionPool:
+    """常駐ワーカープロセスのプール"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {'jobs': 0, 'recycled': 0, 'crashed': 0, 'timeouts': 0, 'limit_breaches': 0, 'busy': 0}
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._start_worker())
+        logging.info(f"Started conversion pool with {size} workers")
+
+    def _start_worker(self) -> '_PoolWorker':
+        return _PoolWorker()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> dict:
+        """ジョブ数・入れ替え回数と現在のアイドルワーカー数を返す"""
+        with self._stats_lock:
+            return {**self._stats, 'workers': self.size, 'idle': self._idle.qsize()}
+
+    def convert(self, xls_data: bytes, engine: str = None, profile: bool = False,
+                **options) -> Tuple[bytes, dict]:
+        """
+        アイドルのワーカーで変換（全ワーカーが使用中の場合は POOL_ACQUIRE_TIMEOUT_SECONDS まで待機）
+
+        Args:
+            xls_data: XLSファイルのバイナリデータ
+            engine: 変換エンジン
+            profile: ワーカーで統計的プロファイラを動作させる（convert を参照）
+            **options: 変換オプション
+
+        Returns:
+            (変換結果のバイナリデータ, 変換統計)
+
+        Raises:
+            PoolBusy: 待機時間内にワーカーが空かなかった
+        """
+        return self._run(xls_data, engine, options, profile)
+
+    def convert_resumable(self, xls_data: bytes, input_hash: str, **options):
+        """
+        アイドルのワーカーでチェックポイントを保存しながら変換（module の convert_resumable を参照）
+
+        1回の実行の時間予算は CHECKPOINT_STEP_SECONDS と、経過時間・CPU 時間の上限の半分のうち最も短い時間
+        （時間予算の直前に開始したシートの変換が上限を超えないようにする）
+        """
+        budgets = [checkpoint.get_step_seconds(), get_job_timeout() / 2]
+        if get_max_cpu_seconds():
+            budgets.append(get_max_cpu_seconds() / 2)
+        options.setdefault('time_budget', min(budgets))
+        return self._run(xls_data, None, options, False, resume_hash=input_hash)
+
+    def _run(self, xls_data: bytes, engine: str, options: dict, profile: bool, resume_hash: str = None):
+        """アイドルのワーカーで1件実行し、上限超過・ジョブ数に応じてワーカーを入れ替える"""
+        worker = self._acquire()
+        replace = True
+        try:
+            result = worker.run(xls_data, engine, options, get_job_timeout(), profile, resume_hash)
+            replace = worker.jobs >= get_max_jobs() or worker.rss_growth >= get_max_rss_growth()
+            if replace:
+                self._count('recycled')
+                logging.info(
+                    f"Recycling conversion worker {worker.pid} "
+                    f"(jobs: {worker.jobs}, RSS growth: {worker.rss_growth // (1024 * 1024)}MB)"
+                )
+            return result
+        except WorkerTimeout:
+            self._count('timeouts')
+            raise
+        except ResourceLimitExceeded:
+            # 上限に達したワーカーはメモリ状態・シグナル処理が不確かなため入れ替える
+            self._count('limit_breaches')
+            raise
+        except WorkerCrashed:
+            self._count('crashed')
+            raise
+        except Exception:
+            # 変換エラーはワーカーから送られた例外（ワーカーはそのまま使用できる）
+            replace = False
+            raise
+        finally:
+            self._count('jobs')
+            self._release(worker, replace)
+
+    def _acquire(self) -> '_PoolWorker':
+        """アイドルのワーカーを取得（しばらく使用されていないワーカーは死活確認する）"""
+        timeout = get_acquire_timeout()
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            self._count('busy')
+            raise PoolBusy(f"All {self.size} conversion workers stayed busy for {timeout:.0f}s")
+        if not worker.is_alive() or (
+            time.monotonic() - worker.last_used > HEALTH_CHECK_INTERVAL and not worker.ping(PING_TIMEOUT)
+        ):
+            logging.warning(f"Replacing unhealthy conversion worker {worker.pid}")
+            self._count('crashed')
+            worker.stop()
+            worker = self._start_worker()
+        return worker
+
+    def _release(self, worker: '_PoolWorker', replace: bool):
+        if self._closed:
+            worker.stop()
+            return
+        if replace:
+            # 停止待ちで応答を遅らせないよう、古いワーカーはバックグラウンドで停止する
+            threading.Thread(target=worker.stop, name='pool-worker-stop', daemon=True).start()
+            worker = self._start_worker()
+        self._idle.put(worker)
+
+    def check_health(self) -> dict:
+        """
+        アイドルのワーカーをすべて ping し、応答の無いワーカーを入れ替える
+
+        Returns:
+            {'healthy': int, 'replaced': int}
+        """
+        workers = []
+        while True:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        result = {'healthy': 0, 'replaced': 0}
+        for worker in workers:
+            if worker.is_alive() and worker.ping(PING_TIMEOUT):
+                result['healthy'] += 1
+            else:
+                result['replaced'] += 1
+                self._count('crashed')
+                worker.stop()
+                worker = self._start_worker()
+            self._idle.put(worker)
+        return result
+
+    def shutdown(self):
+        """すべてのアイドルワーカーを停止（使用中のワーカーは変換完了後に停止）"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+class _PoolWorker:
+    """ワーカープロセスと制御用ソケット（親プロセス側）"""
+
+    def __init__(self):
+        # multiprocessing の spawn はホストのメインモジュールを再実行するため、
+        # "python -m worker_pool" で起動し、ソケットペアを Connection として使用する
+        parent_socket, child_socket = socket.socketpair()
+        env = {**os.environ, _WORKER_ENV: '1', 'PYTHONPATH': os.pathsep.join(filter(None, sys.path))}
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'worker_pool', str(child_socket.fileno())],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            pass_fds=(child_socket.fileno(),),
+            stdin=subprocess.DEVNULL,
+        )
+        child_socket.close()
+        self._conn = Connection(parent_socket.detach())
+        self.ready = False
+        self.jobs = 0
+        self.baseline_rss = 0
+        self.rss = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def rss_growth(self) -> int:
+        """起動完了時からの RSS 増加量（バイト）"""
+        return max(0, self.rss - self.baseline_rss)
+
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    def _receive(self, timeout: float):
+        if not self._conn.poll(timeout):
+            raise WorkerTimeout(f"変換ワーカーが {timeout:.0f} 秒以内に応答しませんでした")
+        try:
+            return self._conn.recv()
+        except (EOFError, OSError):
+            try:
+                returncode = self._process.wait(1)
+            except subprocess.TimeoutExpired:
+                returncode = None
+            if returncode == -signal.SIGXCPU:
+                # CPU 時間の上限でシグナルを処理できずに終了した
+                raise CpuLimitExceeded(f"変換の CPU 時間が上限（{get_max_cpu_seconds()}秒）を超えました")
+            raise WorkerCrashed(f"変換ワーカー（pid {self.pid}）が異常終了しました"
+                                f"（終了コード: {returncode}）")
+
+    def _wait_ready(self):
+        if not self.ready:
+            _, self.baseline_rss = self._receive(STARTUP_TIMEOUT)
+            self.rss = self.baseline_rss
+            self.ready = True
+
+    def ping(self, timeout: float) -> bool:
+        """死活確認（応答があれば RSS を更新して True）"""
+        try:
+            self._wait_ready()
+            self._conn.send(('ping',))
+            _, self.rss = self._receive(timeout)
+            self.last_used = time.monotonic()
+            return True
+        except (WorkerTimeout, WorkerCrashed, OSError):
+            return False
+
+    def run(self, xls_data: bytes, engine: str, options: dict, timeout: float,
+            profile: bool = False, resume_hash: str = None) -> Tuple[bytes, dict]:
+        """
+        1件の変換をワーカーで実行（resume_hash 指定時はチェックポイントによる変換、対象外の場合は None）
+
+        Raises:
+            ワーカーで発生した変換エラー、WorkerCrashed、WorkerTimeout
+        """
+        directory = _temp_dir()
+        fd, input_path = tempfile.mkstemp(prefix='xls2xlsx-in-', dir=directory)
+        output_path = input_path.replace('xls2xlsx-in-', 'xls2xlsx-out-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(xls_data)
+            try:
+                self._wait_ready()
+                if resume_hash:
+                    self._conn.send(('resume', input_path, output_path, resume_hash, options))
+                else:
+                    self._conn.send(('convert', input_path, output_path, engine, options, profile))
+                reply = self._receive(timeout)
+            except WorkerTimeout:
+                self.kill()
+                raise
+            self.jobs += 1
+            self.last_used = time.monotonic()
+            status, payload, self.rss = reply
+            if status == 'error':
+                raise payload
+            if payload is None:
+                return None
+            with open(output_path, 'rb') as f:
+                return f.read(), payload
+        finally:
+            for path in (input_path, output_path):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def kill(self):
+        """ワーカーを強制終了"""
+        self._process.kill()
+        self._process.wait(5)
+
+    def stop(self):
+        """ワーカーを停止（応答が無い場合は強制終了）"""
+        try:
+            self._conn.send(('stop',))
+        except (OSError, ValueError):
+            pass
+        try:
+            self._process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        self._conn.close()
+
+
+def _worker_main(conn: Connection):
+    """
+    ワーカープロセスのメインループ
+
+    起動時にウォームアップ（変換モジュールの import と初回実行）を行い、
+    親プロセスからの変換要求を1件ずつ処理する
+    """
+    from warmup_utils import warm_up
+    try:
+        warm_up(include_storage=False)
+    except Exception as e:
+        logging.warning(f"変換ワーカーのウォームアップエラー（無視可能）: {str(e)}")
+    _limit_address_space()
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    conn.send(('ready', current_rss()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'stop':
+            return
+        if message[0] == 'ping':
+            conn.send(('pong', current_rss()))
+            continue
+
+        if message[0] == 'resume':
+            _, input_path, output_path, resume_hash, options = message
+            engine, profile = None, False
+        else:
+            _, input_path, output_path, engine, options, profile = message
+            resume_hash = None
+        try:
+            with open(input_path, 'rb') as f:
+                xls_data = f.read()
+            profiler = SamplingProfiler() if profile else None
+            baseline = current_rss()
+            track_peak = reset_peak_rss()
+            with _CpuTimeLimit(), profiler or nullcontext():
+                if resume_hash:
+                    result = checkpoint.convert_resumable(xls_data, resume_hash, **options)
+                else:
+                    result = convert_xls_to_xlsx_with_stats(xls_data, engine, **options)
+            del xls_data
+            if result is None:
+                # チェックポイントの対象外（シート数が下限未満）
+                reply = ('ok', None, current_rss())
+            else:
+                output, stats = result
+                result = None
+                if profiler is not None:
+                    stats.update(profile=profiler.collapsed(), profile_samples=profiler.samples)
+                peak = peak_rss() if track_peak else None
+                if peak is not None:
+                    stats['peak_memory'] = max(0, peak - baseline)
+                with open(output_path, 'wb') as f:
+                    f.write(output)
+                del output
+                reply = ('ok', stats, current_rss())
+        except MemoryError:
+            xls_data = output = result = None
+            reply = ('error', MemoryLimitExceeded(
+                f"変換に必要なメモリが上限（{get_max_memory() // (1024 * 1024)}MB）を超えました"
+            ), current_rss())
+        except Exception as e:
+            reply = ('error', e, current_rss())
+        try:
+            conn.send(reply)
+        except Exception:
+            # 例外オブジェクトを pickle できない場合はメッセージのみ返す
+            conn.send(('error', RuntimeError(str(reply[1])), reply[2]))
+
+
+def _limit_address_space():
+    """
+    ワーカーのアドレス空間を「現在の使用量 + SANDBOX_MAX_MEMORY_MB」に制限
+
+    超過した割り当ては MemoryError になる（ハード上限は変更しない）
+    """
+    import resource
+
+    limit = get_max_memory()
+    if not limit:
+        return
+    try:
+        with open('/proc/self/statm') as f:
+            address_space = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        soft = address_space + limit
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+    except (OSError, ValueError, IndexError) as e:
+        logging.warning(f"変換ワーカーのメモリ上限を設定できません: {str(e)}")
+
+
+class _CpuTimeLimit:
+    """
+    変換1件の CPU 時間を制限するコンテキストマネージャー
+
+    RLIMIT_CPU のソフト上限を「これまでの CPU 時間 + SANDBOX_MAX_CPU_SECONDS」に設定し、
+    超過時の SIGXCPU で CpuLimitExceeded を送出する。ハード上限は変更しない
+    （引き下げたハード上限は戻せないため、ワーカーを使い続けられなくなる）
+
+    中断された処理の後始末（ライブラリの close 等）で別の例外に置き換わった場合も、
+    上限超過として CpuLimitExceeded を送出する
+    """
+
+    def __enter__(self):
+        import resource
+
+        global _cpu_limit_exceeded
+        _cpu_limit_exceeded = False
+        limit = get_max_cpu_seconds()
+        if limit:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            soft = int(usage.ru_utime + usage.ru_stime) + 1 + limit
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import resource
+
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        if _cpu_limit_exceeded and exc_value is not None and not isinstance(exc_value, CpuLimitExceeded):
+            raise _cpu_limit_error() from exc_value
+        return False
+
+
+# 実行中の変換で SIGXCPU を受信した
+_cpu_limit_exceeded = False
+
+
+def _cpu_limit_error() -> CpuLimitExceeded:
+    """CPU 時間の上限超過の例外を作成"""
+    return CpuLimitExceeded(f"変換の CPU 時間が上限（{get_max_cpu_seconds()}秒）を超えました")
+
+
+def _on_cpu_limit(signum, frame):
+    """SIGXCPU のハンドラー（変換を中断する）"""
+    import resource
+
+    global _cpu_limit_exceeded
+    _cpu_limit_exceeded = True
+    # 処理中に SIGXCPU が繰り返し届かないよう、ソフト上限を先に解除する
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+    raise _cpu_limit_error()
+
+
+if __name__ == '__main__':
+    # "python -m worker_pool <ソケットのファイル記述子>" で起動されたワーカープロセス
+    import worker_pool
+    worker_pool._worker_main(Connection(int(sys.argv[1])))
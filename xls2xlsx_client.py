@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+変換APIのクライアント（標準ライブラリのみ、Functions のコードに依存しない）
+
+入力XLSの SHA-256 を mmap で計算して事前確認API（POST /api/probe）に問い合わせ、
+変換済みの場合はアップロードせずに変換結果を取得する。変換済みでない場合のみ convert_http に
+ファイルをストリーミングでアップロードする。10MB以上の変換結果（JSON の download_url）は
+Blob Storage からストリーミングでダウンロードする
+
+使い方:
+    python xls2xlsx_client.py report.xls [--url http://localhost:7071] [--key <Function Key>]
+    python xls2xlsx_client.py report.xls --sheets Sheet1 --rows 1-1000 --format parquet -o report.zip
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import mmap
+import os
+import sys
+from urllib.parse import quote, urlencode, urlsplit
+
+DEFAULT_URL = 'http://localhost:7071'
+PROBE_PATH = '/api/probe'
+CONVERT_PATH = '/api/convert_http'
+
+# ダウンロード・アップロードの転送単位
+CHUNK_SIZE = 1024 * 1024
+
+
+class ConversionRequestError(Exception):
+    """変換API がエラーを返した"""
+
+    def __init__(self, message: str, status_code: int, failure_class: str = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.failure_class = failure_class
+
+
+def hash_file(path: str) -> str:
+    """
+    ファイルの SHA-256（16進文字列）を計算（ファイルを読み込まずに mmap で参照する）
+
+    Args:
+        path: ファイルのパス
+
+    Returns:
+        SHA-256（サーバーの入力ハッシュと同じ値）
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        # 空のファイルは mmap できない
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest.update(mapped)
+    return digest.hexdigest()
+
+
+def build_query(sheets: str = None, rows: str = None, raw: bool = False, schema: str = None,
+                output_format: str = None) -> dict:
+    """
+    変換オプションをクエリパラメータにする（probe と convert_http で同じ値を送る）
+
+    Args:
+        sheets: 変換するシート（カンマ区切りのシート名または1始まりのシート番号。例: "Sales,3"）
+        rows: 変換する行範囲（例: "1-1000"）
+        raw: ヘッダー推定なしの raw モード
+        schema: スキーマヒント
+        output_format: 出力形式（xlsx / csv / parquet / arrow）
+
+    Returns:
+        クエリパラメータ
+    """
+    query = {'sheets': sheets, 'rows': rows, 'schema': schema, 'format': output_format}
+    if raw:
+        query['raw'] = 'true'
+    return {name: value for name, value in query.items() if value}
+
+
+def default_output_path(path: str, output_format: str = None) -> str:
+    """入力と同じディレクトリの出力ファイル名（サーバーの出力ファイル名と同じ規則）"""
+    stem = path[:-4] if path.lower().endswith('.xls') else path
+    if not output_format or output_format == 'xlsx':
+        return f"{stem}.xlsx"
+    return f"{stem}.{output_format}.zip"
+
+
+class _Connection:
+    """URL ごとの HTTP 接続"""
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=timeout, blocksize=CHUNK_SIZE)
+        self.path = parts.path or '/'
+        self.query = parts.query
+
+    def request(self, method: str, path: str = None, query: dict = None, body=None, headers: dict = None):
+        target = path if path is not None else self.path
+        params = '&'.join(part for part in (self.query, urlencode(query or {})) if part)
+        if params:
+            target = f"{target}?{params}"
+        self.connection.request(method, target, body=body, headers=headers or {})
+        return self.connection.getresponse()
+
+    def close(self):
+        self.connection.close()
+
+
+def _raise_for_error(response):
+    """エラー応答を ConversionRequestError にする"""
+    message = response.read().decode('utf-8', 'replace')
+    raise ConversionRequestError(message, response.status, response.getheader('X-Failure-Class'))
+
+
+def _write_body(response, output_path: str) -> int:
+    """応答ボディをストリーミングでファイルに書き出し、書き出したバイト数を返す"""
+    written = 0
+    with open(output_path, 'wb') as f:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def _download(url: str, output_path: str, timeout: float) -> int:
+    """SAS付きダウンロードURLから変換結果をストリーミングでダウンロード"""
+    connection = _Connection(url, timeout)
+    try:
+        response = connection.request('GET')
+        if response.status != 200:
+            _raise_for_error(response)
+        return _write_body(response, output_path)
+    finally:
+        connection.close()
+
+
+def _save_result(response, output_path: str, timeout: float) -> dict:
+    """
+    変換結果の応答（ファイル、または download_url の JSON）を保存
+
+    Returns:
+        {'output_path', 'bytes', 'content_sha256'}
+    """
+    content_sha256 = (response.getheader('ETag') or '').strip('"') or None
+    if response.getheader('Content-Type', '').startswith('application/json'):
+        result = json.loads(response.read())
+        size = _download(result['download_url'], output_path, timeout)
+        content_sha256 = result.get('content_sha256') or content_sha256
+    else:
+        size = _write_body(response, output_path)
+    return {'output_path': output_path, 'bytes': size, 'content_sha256': content_sha256}
+
+
+def convert_file(path: str, base_url: str = DEFAULT_URL, output_path: str = None, function_key: str = None,
+                 timeout: float = 600, **options) -> dict:
+    """
+    事前確認してから XLS を変換し、結果をファイルに保存
+
+    Args:
+        path: 入力XLSのパス
+        base_url: Functions のURL（例: https://<app>.azurewebsites.net）
+        output_path: 出力ファイルのパス（省略時は入力と同じディレクトリ）
+        function_key: Function Key（x-functions-key ヘッダー）
+        timeout: 1リクエストのタイムアウト（秒）
+        **options: 変換オプション（build_query を参照）
+
+    Returns:
+        {'probe': 'hit' / 'miss', 'input_sha256', 'output_path', 'bytes', 'content_sha256'}
+
+    Raises:
+        ConversionRequestError: 変換API がエラーを返した
+    """
+    input_hash = hash_file(path)
+    query = build_query(**options)
+    output_path = output_path or default_output_path(path, options.get('output_format'))
+    # HTTP ヘッダーは Latin-1 のため、ファイル名はパーセントエンコードして送る（サーバーでデコード）
+    headers = {'X-Filename': quote(os.path.basename(path))}
+    if function_key:
+        headers['x-functions-key'] = function_key
+
+    connection = _Connection(base_url, timeout)
+    try:
+        response = connection.request('POST', PROBE_PATH, dict(query, sha256=input_hash), headers=headers)
+        if response.status != 200:
+            _raise_for_error(response)
+        if response.getheader('X-Probe') == 'hit':
+            return {'probe': 'hit', 'input_sha256': input_hash, **_save_result(response, output_path, timeout)}
+        response.read()
+
+        # 変換済みでない場合のみファイルをアップロード（読み込みながら送信する）
+        with open(path, 'rb') as f:
+            upload_headers = {
+                **headers,
+                'Content-Type': 'application/octet-stream',
+                'Content-Length': str(os.fstat(f.fileno()).st_size),
+            }
+            response = connection.request('POST', CONVERT_PATH, query, body=f, headers=upload_headers)
+        if response.status != 200:
+            _raise_for_error(response)
+        return {'probe': 'miss', 'input_sha256': input_hash, **_save_result(response, output_path, timeout)}
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='XLS→XLSX 変換APIのクライアント（変換済みの入力はアップロードしない）')
+    parser.add_argument('path', help='入力XLSのパス')
+    parser.add_argument('-o', '--output', help='出力ファイルのパス')
+    parser.add_argument('--url', default=os.environ.get('XLS2XLSX_URL', DEFAULT_URL), help='Functions のURL')
+    parser.add_argument('--key', default=os.environ.get('XLS2XLSX_FUNCTION_KEY'), help='Function Key')
+    parser.add_argument('--sheets', help='変換するシート（シート名または1始まりのシート番号。例: Sales,3）')
+    parser.add_argument('--rows', help='変換する行範囲（例: 1-1000）')
+    parser.add_argument('--raw', action='store_true', help='ヘッダー推定なしの raw モード')
+    parser.add_argument('--schema', help='スキーマヒント')
+    parser.add_argument('--format', dest='output_format', choices=['xlsx', 'csv', 'parquet', 'arrow'],
+                        help='出力形式')
+    parser.add_argument('--timeout', type=float, default=600, help='1リクエストのタイムアウト（秒）')
+    args = parser.parse_args()
+
+    try:
+        result = convert_file(args.path, args.url, args.output, args.key, args.timeout, sheets=args.sheets,
+                              rows=args.rows, raw=args.raw, schema=args.schema, output_format=args.output_format)
+    except ConversionRequestError as e:
+        print(f"❌ 変換エラー（{e.status_code}{f', {e.failure_class}' if e.failure_class else ''}）: {e}")
+        return 1
+    action = '変換済みの結果を取得' if result['probe'] == 'hit' else 'アップロードして変換'
+    print(f"✅ {action}: {result['output_path']}（{result['bytes']:,} バイト）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
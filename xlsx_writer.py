@@ -0,0 +1,428 @@
+"""
+中間表現（sheet_model）から XLSX を直接書き出すモジュール
+行順にセルを走査し、非空セルのみをワークシート XML にストリーム出力する
+"""
+import io
+import os
+import re
+import time
+import zipfile
+from datetime import datetime
+from typing import List
+from xml.sax.saxutils import escape, quoteattr
+
+from sheet_model import (
+    KIND_BOOL,
+    KIND_DATE,
+    KIND_ERROR,
+    KIND_NUMBER,
+    KIND_TEXT,
+    SharedStrings,
+    SparseSheet,
+)
+
+# Excel のシート名上限
+MAX_SHEET_NAME_LENGTH = 31
+
+# スタイルインデックス（styles.xml の cellXfs と対応）
+STYLE_DATE = 1       # numFmtId 14: 日付
+STYLE_DATETIME = 2   # numFmtId 22: 日付 + 時刻
+
+# XLS のエラーコード → 表示文字列
+ERROR_TEXTS = {
+    0x00: '#NULL!',
+    0x07: '#DIV/0!',
+    0x0F: '#VALUE!',
+    0x17: '#REF!',
+    0x1D: '#NAME?',
+    0x24: '#NUM!',
+    0x2A: '#N/A',
+}
+
+# 決定的な出力で ZIP エントリ・docProps/core.xml に記録する日時（ZIP 形式で表せる最小の日時）
+FIXED_TIMESTAMP = datetime(1980, 1, 1)
+
+# ZIP エントリのファイル属性（作成 OS を Unix、権限を 0600 に固定）
+_ZIP_CREATE_SYSTEM = 3
+_ZIP_EXTERNAL_ATTR = 0o600 << 16
+
+# docProps/core.xml の作成・更新日時（openpyxl が書き込む値を置き換える）
+_CORE_TIMESTAMPS = re.compile(r'(<dcterms:(created|modified)\b[^>]*>)[^<]*(</dcterms:\2>)')
+
+# XML 1.0 で使用できない制御文字（OOXML の _xHHHH_ 形式でエスケープする）
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_CONTENT_TYPES_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '<Override PartName="/docProps/app.xml" ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+    '<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/extended-properties" Target="docProps/app.xml"/>'
+    '</Relationships>'
+)
+
+_APP_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+    '<Application>xls2xlsx</Application>'
+    '</Properties>'
+)
+
+_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+# 列番号 → 列記号のキャッシュ（XLS の列上限は 256）
+_COLUMN_LETTERS: List[str] = []
+
+
+def column_letter(col: int) -> str:
+    """
+    0始まりの列番号を列記号（A, B, ..., AA）に変換
+    """
+    while len(_COLUMN_LETTERS) <= col:
+        n = len(_COLUMN_LETTERS) + 1
+        letters = ''
+        while n:
+            n, rem = divmod(n - 1, 26)
+            letters = chr(65 + rem) + letters
+        _COLUMN_LETTERS.append(letters)
+    return _COLUMN_LETTERS[col]
+
+
+def xml_text(value: str) -> str:
+    """
+    文字列を XML テキストとしてエスケープ（不正な制御文字は _xHHHH_ 形式）
+    """
+    value = escape(value)
+    if _ILLEGAL_XML_CHARS.search(value):
+        value = _ILLEGAL_XML_CHARS.sub(lambda m: '_x%04X_' % ord(m.group()), value)
+    return value
+
+
+def format_number(value: float) -> str:
+    """
+    数値を XML 用の文字列に変換（整数値は小数点なし）
+    """
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def sheet_xml_name(index: int) -> str:
+    """
+    ワークシートパーツのパス名を返す（1始まり）
+    """
+    return f'xl/worksheets/sheet{index}.xml'
+
+
+def unique_sheet_names(sheets: List[SparseSheet]) -> List[str]:
+    """
+    Excel の制限（31文字、大文字小文字を区別しない一意性）に合わせたシート名一覧を返す
+    """
+    return dedupe_sheet_names([sheet.name for sheet in sheets])
+
+
+def dedupe_sheet_names(sheet_names: List[str]) -> List[str]:
+    """
+    シート名の一覧を Excel の制限に合わせて切り詰め・重複除去する
+    """
+    names = []
+    seen = set()
+    for sheet_name in sheet_names:
+        base = sheet_name[:MAX_SHEET_NAME_LENGTH] or 'Sheet'
+        name = base
+        suffix = 1
+        while name.lower() in seen:
+            suffix += 1
+            tail = f'_{suffix}'
+            name = base[:MAX_SHEET_NAME_LENGTH - len(tail)] + tail
+        seen.add(name.lower())
+        names.append(name)
+    return names
+
+
+def iter_sheet_xml(sheet: SparseSheet):
+    """
+    ワークシート XML を行単位の文字列チャンクとして返す
+
+    Args:
+        sheet: 中間表現のシート
+
+    Yields:
+        XML 文字列チャンク
+    """
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    )
+    if sheet.nrows and sheet.ncols:
+        yield f'<dimension ref="A1:{column_letter(sheet.ncols - 1)}{sheet.nrows}"/>'
+    yield '<sheetData>'
+    for row, cells in sheet.iter_rows():
+        r = row + 1
+        parts = [f'<row r="{r}">']
+        for col, kind, value in cells:
+            ref = f'{column_letter(col)}{r}'
+            if kind == KIND_NUMBER:
+                parts.append(f'<c r="{ref}"><v>{format_number(value)}</v></c>')
+            elif kind == KIND_TEXT:
+                parts.append(f'<c r="{ref}" t="s"><v>{value}</v></c>')
+            elif kind == KIND_BOOL:
+                parts.append(f'<c r="{ref}" t="b"><v>{1 if value else 0}</v></c>')
+            elif kind == KIND_DATE:
+                style = STYLE_DATE if value.is_integer() else STYLE_DATETIME
+                parts.append(f'<c r="{ref}" s="{style}"><v>{format_number(value)}</v></c>')
+            elif kind == KIND_ERROR:
+                text = ERROR_TEXTS.get(int(value), '#N/A')
+                parts.append(f'<c r="{ref}" t="e"><v>{text}</v></c>')
+        parts.append('</row>')
+        yield ''.join(parts)
+    yield '</sheetData></worksheet>'
+
+
+def iter_shared_strings_xml(sst: SharedStrings):
+    """
+    共有文字列テーブル XML を文字列チャンクとして返す
+    """
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'count="{sst.ref_count}" uniqueCount="{len(sst)}">'
+    )
+    for value in sst.strings:
+        if value != value.strip():
+            yield f'<si><t xml:space="preserve">{xml_text(value)}</t></si>'
+        else:
+            yield f'<si><t>{xml_text(value)}</t></si>'
+    yield '</sst>'
+
+
+def workbook_xml(sheet_names: List[str], datemode: int = 0) -> str:
+    """
+    workbook.xml を生成
+    """
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    ]
+    if datemode == 1:
+        parts.append('<workbookPr date1904="1"/>')
+    parts.append('<sheets>')
+    for index, name in enumerate(sheet_names, start=1):
+        parts.append(f'<sheet name={quoteattr(name)} sheetId="{index}" r:id="rId{index}"/>')
+    parts.append('</sheets></workbook>')
+    return ''.join(parts)
+
+
+def workbook_rels_xml(sheet_count: int) -> str:
+    """
+    xl/_rels/workbook.xml.rels を生成
+    """
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    ]
+    for index in range(1, sheet_count + 1):
+        parts.append(
+            f'<Relationship Id="rId{index}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{index}.xml"/>'
+        )
+    parts.append(
+        f'<Relationship Id="rId{sheet_count + 1}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        f'<Relationship Id="rId{sheet_count + 2}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+        'Target="sharedStrings.xml"/>'
+        '</Relationships>'
+    )
+    return ''.join(parts)
+
+
+def content_types_xml(sheet_count: int) -> str:
+    """
+    [Content_Types].xml を生成
+    """
+    parts = [_CONTENT_TYPES_HEAD]
+    for index in range(1, sheet_count + 1):
+        parts.append(
+            f'<Override PartName="/{sheet_xml_name(index)}" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        )
+    parts.append('</Types>')
+    return ''.join(parts)
+
+
+def is_deterministic() -> bool:
+    """
+    決定的な出力（DETERMINISTIC_OUTPUT、既定: 有効）か
+
+    有効な場合は ZIP エントリの日時・属性と docProps/core.xml の作成・更新日時を固定し、
+    同じ入力・変換オプション・ENGINE_VERSION から常に同じバイト列を書き出す
+    """
+    return os.environ.get('DETERMINISTIC_OUTPUT', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+
+def package_timestamp() -> datetime:
+    """docProps/core.xml に記録する日時（決定的な出力では FIXED_TIMESTAMP、それ以外は現在時刻（UTC））"""
+    return FIXED_TIMESTAMP if is_deterministic() else datetime.utcnow()
+
+
+def zip_entry(name: str, compress_type: int = zipfile.ZIP_DEFLATED) -> zipfile.ZipInfo:
+    """
+    ZIP エントリの情報を作成（決定的な出力では日時・属性を固定）
+
+    Args:
+        name: エントリ名
+        compress_type: 圧縮方式
+
+    Returns:
+        ZipFile.writestr / ZipFile.open に渡す ZipInfo
+    """
+    date_time = FIXED_TIMESTAMP.timetuple()[:6] if is_deterministic() else time.localtime()[:6]
+    info = zipfile.ZipInfo(name, date_time=date_time)
+    info.compress_type = compress_type
+    info.create_system = _ZIP_CREATE_SYSTEM
+    info.external_attr = _ZIP_EXTERNAL_ATTR
+    return info
+
+
+def normalize_package(data: bytes) -> bytes:
+    """
+    他のライブラリ（openpyxl）が書き出した XLSX を決定的な形に書き直す
+
+    [Content_Types].xml を先頭に、他のパーツをパス名順に並べ、ZIP エントリの日時・属性と
+    docProps/core.xml の作成・更新日時を固定する（パーツの内容は変更しない）
+
+    Args:
+        data: XLSXファイルのバイナリデータ
+
+    Returns:
+        書き直した XLSXファイルのバイナリデータ
+    """
+    stamp = FIXED_TIMESTAMP.strftime('%Y-%m-%dT%H:%M:%SZ')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, \
+            zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        names = sorted(source.namelist(), key=lambda name: (name != '[Content_Types].xml', name))
+        for name in names:
+            part = source.read(name)
+            if name == 'docProps/core.xml':
+                text = _CORE_TIMESTAMPS.sub(lambda m: f'{m.group(1)}{stamp}{m.group(3)}', part.decode('utf-8'))
+                part = text.encode('utf-8')
+            zf.writestr(zip_entry(name), part)
+    return buffer.getvalue()
+
+
+def core_xml(created: datetime) -> str:
+    """
+    docProps/core.xml を生成
+    """
+    stamp = created.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<cp:coreProperties '
+        'xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:dcterms="http://purl.org/dc/terms/" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        '<dc:creator>xls2xlsx</dc:creator>'
+        f'<dcterms:created xsi:type="dcterms:W3CDTF">{stamp}</dcterms:created>'
+        f'<dcterms:modified xsi:type="dcterms:W3CDTF">{stamp}</dcterms:modified>'
+        '</cp:coreProperties>'
+    )
+
+
+def _write_part(zf: zipfile.ZipFile, name: str, chunks) -> None:
+    """
+    文字列チャンクを UTF-8 で ZIP エントリに書き込む（bytes のチャンクはそのまま書き込む）
+    """
+    if isinstance(chunks, str):
+        zf.writestr(zip_entry(name), chunks.encode('utf-8'))
+        return
+    with zf.open(zip_entry(name), 'w') as entry:
+        writer = io.BufferedWriter(entry, buffer_size=256 * 1024)
+        for chunk in chunks:
+            writer.write(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+        writer.flush()
+
+
+def write_xlsx(sheets: List[SparseSheet], sst: SharedStrings, datemode: int = 0) -> bytes:
+    """
+    中間表現のシート一覧を XLSX バイナリに書き出す
+
+    Args:
+        sheets: シート一覧
+        sst: 共有文字列テーブル
+        datemode: 日付モード（0: 1900年, 1: 1904年）
+
+    Returns:
+        XLSXファイルのバイナリデータ
+    """
+    return assemble_xlsx(
+        [sheet.name for sheet in sheets],
+        (iter_sheet_xml(sheet) for sheet in sheets),
+        sst,
+        datemode,
+    )
+
+
+def assemble_xlsx(sheet_names: List[str], sheet_parts, sst: SharedStrings, datemode: int = 0) -> bytes:
+    """
+    ワークシートパーツ（XML チャンク）と共有文字列テーブルから XLSX を組み立てる
+
+    ワークシートパーツはシート順に1つずつ取り出して書き込むため、
+    保存済みのパーツ（checkpoint）を逐次読み込んで渡すこともできる。
+    パーツは常に同じ順序で書き込み、決定的な出力（is_deterministic）では日時も固定する
+
+    Args:
+        sheet_names: シート名一覧（重複除去前）
+        sheet_parts: シートごとのワークシート XML（文字列・bytes のチャンクの反復可能オブジェクト）
+        sst: 共有文字列テーブル
+        datemode: 日付モード（0: 1900年, 1: 1904年）
+
+    Returns:
+        XLSXファイルのバイナリデータ
+    """
+    names = dedupe_sheet_names(sheet_names)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        _write_part(zf, '[Content_Types].xml', content_types_xml(len(names)))
+        _write_part(zf, '_rels/.rels', _ROOT_RELS)
+        _write_part(zf, 'docProps/app.xml', _APP_XML)
+        _write_part(zf, 'docProps/core.xml', core_xml(package_timestamp()))
+        _write_part(zf, 'xl/workbook.xml', workbook_xml(names, datemode))
+        _write_part(zf, 'xl/_rels/workbook.xml.rels', workbook_rels_xml(len(names)))
+        _write_part(zf, 'xl/styles.xml', _STYLES_XML)
+        for index, chunks in enumerate(sheet_parts, start=1):
+            _write_part(zf, sheet_xml_name(index), chunks)
+        _write_part(zf, 'xl/sharedStrings.xml', iter_shared_strings_xml(sst))
+    return buffer.getvalue()